@@ -0,0 +1,314 @@
+"""
+asyncio execution of the wait loops.
+
+The blocking wait_for_* loops hold a thread in time.sleep() for as long as
+a controller takes to disable HA, reboot or become healthy. Here the same
+waits are coroutines on one event loop:
+
+- with aiohttp each AsyncController has its own aiohttp session (own
+  cookies and connections), so the waits never share a session with an
+  upload
+- waits sleep with asyncio.sleep(), are cancelled cleanly and take a
+  timeout instead of prompting the operator
+- run_wait() runs every wait of the process on one event loop in a
+  background thread, so waits started by concurrent task graph tasks
+  share that loop instead of each starting its own
+
+Without aiohttp the coroutines run the blocking helpers from ha_functions
+(on the pooled controller sessions) on the loop's default executor, one
+short call at a time.
+"""
+
+import ssl
+import time
+import asyncio
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from ha_functions import (
+    session_pool, login, ha_status, ha_healthy, update_status, ReachabilityProbe, UpdatePollingStrategy,
+    load_upgrade_history, record_upgrade_history, PROBE_DOWN, PROBE_PORT_OPEN, PROBE_API_READY,
+    HA_WATCH_INTERVAL, PROBE_CONNECT_TIMEOUT, PROBE_RESPONSE_TIMEOUT
+)
+from http_metrics import request_metrics
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+# StreamWriter.start_tls() arrived in Python 3.11; without it HTTPS probes run the blocking probe
+HAS_START_TLS = hasattr(asyncio.StreamWriter, 'start_tls')
+
+# Give up on a version update after this long, like the blocking monitor's first prompt
+VERSION_UPDATE_TIMEOUT = 2700
+
+
+def _insecure_context():
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class AsyncController:
+    """Async access to one controller. Use as an async context manager."""
+
+    def __init__(self, base_url, username=None, password=None, probe_timeout=PROBE_CONNECT_TIMEOUT,
+                 probe_response_timeout=PROBE_RESPONSE_TIMEOUT):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.probe_timeout = probe_timeout
+        self.probe_response_timeout = probe_response_timeout
+        self._authenticated = False
+        self._session = None
+        parts = urlsplit(base_url)
+        self._host = parts.hostname
+        self._tls = parts.scheme == 'https'
+        self._port = parts.port or (443 if self._tls else 80)
+        self._context = _insecure_context()
+
+    async def __aenter__(self):
+        if HAS_AIOHTTP:
+            self._session = aiohttp.ClientSession(
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                connector=aiohttp.TCPConnector(ssl=False)
+            )
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    async def _blocking(func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _request(self, method, path, timeout=30, **kwargs):
+        """(status, parsed JSON or None), or (None, None) when the controller does not answer"""
+        url = f"{self.base_url}{path}"
+        started = time.perf_counter()
+        try:
+            async with self._session.request(method, url, timeout=aiohttp.ClientTimeout(total=timeout, connect=3),
+                                             **kwargs) as response:
+                if response.status == 401:
+                    self._authenticated = False
+                text = await response.text()
+                request_metrics.record(method, url, response.status, time.perf_counter() - started,
+                                       bytes_in=len(text.encode()))
+                if response.status != 200 or not text.strip():
+                    return response.status, None
+                try:
+                    return response.status, await response.json(content_type=None)
+                except ValueError:
+                    return response.status, None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            request_metrics.record(method, url, type(e).__name__, time.perf_counter() - started)
+            return None, None
+
+    def is_authenticated(self):
+        if not self._session:
+            return session_pool.is_authenticated(self.base_url)
+        return self._authenticated
+
+    async def login(self):
+        if not self._session:
+            return await self._blocking(login, self.base_url, self.username, self.password)
+        status, _ = await self._request('POST', '/mgmt/system/user/login',
+                                        json={"username": self.username, "password": self.password})
+        self._authenticated = status == 200
+        print("✅ Login successful" if self._authenticated else f"❌ Login failed with status code: {status}")
+        return self._authenticated
+
+    async def ha_status(self):
+        if not self._session:
+            return await self._blocking(ha_status, self.base_url)
+        return (await self._request('GET', '/mgmt/cybercontroller/ha/status'))[1]
+
+    async def update_status(self):
+        """Same answers as ha_functions.update_status()"""
+        if not self._session:
+            return await self._blocking(update_status, self.base_url)
+        status, data = await self._request('GET', '/mgmt/system/config/item/settingsbaseparams')
+        if data is not None or status == 401:
+            return data
+        status, data = await self._request('GET', '/mgmt/system/status', timeout=20)
+        if data is not None:
+            return {"lastUpgradeStatus": "In Progress", "software_version": data.get("version", "Unknown")}
+        return None
+
+    async def probe(self, path='/mgmt/system/user/accessibility'):
+        """Async version of ReachabilityProbe.probe()"""
+        if self._tls and not HAS_START_TLS:
+            return await self._blocking(ReachabilityProbe(self.base_url, self.probe_timeout, path,
+                                                          self.probe_response_timeout).probe)
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self._host, self._port),
+                                                    self.probe_timeout)
+        except (OSError, asyncio.TimeoutError):
+            return PROBE_DOWN
+        try:
+            if self._tls:
+                await asyncio.wait_for(writer.start_tls(self._context, server_hostname=self._host),
+                                       self.probe_response_timeout)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {self._host}\r\nConnection: close\r\n\r\n".encode())
+            status_line = (await asyncio.wait_for(reader.readline(), self.probe_response_timeout)).split()
+            if len(status_line) >= 2 and status_line[0].startswith(b'HTTP/') and int(status_line[1]) < 500:
+                return PROBE_API_READY
+            return PROBE_PORT_OPEN
+        except (OSError, ValueError, asyncio.TimeoutError):
+            return PROBE_PORT_OPEN
+        finally:
+            writer.close()
+
+
+async def wait_for_ha_state(controller, predicate, description, interval=HA_WATCH_INTERVAL, timeout=None):
+    """Poll the HA status until predicate(status) holds and return it; raises asyncio.TimeoutError"""
+    async def poll():
+        started = time.monotonic()
+        while True:
+            status = await controller.ha_status()
+            if predicate(status):
+                return status
+            elapsed = int(time.monotonic() - started)
+            state = status.get('haStatus', 'unknown') if status else 'no answer'
+            print(f"\r⏳ {controller.base_url}: HA {state} - waiting for {description}... "
+                  f"({elapsed//60:02d}:{elapsed%60:02d})", end='', flush=True)
+            await asyncio.sleep(interval)
+    return await asyncio.wait_for(poll(), timeout)
+
+
+async def wait_for_ha_disable_async(controller, timeout=None):
+    status = await wait_for_ha_state(controller, lambda s: bool(s) and s.get('haStatus') == 'disabled',
+                                     'HA to be disabled', timeout=timeout)
+    print(f"\n✅ HA is now disabled on {controller.base_url}")
+    return status
+
+
+async def wait_for_ha_healthy_async(controller, timeout=None):
+    status = await wait_for_ha_state(controller, ha_healthy, 'both nodes to be healthy', timeout=timeout)
+    print(f"\n✅ HA is healthy on both nodes! Primary: {status.get('primaryHealth')} | "
+          f"Secondary: {status.get('secondaryHealth')}")
+    return status
+
+
+async def wait_for_version_update_async(controller, timeout=VERSION_UPDATE_TIMEOUT, image_sha256=None):
+    """
+    Coroutine version of wait_for_version_update(): probe first, poll the update status once
+    the API answers, log in again after the reboot, and poll on the UpdatePollingStrategy cadence.
+    Returns the same stats; on timeout they are returned with 'timed_out' instead of prompting.
+    """
+    previous = await controller.update_status()
+    current_version = previous.get('software_version') if previous else None
+    strategy = UpdatePollingStrategy(load_upgrade_history(), controller=controller.base_url)
+    # Only used to record and announce transitions, the probing itself is async
+    transitions = ReachabilityProbe(controller.base_url)
+    stats = {'controller': controller.base_url, 'completed': False, 'previous_version': current_version}
+    started = time.monotonic()
+    print(f"📊 Monitoring update of {controller.base_url} (starting version: {current_version})")
+
+    async def monitor():
+        down_at = up_at = None
+        failures = polls = 0
+        interval = 0
+        while True:
+            polls += 1
+            elapsed = time.monotonic() - started
+            reachability = transitions.check(await controller.probe())
+            polling = transitions.worth_polling(reachability)
+            result = await controller.update_status() if polling else None
+
+            if result is None:
+                failures += 1
+                if down_at is None:
+                    down_at = elapsed
+                came_back = False
+                if polling and not controller.is_authenticated():
+                    came_back = await controller.login()
+                if came_back:
+                    interval = strategy.next_interval(elapsed, responding=True, came_back=True)
+                else:
+                    interval = strategy.next_interval(elapsed, responding=False, failures=failures,
+                                                      probing=not polling)
+                await asyncio.sleep(interval)
+                continue
+
+            failures = 0
+            if down_at is not None and up_at is None:
+                up_at = elapsed
+            upgrade_status = result.get('lastUpgradeStatus', 'In Progress')
+            new_version = result.get('software_version', current_version)
+            if upgrade_status == 'OK' and new_version != current_version:
+                stats.update({
+                    'completed': True,
+                    'new_version': new_version,
+                    'total': round(elapsed, 1),
+                    'down_at': round(down_at, 1) if down_at is not None else None,
+                    'up_at': round(up_at, 1) if up_at is not None else None,
+                    'detection_latency': round(interval, 1),
+                    'polls': polls,
+                    'reachability': transitions.transitions
+                })
+                print(f"\n✅ {controller.base_url} updated: {current_version} -> {new_version} "
+                      f"({int(elapsed)//60:02d}:{int(elapsed)%60:02d})")
+                record_upgrade_history({
+                    'controller': controller.base_url,
+                    'finished_at': datetime.now(timezone.utc).isoformat(),
+                    'total': stats['total'],
+                    'down_at': stats['down_at'],
+                    'up_at': stats['up_at'],
+                    'detection_latency': stats['detection_latency'],
+                    'new_version': new_version,
+                    'image_sha256': image_sha256
+                })
+                return stats
+            if upgrade_status == 'Failed':
+                print(f"\n❌ Update failed according to server status: {controller.base_url}")
+                stats['failed'] = True
+                return stats
+            interval = strategy.next_interval(elapsed, responding=True, came_back=up_at is not None)
+            await asyncio.sleep(interval)
+
+    try:
+        return await asyncio.wait_for(monitor(), timeout)
+    except asyncio.TimeoutError:
+        print(f"\n⏰ Update monitoring of {controller.base_url} timed out after {timeout}s - "
+              f"the update may still be in progress")
+        stats['timed_out'] = True
+        return stats
+
+
+# Event loop of all waits in this process, running in a daemon thread once the first wait starts
+_wait_loop = None
+_wait_loop_lock = threading.Lock()
+
+def _event_loop():
+    global _wait_loop
+    with _wait_loop_lock:
+        if _wait_loop is None:
+            _wait_loop = asyncio.new_event_loop()
+            threading.Thread(target=_wait_loop.run_forever, name='async-waits', daemon=True).start()
+        return _wait_loop
+
+
+def run_wait(base_url, username, password, wait, *args, **kwargs):
+    """
+    Run one wait coroutine (e.g. wait_for_ha_disable_async) for a controller on the shared
+    event loop and return its result. Callers in several threads wait concurrently on that
+    loop; a caller interrupted by Ctrl+C cancels its wait.
+    """
+    async def main():
+        async with AsyncController(base_url, username, password) as controller:
+            if username:
+                await controller.login()
+            return await wait(controller, *args, **kwargs)
+    future = asyncio.run_coroutine_threadsafe(main(), _event_loop())
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
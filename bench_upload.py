@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Loopback Upload Benchmark
+=========================
+Uploads a scratch image to a local stand-in controller (mock_controller.py)
+with each upload engine and reports wall time, throughput, client CPU time
+and peak client memory.
+
+    python bench_upload.py --size-mb 1024 --runs 3
+    python bench_upload.py --size-mb 1024 --runs 3 --tls
+
+Every run uses a fresh client process so CPU and peak RSS are per engine.
+Plain HTTP measures the sendfile() path; real controllers speak HTTPS, where
+the sendfile engine falls back to its reused buffer. --tls serves the
+stand-in controller over TLS with a throwaway self-signed certificate
+(made with the openssl command) to measure that path.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _self_signed_cert(directory):
+    """Write a throwaway certificate and key for 127.0.0.1 with the openssl command, returns the PEM path"""
+    if not shutil.which('openssl'):
+        raise SystemExit("❌ --tls needs the openssl command to create a test certificate")
+    pem = os.path.join(directory, 'bench.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-keyout', pem, '-out', pem],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return pem
+
+
+def run_worker(engine, url, upgrade_file):
+    """Upload once in this process and print the measurements as JSON"""
+    import ha_functions
+
+    bytes_size = os.path.getsize(upgrade_file)
+    upload_url = f"{url}/mgmt/system/config/action/software?type=full&filesize={bytes_size}"
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        ha_functions.login(url, 'bench', 'bench')
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        response = ha_functions._send_upload(upload_url, upgrade_file, bytes_size, 0, engine)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+    print(json.dumps({
+        'ok': response is not None and response.status_code == 200,
+        'wall': wall,
+        'cpu': cpu,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback benchmark for the upload engines")
+    parser.add_argument('--size-mb', type=int, default=512, help="scratch image size")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--engines', default='toolbelt,sendfile')
+    parser.add_argument('--tls', action='store_true', help="serve the stand-in controller over HTTPS")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return run_worker(args.worker, args.url, args.file)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as workdir, tempfile.NamedTemporaryFile(suffix='.tar.gz') as image:
+        command = [sys.executable, os.path.join(here, 'mock_controller.py'), '--port', str(port)]
+        if args.tls:
+            command += ['--certfile', _self_signed_cert(workdir)]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        url = f"{'https' if args.tls else 'http'}://127.0.0.1:{port}"
+
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            image.write(block)
+        image.flush()
+
+        # Give the server a moment to bind
+        for _ in range(50):
+            with contextlib.suppress(OSError), socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                break
+            time.sleep(0.1)
+
+        print(f"📊 Loopback upload benchmark - {args.size_mb} MB image, {args.runs} runs per engine, "
+              f"{'HTTPS' if args.tls else 'plain HTTP'}")
+        print(f"{'Engine':<10} {'Wall s':>8} {'MB/s':>8} {'CPU s':>8} {'Peak RSS MB':>12}")
+        try:
+            for engine in args.engines.split(','):
+                results = []
+                for _ in range(args.runs):
+                    out = subprocess.run([sys.executable, __file__, '--worker', engine, '--url', url, '--file', image.name],
+                                         capture_output=True, text=True, cwd=here)
+                    results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+                if not all(r['ok'] for r in results):
+                    print(f"{engine:<10} upload failed")
+                    continue
+                wall = sum(r['wall'] for r in results) / len(results)
+                cpu = sum(r['cpu'] for r in results) / len(results)
+                rss = max(r['max_rss_mb'] for r in results)
+                print(f"{engine:<10} {wall:>8.2f} {args.size_mb / wall:>8.1f} {cpu:>8.2f} {rss:>12.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Resume-Across-Restart Check
+===========================
+Checks that a resumable upload killed mid-transfer continues where the
+controller left off when the tool is started again, instead of sending the
+whole image a second time.
+
+A local stand-in controller (mock_controller.py) drops the first upload
+after half of the image. The uploading process is killed while it waits to
+retry, as if the operator's session died. A second process started in the
+same directory with the same checkpoint.json must resume the upload at the
+acknowledged offset and complete it with the right digest.
+
+    python check_resume.py --size-mb 64 --engine sendfile
+
+Exits with status 1 when the image was re-sent or the upload failed.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import subprocess
+
+from mock_controller import MockController
+
+
+def run_worker(url, upgrade_file, engine):
+    """Upload once through the main.py workflow, resuming from checkpoint.json when it has an entry"""
+    from main import build_config, load_progress, resume_point, stage_version_image
+
+    progress = load_progress()
+    resume_uploads = resume_point(progress)[1] if progress else None
+    inputs = {
+        'primary_address': 'unused', 'secondary_address': 'unused',
+        'primary_username': 'check', 'primary_password': 'check',
+        'secondary_username': 'check', 'secondary_password': 'check',
+        'upgrade_file': upgrade_file, 'file_size': os.path.getsize(upgrade_file)
+    }
+    config = build_config(inputs, {'resumable': True, 'upload_engine': engine, 'event_log': ''}, resume_uploads)
+    ok = stage_version_image(url, config, "secondary controller", phase=2)
+    print(json.dumps({'ok': bool(ok)}))
+
+
+def _start_worker(url, upgrade_file, engine, workdir):
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', '--url', url,
+                             '--file', upgrade_file, '--engine', engine],
+                            cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that resumable uploads survive a restart")
+    parser.add_argument('--size-mb', type=int, default=64, help="scratch image size")
+    parser.add_argument('--engine', default='sendfile', help="upload engine to check")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args.url, args.file, args.engine)
+        return True
+
+    size = args.size_mb * 1024 * 1024
+    cut = size // 2
+    controller = MockController(interrupt_after=cut)
+    url = controller.start()
+    with tempfile.TemporaryDirectory() as workdir:
+        upgrade_file = os.path.join(workdir, 'check-image.tar.gz')
+        digest = hashlib.sha256()
+        with open(upgrade_file, 'wb') as f:
+            for _ in range(args.size_mb):
+                block = os.urandom(1024 * 1024)
+                digest.update(block)
+                f.write(block)
+
+        print(f"🧪 Uploading {args.size_mb} MB with {args.engine}, link drops after {cut:,} bytes")
+        first = _start_worker(url, upgrade_file, args.engine, workdir)
+        deadline = time.time() + 120
+        while controller.interruptions == 0 and first.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        # Killed while it waits to retry, like a lost operator session
+        first.kill()
+        first.communicate()
+        print(f"💥 First run killed after the controller acknowledged {controller.received:,} bytes")
+
+        second = _start_worker(url, upgrade_file, args.engine, workdir)
+        output, _ = second.communicate(timeout=300)
+        controller.stop()
+
+    lines = output.strip().splitlines()
+    result = json.loads(lines[-1]) if lines and lines[-1].startswith('{') else {'ok': False}
+    checks = {
+        'first upload was interrupted': controller.interruptions == 1,
+        'restart completed the upload': result['ok'] and controller.received == size,
+        f"restart resumed at byte {cut:,}": controller.upload_starts == [0, cut],
+        'controller has the right SHA-256': controller.digest == digest.hexdigest()
+    }
+    for name, passed in checks.items():
+        print(f"{'✅' if passed else '❌'} {name}")
+    if not all(checks.values()):
+        print(f"Upload requests started at: {controller.upload_starts}")
+        print(output[-2000:])
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
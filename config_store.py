@@ -0,0 +1,131 @@
+"""
+Content-addressed store for exported DefenseFlow configurations.
+
+Every export is kept once under its SHA-256 digest:
+
+    df_configs/
+    ├── index.json                  # one entry per export: digest, controller, role, phase, time
+    ├── incoming/                   # exports being written
+    └── objects/ab/abcdef...zip     # archive contents, deduplicated by digest
+
+Identical exports share one archive, the index tells which controller
+produced which configuration in which phase, and old entries expire under
+a retention policy (age, while always keeping the newest few per
+controller). Archives no longer referenced by the index are deleted.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+DEFAULT_ROOT = 'df_configs'
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_KEEP_PER_CONTROLLER = 5
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, read in chunks"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class ConfigStore:
+    """Deduplicated archive of configuration exports with an index and retention"""
+
+    def __init__(self, root=DEFAULT_ROOT, retention_days=DEFAULT_RETENTION_DAYS,
+                 keep_per_controller=DEFAULT_KEEP_PER_CONTROLLER):
+        self.root = root
+        self.retention_days = retention_days
+        self.keep_per_controller = keep_per_controller
+        self.index_path = os.path.join(root, 'index.json')
+        self.incoming_dir = os.path.join(root, 'incoming')
+        self._lock = threading.Lock()
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _save_index(self, entries):
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp, self.index_path)
+
+    def object_path(self, digest, name=''):
+        """Where the archive with this digest is stored"""
+        suffix = os.path.splitext(name)[1] or '.zip'
+        return os.path.join(self.root, 'objects', digest[:2], f"{digest}{suffix}")
+
+    def add(self, path, controller, role=None, phase=None, name=None):
+        """
+        Move an exported file into the store and index it. An archive with the same
+        digest is reused and the new copy deleted. Returns the index entry.
+        """
+        name = name or os.path.basename(path)
+        digest = file_digest(path)
+        stored = self.object_path(digest, name)
+        entry = {
+            'digest': digest,
+            'path': stored,
+            'name': name,
+            'size': os.path.getsize(path),
+            'controller': controller,
+            'role': role,
+            'phase': phase,
+            'stored_at': datetime.now(timezone.utc).isoformat(),
+            'stored_ts': time.time()
+        }
+
+        with self._lock:
+            if os.path.exists(stored):
+                os.remove(path)
+                entry['deduplicated'] = True
+            else:
+                os.makedirs(os.path.dirname(stored), exist_ok=True)
+                os.replace(path, stored)
+            entries = self._load_index()
+            entries.append(entry)
+            self._save_index(entries)
+        return entry
+
+    def prune(self):
+        """
+        Drop index entries older than retention_days (keeping the newest
+        keep_per_controller per controller) and delete unreferenced archives.
+        Returns the number of archives deleted.
+        """
+        with self._lock:
+            entries = self._load_index()
+            cutoff = time.time() - self.retention_days * 86400 if self.retention_days is not None else None
+
+            kept = []
+            newest = {}
+            for entry in reversed(entries):
+                count = newest.get(entry.get('controller'), 0)
+                if count < self.keep_per_controller or cutoff is None or entry.get('stored_ts', 0) >= cutoff:
+                    kept.append(entry)
+                    newest[entry.get('controller')] = count + 1
+            kept.reverse()
+
+            referenced = {os.path.normpath(entry['path']) for entry in kept}
+            removed = 0
+            objects_dir = os.path.join(self.root, 'objects')
+            for directory, _, files in os.walk(objects_dir):
+                for filename in files:
+                    path = os.path.normpath(os.path.join(directory, filename))
+                    if path not in referenced:
+                        os.remove(path)
+                        removed += 1
+            self._save_index(kept)
+        return removed
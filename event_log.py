@@ -0,0 +1,133 @@
+"""
+Structured, append-only JSONL event stream of upgrade runs.
+
+Every line of upgrade_events.jsonl is one event of one run:
+
+    {"ts": "...", "run": "20261017T101500-3f2a", "event": "phase_end", "phase": 2,
+     "name": "update_secondary", "status": "completed", "duration": 1234.5,
+     "bytes_out": 5368709120, "bytes_in": 18230}
+
+- run_start / run_end: controllers, image, options; outcome and total time
+- phase_start / phase_end: phase number and name, status, duration and
+  the HTTP bytes sent and received during the phase
+- step: timed sub-steps such as upload, commit, reboot_down, reboot_up,
+  version_ready, ha_disabled, ha_healthy, config_export, config_import,
+  with the controller involved and the bytes they moved; version_ready
+  also carries the monitoring's detection_latency
+- task: task graph runs (--parallel), with their phase
+
+Events are written as they happen, so an interrupted run leaves a usable
+record. upgrade_report.py summarizes where the time went and compares runs.
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from http_metrics import request_metrics
+
+DEFAULT_EVENT_LOG = 'upgrade_events.jsonl'
+
+
+class EventLog:
+    """Appends the events of one run to a JSONL file; does nothing until start_run()"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.run_id = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    def start_run(self, path=DEFAULT_EVENT_LOG, **fields):
+        """Start a new run in the log at path and record its run_start event"""
+        self.path = path
+        self.run_id = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:4]}"
+        self._started = time.monotonic()
+        self.emit('run_start', **fields)
+        return self.run_id
+
+    def end_run(self, status, **fields):
+        """Record the run_end event with the run's outcome, total time and HTTP totals"""
+        if self._started is None:
+            return
+        self.emit('run_end', status=status, duration=round(time.monotonic() - self._started, 2),
+                  http=request_metrics.totals(), **fields)
+        self._started = None
+
+    def emit(self, event, **fields):
+        """Append one event"""
+        if not self.path:
+            return
+        record = {'ts': datetime.now(timezone.utc).isoformat(), 'run': self.run_id, 'event': event, **fields}
+        line = json.dumps(record, default=str)
+        with self._lock:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(line + '\n')
+            except OSError as e:
+                print(f"⚠️ Could not write event log: {e}")
+
+    @contextmanager
+    def phase(self, phase, name):
+        """Record phase_start, then phase_end with its status, duration and HTTP bytes"""
+        self.emit('phase_start', phase=phase, name=name)
+        before = request_metrics.totals()
+        started = time.monotonic()
+        status = 'failed'
+        try:
+            yield
+            status = 'completed'
+        except KeyboardInterrupt:
+            status = 'interrupted'
+            raise
+        finally:
+            after = request_metrics.totals()
+            self.emit('phase_end', phase=phase, name=name, status=status,
+                      duration=round(time.monotonic() - started, 2),
+                      bytes_out=after['bytes_out'] - before['bytes_out'],
+                      bytes_in=after['bytes_in'] - before['bytes_in'])
+
+    @contextmanager
+    def step(self, step, controller=None, **fields):
+        """
+        Time a sub-step and record it as a step event. The yielded dict can be
+        filled with more fields (e.g. bytes) while the step runs.
+        """
+        extra = dict(fields)
+        started = time.monotonic()
+        status = 'failed'
+        try:
+            yield extra
+            status = 'completed'
+        finally:
+            self.record_step(step, time.monotonic() - started, controller, status=status, **extra)
+
+    def record_step(self, step, duration, controller=None, status='completed', **fields):
+        """Record a sub-step timed elsewhere (e.g. taken from upload or monitoring stats)"""
+        if duration is None:
+            return
+        self.emit('step', step=step, controller=controller, status=status, duration=round(duration, 2), **fields)
+
+
+# Event log of the run in this process
+event_log = EventLog()
+
+
+def load_runs(path=DEFAULT_EVENT_LOG):
+    """Events of every run in the log, as {run id: [events]} in the order the runs started"""
+    runs = {}
+    if not os.path.exists(path):
+        return runs
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash
+                continue
+            runs.setdefault(event.get('run'), []).append(event)
+    return runs
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Fleet HA Version Upgrade
+========================
+Upgrades many CyberController HA pairs at once with bounded parallelism.
+
+Each pair runs the regular upgrade workflow from main.py in its own process,
+inside its own working directory under --runs-dir, so it gets its own
+session, checkpoint.json, exported configuration files and upgrade.log.
+A failing pair does not stop the others; re-running the fleet resumes each
+unfinished pair from its checkpoint and skips pairs that already completed.
+
+Inventory (JSON):
+
+    {
+      "defaults": {"upgrade_file": "/images/CC-10.9.tar.gz",
+                   "primary_username": "radware", "primary_password": "...",
+                   "secondary_username": "radware", "secondary_password": "..."},
+      "pairs": [
+        {"name": "dc1", "primary_address": "10.0.1.10", "secondary_address": "10.0.1.11"},
+        {"name": "dc2", "primary_address": "10.0.2.10", "secondary_address": "10.0.2.11"}
+      ]
+    }
+
+    python fleet.py inventory.json --workers 4 --prestage --parallel
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from multiprocessing.connection import wait
+from datetime import datetime, timezone
+
+from image_staging import ImageStager
+from main import add_upgrade_options, build_config, resume_point, run_upgrade, load_progress, save_progress
+
+REQUIRED_FIELDS = [
+    'name', 'primary_address', 'primary_username', 'primary_password',
+    'secondary_address', 'secondary_username', 'secondary_password', 'upgrade_file'
+]
+
+
+def load_inventory(path):
+    """Load the inventory file and return the list of fully populated pairs"""
+    with open(path, 'r') as f:
+        inventory = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    defaults = inventory.get('defaults', {})
+    pairs = []
+    for entry in inventory.get('pairs', []):
+        pair = {**defaults, **entry}
+        missing = [field for field in REQUIRED_FIELDS if not pair.get(field)]
+        if missing:
+            raise ValueError(f"Pair {pair.get('name', '?')} is missing: {', '.join(missing)}")
+
+        # Workers run in their own directory, so resolve the image path up front
+        pair['upgrade_file'] = os.path.join(base_dir, os.path.expanduser(pair['upgrade_file']))
+        if not os.path.exists(pair['upgrade_file']):
+            raise FileNotFoundError(f"Upgrade file not found for {pair['name']}: {pair['upgrade_file']}")
+        pair['file_size'] = os.path.getsize(pair['upgrade_file'])
+        pairs.append(pair)
+
+    names = [pair['name'] for pair in pairs]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate pair names in inventory: {', '.join(sorted(duplicates))}")
+    return pairs
+
+
+def _run_pair(pair, options, pair_dir):
+    """Worker process: upgrade one pair inside its own directory, logging to upgrade.log"""
+    os.chdir(pair_dir)
+    log = open('upgrade.log', 'a', buffering=1)
+    sys.stdout = sys.stderr = log
+    # No operator on this process - interactive prompts fail the pair instead of hanging
+    sys.stdin = open(os.devnull)
+
+    print(f"\n{'='*60}\n🚀 Fleet run for {pair['name']} started {datetime.now(timezone.utc).isoformat()}\n{'='*60}")
+    started = time.time()
+    result = {'name': pair['name'], 'ok': False, 'error': None}
+    try:
+        progress = load_progress()
+        start_phase, resume_uploads = resume_point(progress) if progress else (0, None)
+        config = build_config(pair, options, resume_uploads)
+        run_upgrade(config, start_phase)
+        result['ok'] = True
+    except (Exception, SystemExit) as e:
+        # upload_df_config() exits on failure, so SystemExit is a pair failure too
+        result['error'] = f"{type(e).__name__}: {e}"
+        print(f"\n💥 Pair failed with error: {result['error']}")
+        save_progress('error', 'failed', {'error': result['error'], 'timestamp': datetime.now(timezone.utc).isoformat()})
+
+    result['duration'] = time.time() - started
+    with open('result.json', 'w') as f:
+        json.dump(result, f, indent=2)
+    log.flush()
+
+
+def _fmt(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def stage_images(pending, options):
+    """
+    With --stage-image copy, copy each image once for the whole fleet and point
+    its pairs at the copy. The copy is owned by this process, the workers only
+    read it, so none of them can remove it while another pair still uploads.
+    Returns the pending list for the workers and the stagers by image.
+    """
+    if options.get('stage_image') != 'copy' or not pending:
+        return pending, {}
+    stagers = {}
+    for pair, _ in pending:
+        if pair['upgrade_file'] not in stagers:
+            print(f"🔥 Copying {pair['upgrade_file']} for the fleet")
+            stagers[pair['upgrade_file']] = ImageStager(pair['upgrade_file'], 'copy', options.get('stage_dir')).start()
+    staged = [({**pair, 'upgrade_file': stagers[pair['upgrade_file']].path()}, pair_dir) for pair, pair_dir in pending]
+    return staged, stagers
+
+
+def run_fleet(pairs, options, workers=4, runs_dir='fleet_runs', force=False):
+    """Upgrade all pairs with at most `workers` running at once, returns the per-pair results"""
+    os.makedirs(runs_dir, exist_ok=True)
+    fleet_started = time.time()
+    results = {}
+    pending = []
+
+    for pair in pairs:
+        pair_dir = os.path.abspath(os.path.join(runs_dir, pair['name']))
+        os.makedirs(pair_dir, exist_ok=True)
+        if glob.glob(os.path.join(pair_dir, 'checkpoint_completed_*.json')) and not force:
+            print(f"⏭️ {pair['name']}: already completed, skipping")
+            results[pair['name']] = {'name': pair['name'], 'ok': True, 'skipped': True, 'duration': 0.0}
+            continue
+        # Stale result from an earlier run must not be mistaken for this one
+        if os.path.exists(os.path.join(pair_dir, 'result.json')):
+            os.remove(os.path.join(pair_dir, 'result.json'))
+        pending.append((pair, pair_dir))
+
+    pending, stagers = stage_images(pending, options)
+    worker_options = {**options, 'stage_image': None} if stagers else options
+
+    print(f"🚀 Upgrading {len(pending)} HA pairs with up to {workers} in parallel")
+    running = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            pair, pair_dir = pending.pop(0)
+            process = multiprocessing.Process(target=_run_pair, args=(pair, worker_options, pair_dir),
+                                              name=f"fleet-{pair['name']}")
+            process.start()
+            running[process.sentinel] = (process, pair, pair_dir, time.time())
+            print(f"▶️  {pair['name']}: started (log: {os.path.join(pair_dir, 'upgrade.log')})")
+
+        for sentinel in wait(list(running)):
+            process, pair, pair_dir, started = running.pop(sentinel)
+            process.join()
+            try:
+                with open(os.path.join(pair_dir, 'result.json'), 'r') as f:
+                    result = json.load(f)
+            except (OSError, ValueError):
+                result = {'name': pair['name'], 'ok': False,
+                          'error': f"worker exited with code {process.exitcode}",
+                          'duration': time.time() - started}
+            results[pair['name']] = result
+            if result['ok']:
+                print(f"✅ {pair['name']}: completed in {_fmt(result['duration'])}")
+            else:
+                print(f"❌ {pair['name']}: failed after {_fmt(result['duration'])} - {result['error']}")
+
+    # A copy is kept for the next fleet run until every pair that uploads it has completed
+    for image, stager in stagers.items():
+        users = [results.get(pair['name'], {}) for pair in pairs if pair['upgrade_file'] == image]
+        if all(result.get('ok') for result in users):
+            stager.cleanup()
+
+    print_summary(pairs, results, time.time() - fleet_started, workers)
+    return results
+
+
+def print_summary(pairs, results, wall_clock, workers):
+    """Print per-pair outcome and fleet wall-clock time"""
+    print(f"\n📊 Fleet Summary")
+    print(f"{'='*60}")
+    print(f"{'Pair':<24} {'Status':<10} {'Duration':>10}  Error")
+    for pair in pairs:
+        result = results.get(pair['name'], {})
+        if result.get('skipped'):
+            status = 'skipped'
+        else:
+            status = 'ok' if result.get('ok') else 'failed'
+        print(f"{pair['name']:<24} {status:<10} {_fmt(result.get('duration', 0)):>10}  {result.get('error') or ''}")
+
+    ran = [r for r in results.values() if not r.get('skipped')]
+    serial = sum(r.get('duration', 0) for r in ran)
+    succeeded = sum(1 for r in ran if r.get('ok'))
+    print(f"\n✅ {succeeded}/{len(ran)} pairs upgraded ({len(results) - len(ran)} skipped)")
+    print(f"⏱️  Fleet wall-clock time: {_fmt(wall_clock)} with {workers} workers")
+    if wall_clock > 0 and serial:
+        print(f"⏱️  Sum of pair durations: {_fmt(serial)} ({serial / wall_clock:.1f}x speed-up over serial)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upgrade many CyberController HA pairs concurrently")
+    parser.add_argument('inventory', help="JSON inventory of HA pairs")
+    parser.add_argument('--workers', type=int, default=4, help="maximum number of pairs upgraded at once")
+    parser.add_argument('--runs-dir', default='fleet_runs', help="directory holding one working directory per pair")
+    parser.add_argument('--force', action='store_true', help="upgrade pairs again even if they already completed")
+    add_upgrade_options(parser)
+    args = parser.parse_args(argv)
+
+    print("🚀 Radware CyberController Fleet HA Version Upgrade")
+    print("=" * 51)
+    pairs = load_inventory(args.inventory)
+    results = run_fleet(pairs, vars(args), max(1, args.workers), args.runs_dir, args.force)
+    return all(result.get('ok') for result in results.values())
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
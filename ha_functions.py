@@ -1,13 +1,27 @@
 import requests
 import os
+import re
 import time
 import urllib3
 import ssl
 import socket
 import threading
 import gc
+import json
+import random
+import queue
+import statistics
+import heapq
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
+from upload_engine import upload_with_sendfile, multipart_envelope
+from progress import TransferProgress
+from image_digest import ImageHasher, HashingReader, digest_cache
+from image_staging import advise_sequential
+from http_metrics import InstrumentedAdapter, request_metrics
+
 # Optional import for chunked uploads
 try:
     from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
@@ -15,16 +29,40 @@ try:
 except ImportError:
     HAS_CHUNKED_SUPPORT = False
 
+# Optional import for streaming large JSON collections
+try:
+    import ijson
+    HAS_STREAMING_JSON = True
+except ImportError:
+    HAS_STREAMING_JSON = False
+
+# Upload engines selectable in version_update_chunked (None picks the best available)
+UPLOAD_ENGINES = ('toolbelt', 'sendfile')
+
+# Abort an upload whose throughput stays below the floor for this long
+STALL_FLOOR_BYTES = 64 * 1024  # bytes per second
+STALL_SECONDS = 60
+STALL_BLOCK_SIZE = 1024 * 1024  # sendfile block size while the watchdog samples progress
+
+# Page size for paginated configuration collections
+PAGE_SIZE = 100
+
+# Bulk configuration updates: concurrent requests per controller (stays below the adapter's pool size of 10)
+BULK_WORKERS = 8
+BULK_ATTEMPTS = 3
+PO_BATCH_SIZE = 200  # protected objects per disable request
+
+# DefenseFlow configuration migration: chunk size and how many chunks may sit between export and import
+DF_STREAM_CHUNK_SIZE = 64 * 1024
+DF_STREAM_BUFFER_CHUNKS = 32
+DF_IMPORT_PART_NAME = 'DefenseFlow-To-CCPlus.code-workspace'
+
 # Disable SSL certificate warnings and verification
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# Global session object with SSL verification disabled
-session = requests.Session()
-session.verify = False
-
-# Configure session for better connection handling
-from requests.adapters import HTTPAdapter
+# Configure sessions for better connection handling
 from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
 
 # Set up retry strategy
 retry_strategy = Retry(
@@ -33,10 +71,94 @@ retry_strategy = Retry(
     status_forcelist=[429, 500, 502, 503, 504],
 )
 
-# Mount adapter with retry strategy
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
+def _new_session():
+    """Create a session with SSL verification disabled and the instrumented retry adapter mounted"""
+    new_session = requests.Session()
+    new_session.verify = False
+    
+    # Mount adapter with retry strategy, recording every request in request_metrics
+    adapter = InstrumentedAdapter(max_retries=retry_strategy)
+    new_session.mount("http://", adapter)
+    new_session.mount("https://", adapter)
+    return new_session
+
+
+class SessionPool:
+    """
+    One authenticated, pooled session per controller address.
+    
+    Keeping primary and secondary apart means cookies never clash, each
+    controller keeps its own TLS connections alive, and both can be driven
+    at the same time.
+    """
+    
+    def __init__(self):
+        self._sessions = {}
+        self._credentials = {}
+        self._authenticated = set()
+        self._last_activity = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(url):
+        """Controller key ('scheme://host[:port]') for a base or full URL"""
+        parts = urlsplit(url if '//' in url else f"https://{url}")
+        return f"{parts.scheme}://{parts.netloc}"
+    
+    def get(self, url):
+        """Return the session for the controller serving url, creating it on first use"""
+        key = self.key(url)
+        with self._lock:
+            if key not in self._sessions:
+                self._sessions[key] = _new_session()
+                # Every response proves the session was used, heartbeats are only needed when it is idle
+                self._sessions[key].hooks['response'].append(lambda response, *args, **kwargs: self.touch(key))
+            return self._sessions[key]
+    
+    def touch(self, url):
+        """Record that the controller's session just got a response"""
+        with self._lock:
+            self._last_activity[self.key(url)] = time.monotonic()
+    
+    def last_activity(self, url):
+        """time.monotonic() of the session's last response, None if it has none"""
+        with self._lock:
+            return self._last_activity.get(self.key(url))
+    
+    def set_credentials(self, url, username, password):
+        with self._lock:
+            self._credentials[self.key(url)] = (username, password)
+    
+    def credentials(self, url):
+        with self._lock:
+            return self._credentials.get(self.key(url), (None, None))
+    
+    def mark_authenticated(self, url, authenticated=True):
+        with self._lock:
+            if authenticated:
+                self._authenticated.add(self.key(url))
+            else:
+                self._authenticated.discard(self.key(url))
+    
+    def is_authenticated(self, url):
+        with self._lock:
+            return self.key(url) in self._authenticated
+    
+    def close(self):
+        """Close all sessions and forget their logins"""
+        with self._lock:
+            for pooled in self._sessions.values():
+                pooled.close()
+            self._sessions.clear()
+            self._authenticated.clear()
+
+
+# Sessions for every controller this process talks to
+session_pool = SessionPool()
+
+def get_session(url):
+    """Return the pooled session for the controller serving url"""
+    return session_pool.get(url)
 
 # Also disable SSL verification globally for the session
 try:
@@ -45,72 +167,221 @@ try:
 except AttributeError:
     pass
 
-# Global variable to control keep-alive thread
-keep_alive_stop = threading.Event()
+# Heartbeat interval before a session TTL has been observed, and its bounds
+HEARTBEAT_INTERVAL = 300
+HEARTBEAT_MIN_INTERVAL = 30
+HEARTBEAT_PATH = '/mgmt/system/user/accessibility'
 
-def send_keep_alive(ip_address, interval=300):
+class HeartbeatScheduler:
     """
-    Send keep-alive requests every interval seconds to maintain session
+    Keep-alives for any number of controller sessions from one thread.
+    
+    Registered controllers sit on a timer heap keyed by their next due time. A
+    heartbeat is only sent once a session has been idle (no response, see
+    SessionPool.touch) for half the session TTL, at most interval seconds,
+    using the cheapest authenticated request. The TTL starts from the
+    configured ttl or from the session cookie's lifetime at login (see
+    seed_ttl). A 401 means the session outlived the controller's TTL: the
+    idle time becomes the TTL estimate and the session logs in again.
+    Per-session latency and timings are kept in stats().
     """
-    while not keep_alive_stop.is_set():
+    
+    def __init__(self, pool, interval=HEARTBEAT_INTERVAL, min_interval=HEARTBEAT_MIN_INTERVAL, ttl=None):
+        self.pool = pool
+        self.interval = interval
+        self.min_interval = min_interval
+        self.ttl = ttl
+        self._registered = {}
+        self._stats = {}
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+    
+    def interval_for(self, key):
+        """Seconds of idleness before the next heartbeat, derived from the session TTL"""
+        with self._cond:
+            ttl = self._stats.get(key, {}).get('ttl') or self.ttl
+        if ttl is None:
+            return self.interval
+        return max(self.min_interval, min(self.interval, ttl / 2))
+    
+    def _stats_for(self, key):
+        # Called with self._cond held
+        return self._stats.setdefault(key, {'beats': 0, 'failures': 0, 'relogins': 0, 'ttl': None,
+                                            'last_heartbeat': None, 'latency_ms': None})
+    
+    def seed_ttl(self, url, ttl):
+        """Take a session TTL known up front (e.g. from the login response) before any session expired"""
+        if not ttl or ttl <= 0:
+            return
+        with self._cond:
+            stats = self._stats_for(SessionPool.key(url))
+            stats['ttl'] = ttl if stats['ttl'] is None else min(stats['ttl'], ttl)
+    
+    def register(self, url):
+        """Start heart-beating the controller's session (calls are counted, see unregister)"""
+        key = SessionPool.key(url)
+        with self._cond:
+            self._registered[key] = self._registered.get(key, 0) + 1
+            if self._registered[key] > 1:
+                return
+            self._stats_for(key)
+            heapq.heappush(self._heap, (time.monotonic() + self.interval_for(key), key))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+    
+    def unregister(self, url):
+        key = SessionPool.key(url)
+        with self._cond:
+            if self._registered.get(key, 0) > 1:
+                self._registered[key] -= 1
+            else:
+                self._registered.pop(key, None)
+                self._cond.notify()
+    
+    def stats(self, url=None):
+        """Heartbeat stats per controller, or for one controller"""
+        with self._cond:
+            if url is not None:
+                return dict(self._stats.get(SessionPool.key(url), {}))
+            return {key: dict(value) for key, value in self._stats.items()}
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    # Drop entries of controllers that were unregistered meanwhile
+                    while self._heap and self._heap[0][1] not in self._registered:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        if not self._registered:
+                            self._thread = None
+                            return
+                        self._cond.wait()
+                        continue
+                    due, key = self._heap[0]
+                    delay = due - time.monotonic()
+                    if delay <= 0:
+                        heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(delay)
+            
+            interval = self.interval_for(key)
+            last = self.pool.last_activity(key)
+            idle = time.monotonic() - last if last is not None else interval
+            if idle >= interval:
+                self._beat(key, idle)
+                idle = 0
+            with self._cond:
+                if key in self._registered:
+                    heapq.heappush(self._heap, (time.monotonic() + self.interval_for(key) - idle, key))
+    
+    def _beat(self, key, idle):
+        """Send one heartbeat for the controller key, logging in again if the session expired"""
+        session = self.pool.get(key)
+        stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        started = time.monotonic()
         try:
-            # Send a simple GET request to keep session alive - using HA status endpoint
-            url = f"https://{ip_address}/mgmt/cybercontroller/ha/status"
-            response = session.get(url, timeout=30)
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Keep-alive sent - Status: {response.status_code}")
-        except Exception as e:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Keep-alive failed: {str(e)}")
+            response = session.get(f"{key}{HEARTBEAT_PATH}", verify=False, timeout=(3, 10))
+        except requests.exceptions.RequestException as e:
+            with self._cond:
+                self._stats_for(key)['failures'] += 1
+            print(f"[{stamp}] Keep-alive to {urlsplit(key).hostname} failed: {str(e)[:100]}")
+            return
         
-        # Wait for the specified interval or until stop event is set
-        keep_alive_stop.wait(interval)
+        latency_ms = round((time.monotonic() - started) * 1000, 1)
+        with self._cond:
+            stats = self._stats_for(key)
+            stats.update({'beats': stats['beats'] + 1, 'last_heartbeat': datetime.now(timezone.utc).isoformat(),
+                          'latency_ms': latency_ms})
+            if response.status_code == 401:
+                # The session expired within the idle time
+                stats['ttl'] = idle if stats['ttl'] is None else min(stats['ttl'], idle)
+        print(f"[{stamp}] Keep-alive to {urlsplit(key).hostname} - {response.status_code} in {latency_ms:.0f} ms")
+        
+        if response.status_code == 401:
+            self.pool.mark_authenticated(key, False)
+            username, password = self.pool.credentials(key)
+            if username and login(key, username, password, session):
+                with self._cond:
+                    self._stats_for(key)['relogins'] += 1
+
+
+# Keep-alives for every controller session this process talks to
+heartbeats = HeartbeatScheduler(session_pool)
 
-def login(base_url, username, password):
+def session_ttl(response):
+    """Seconds the session cookies set by a login response live (Max-Age / Expires), None if they do not expire"""
+    expiries = [cookie.expires for cookie in response.cookies if cookie.expires]
+    return min(expiries) - time.time() if expiries else None
+
+def login(base_url, username, password, session=None):
+    session = session or get_session(base_url)
+    session_pool.set_credentials(base_url, username, password)
     try:
         url = f"{base_url}/mgmt/system/user/login"
         payload = {"username": username, "password": password}
-        r = session.post(url, json=payload, verify=False)
+        r = session.post(url, json=payload, verify=False, timeout=30)
         if r.status_code != 200:
             print(f"❌ Login failed with status code: {r.status_code}")
             if r.text:
                 print(f"📝 Response: {r.text}")
+            session_pool.mark_authenticated(base_url, False)
             return False
         else:
             print("✅ Login successful")
+            session_pool.mark_authenticated(base_url)
+            heartbeats.seed_ttl(base_url, session_ttl(r))
             return True
     except requests.exceptions.RequestException as e:
         print(f"🔌 Login failed with error: {e}")
         # Server is not ready yet, return False to indicate login failed
+        session_pool.mark_authenticated(base_url, False)
         return False
 
-def ensure_authenticated(base_url, username, password):
-    """Ensure we have a valid session, re-authenticate if needed"""
+def ensure_authenticated(base_url, username=None, password=None, session=None):
+    """
+    Ensure we have a valid session, re-authenticate if needed
+    
+    A controller session that already logged in is checked with one cheap
+    request on its pooled connection; a full login only happens on a 401.
+    Credentials default to the ones last used to log in to this controller.
+    """
+    session = session or get_session(base_url)
+    if username is None:
+        username, password = session_pool.credentials(base_url)
+    
+    if not session_pool.is_authenticated(base_url):
+        return login(base_url, username, password, session)
+    
     try:
         # Test session with a simple API call
         test_url = f"{base_url}/mgmt/system/user/accessibility"
         r = session.get(test_url, verify=False, timeout=10)
         if r.status_code == 401:
             print("🔑 Session expired, re-authenticating...")
-            return login(base_url, username, password)
-        elif r.status_code == 200:
-            return True
-        else:
-            print(f"⚠️  Session test returned status {r.status_code}, re-authenticating...")
-            return login(base_url, username, password)
+            return login(base_url, username, password, session)
+        return True
     except requests.exceptions.RequestException:
         print("🔑 Session test failed, re-authenticating...")
-        return login(base_url, username, password)
+        return login(base_url, username, password, session)
 
 
-def break_ha(base_url_primary):
+def break_ha(base_url_primary, session=None):
+    session = session or get_session(base_url_primary)
     url = f"{base_url_primary}/mgmt/cybercontroller/ha/config"
     r = session.delete(url, verify=False)
     if r.status_code == 200:
          print("HA going to Disable state")
 
-def ha_status(base_url):
+def ha_status(base_url, session=None):
+    session = session or get_session(base_url)
     try:
         url = f"{base_url}/mgmt/cybercontroller/ha/status"
-        r = session.get(url, verify=False)
+        # Bounded, a background watcher must not hang on a rebooting controller
+        r = session.get(url, verify=False, timeout=(3, 30))
         if r.status_code != 200:
             return None
         
@@ -127,7 +398,115 @@ def ha_status(base_url):
     except requests.exceptions.RequestException as e:
         return None
 
-def get_router_id(base_url):
+# Seconds between HA status polls while someone waits for a state change
+HA_WATCH_INTERVAL = 5
+
+class HAStatusWatcher:
+    """
+    Single background poller of one controller's HA status.
+    
+    Waiters block in wait_for() until a predicate on the status holds and are
+    woken by the poll that sees the change, so concurrent waits on the same
+    controller share one request every interval seconds. The poller runs
+    only while someone waits: the first waiter starts it and the last one
+    stops it. The latest result is cached with its time, and a waiter
+    arriving within interval seconds of the last poll checks it first.
+    """
+    
+    def __init__(self, base_url, interval=HA_WATCH_INTERVAL):
+        self.base_url = base_url
+        self.interval = interval
+        self.status = None
+        self.updated = None
+        self.polls = 0
+        self._waiters = 0
+        self._cond = threading.Condition()
+        self._poll_lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+    
+    def _poll(self):
+        # One request at a time, a caller that raced the watcher gets its result
+        with self._poll_lock:
+            result = ha_status(self.base_url)
+            with self._cond:
+                self.status = result
+                self.updated = time.monotonic()
+                self.polls += 1
+                self._cond.notify_all()
+        return result
+    
+    def _run(self, stop):
+        while not stop.is_set():
+            self._poll()
+            stop.wait(self.interval)
+    
+    def start(self):
+        """Start the background poller if it is not running yet"""
+        with self._cond:
+            if self._thread is None:
+                # Each poller has its own stop event, so one that is still finishing is never revived
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+                self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stop the background poller; a poll in flight still completes"""
+        with self._cond:
+            if self._thread is not None:
+                self._stop.set()
+                self._thread = None
+    
+    def age(self):
+        """Seconds since the cached status was read, None before the first poll"""
+        return time.monotonic() - self.updated if self.updated is not None else None
+    
+    def wait_for(self, predicate, on_update=None, timeout=None):
+        """
+        Block until predicate(status) is true and return that status. on_update(status) is
+        called after every poll while waiting. Returns None if timeout seconds pass first.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            self._waiters += 1
+            self.start()
+            try:
+                age = self.age()
+                if age is not None and age <= self.interval and predicate(self.status):
+                    return self.status
+                seen = self.polls
+                while True:
+                    if self.polls != seen:
+                        seen = self.polls
+                        if predicate(self.status):
+                            return self.status
+                        if on_update:
+                            on_update(self.status)
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+                if not self._waiters:
+                    self.stop()
+
+
+# HA status watchers, one per controller address
+ha_watchers = {}
+_ha_watchers_lock = threading.Lock()
+
+def get_ha_watcher(url):
+    """Return the HA status watcher for the controller serving url"""
+    key = SessionPool.key(url)
+    with _ha_watchers_lock:
+        if key not in ha_watchers:
+            ha_watchers[key] = HAStatusWatcher(key)
+        return ha_watchers[key]
+
+def get_router_id(base_url, session=None):
+    session = session or get_session(base_url)
     try:
         url = f"{base_url}/mgmt/device/df/config?prop=BGP_ROUTER_ID,BGP_HOLD_TIME,BGP_LOCAL_AS"
         response = session.get(url, verify=False)
@@ -142,40 +521,113 @@ def get_router_id(base_url):
         print(f"Request error: {e}")
         return None
     
-def get_net_element_names(base_url):
-    try:
-        url = f"{base_url}/mgmt/device/df/config/NetworkElements?count=100"
-        response = session.get(url, verify=False)
+def _prefetched_pages(fetch_page, page_size=PAGE_SIZE, key=None):
+    """
+    Yield the items of fetch_page(offset, count) page by page. The next page is
+    requested in the background while the caller works through the current one.
+    Stops at the first empty page; a short page is not the end, as the server
+    may cap the count or fetch_page may filter items out. Items are told apart
+    by key(item): a server that ignores the offset returns items it already
+    sent, which are dropped, and the listing stops with a warning at the first
+    page that has nothing new. Errors of fetch_page are raised.
+    """
+    key = key or (lambda item: item)
+    seen = set()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        offset = 0
+        future = executor.submit(fetch_page, offset, page_size)
+        while True:
+            page = future.result()
+            if not page:
+                return
+            fresh = [item for item in page if key(item) not in seen]
+            if not fresh:
+                print(f"⚠️ Server ignored the page offset - stopping after {len(seen)} items")
+                return
+            seen.update(key(item) for item in fresh)
+            offset += len(page)
+            future = executor.submit(fetch_page, offset, page_size)
+            yield from fresh
+
+def iter_network_elements(base_url, session=None, page_size=PAGE_SIZE):
+    """
+    Lazily yield all network elements (as returned by the API), one page at a time.
+    Raises requests.exceptions.RequestException when a page cannot be read.
+    """
+    session = session or get_session(base_url)
+    
+    def fetch_page(offset, count):
+        url = f"{base_url}/mgmt/device/df/config/NetworkElements?count={count}&offset={offset}"
+        response = session.get(url, verify=False, timeout=60)
         if response.status_code != 200:
-            print(f"Failed to get network element names. Status code: {response.status_code}")
-            return None  
-        data = response.json()
-        return [element.get('name') for element in data.get('NetworkElements', []) if 'name' in element]
-        
+            raise requests.exceptions.HTTPError(
+                f"Failed to get network element names. Status code: {response.status_code}", response=response)
+        return [element for element in response.json().get('NetworkElements', []) if 'name' in element]
+    
+    return _prefetched_pages(fetch_page, page_size, key=lambda element: element['name'])
+
+def iter_net_element_names(base_url, session=None, page_size=PAGE_SIZE):
+    """Lazily yield all network element names, see iter_network_elements()"""
+    return (element['name'] for element in iter_network_elements(base_url, session, page_size))
+
+def get_net_element_names(base_url, session=None):
+    try:
+        return list(iter_net_element_names(base_url, session))
     except requests.exceptions.RequestException as e:
         print(f"Request error: {e}")
         return None
 
-def get_po_names(base_url):
-    try:
-        url = f"{base_url}/mgmt/v2/device/df/restv2/protected-objects/configure/security-settings/?includeNameSort=false"
-        payload = {
+def iter_protected_objects(base_url, session=None):
+    """
+    Yield all protected objects as the response arrives. With ijson installed the
+    response is parsed incrementally instead of being loaded into memory first.
+    Raises requests.exceptions.RequestException when the list cannot be read.
+    """
+    session = session or get_session(base_url)
+    url = f"{base_url}/mgmt/v2/device/df/restv2/protected-objects/configure/security-settings/?includeNameSort=false"
+    payload = {
         "protectedObjectNames": []
-}
-
-        response = session.post(url, json=payload, verify=False)
+    }
+    
+    with session.post(url, json=payload, verify=False, stream=HAS_STREAMING_JSON, timeout=120) as response:
         if response.status_code != 200:
-            print(f"Failed to get protected object names. Status code: {response.status_code}")    
-            return None  
-        data = response.json()
-        return [obj.get("name") for obj in data["protectedObjects"] if "name" in obj]
-        
+            raise requests.exceptions.HTTPError(
+                f"Failed to get protected object names. Status code: {response.status_code}", response=response)
+        if HAS_STREAMING_JSON:
+            response.raw.decode_content = True
+            objects = ijson.items(response.raw, 'protectedObjects.item')
+        else:
+            objects = response.json()["protectedObjects"]
+        for obj in objects:
+            if "name" in obj:
+                yield obj
+
+def iter_po_names(base_url, session=None):
+    """Yield all protected object names, see iter_protected_objects()"""
+    return (obj["name"] for obj in iter_protected_objects(base_url, session))
+
+def po_is_disabled(obj):
+    """
+    True when a protected object from the listing is already disabled. Objects whose
+    state cannot be read from the listing count as enabled, so they are always disabled.
+    """
+    if isinstance(obj.get('enabled'), bool):
+        return not obj['enabled']
+    for key in ('state', 'status', 'adminStatus'):
+        if isinstance(obj.get(key), str):
+            return obj[key].lower() in ('disabled', 'disable', 'inactive')
+    return False
+
+def get_po_names(base_url, session=None):
+    try:
+        return list(iter_po_names(base_url, session))
     except requests.exceptions.RequestException as e:
         print(f"Request error: {e}")
         return None
     
 
-def establish_ha(primary_address, secondary_address, secondary_username, secondary_password, base_url_primary):
+def establish_ha(primary_address, secondary_address, secondary_username, secondary_password, base_url_primary, session=None):
+    session = session or get_session(base_url_primary)
     url = f"{base_url_primary}/mgmt/cybercontroller/ha/config"
     payload = {
     "primaryIP": f"{primary_address}",
@@ -199,17 +651,166 @@ def establish_ha(primary_address, secondary_address, secondary_username, seconda
 
 
 
-def version_update_chunked(base_url, upgrade_file, bytes_size, username=None, password=None):
+class UploadStalled(Exception):
+    """Raised when an upload's throughput stays below the stall floor"""
+    
+    reason = 'upload_stalled'
+    
+    def __init__(self, bytes_sent, rate, seconds):
+        self.bytes_sent = bytes_sent
+        self.rate = rate
+        self.seconds = seconds
+        super().__init__(f"{self.reason}: {rate / 1024:.1f} KB/s for {seconds:.0f}s after {bytes_sent:,} bytes")
+
+
+class StallWatchdog:
     """
-    Enhanced version update with chunked upload and keep-alive for better memory management
+    Aborts uploads whose throughput stays below a floor.
+    
+    Engines feed it bytes-sent from their progress callbacks. A monitor thread
+    computes the rolling rate over the last window seconds, including time in
+    which no callback arrived at all, and trips once it has stayed below floor
+    for stall_seconds. Tripping calls the abort hook given to start() (the
+    sendfile engine shuts its socket down) and makes the next sample() raise
+    UploadStalled. Engines also use stall_seconds as the socket send timeout
+    and ask stalled() whether a send error was really a stall.
+    """
+    
+    def __init__(self, floor=STALL_FLOOR_BYTES, stall_seconds=STALL_SECONDS, window=10, check_interval=1):
+        self.floor = floor
+        self.stall_seconds = stall_seconds
+        self.window = window
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.tripped = None
+    
+    def start(self, abort=None):
+        """Reset for a new request and start monitoring"""
+        self.stop()
+        now = time.monotonic()
+        self.samples = deque([(now, 0)])
+        self.bytes_sent = 0
+        self.started = now
+        self.last_progress = now
+        self.below_since = None
+        self.tripped = None
+        self.abort = abort
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._monitor, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+    
+    def sample(self, bytes_sent):
+        """Record progress; raises UploadStalled once the watchdog has tripped"""
+        if self.tripped:
+            raise self.tripped
+        now = time.monotonic()
+        with self._lock:
+            if bytes_sent > self.bytes_sent:
+                self.last_progress = now
+            self.bytes_sent = bytes_sent
+            # Progress callbacks can fire for every few KB - keep at most two samples a second
+            if now - self.samples[-1][0] >= 0.5:
+                self.samples.append((now, bytes_sent))
+    
+    def rate(self, now=None):
+        """Rolling throughput in bytes per second over the last window"""
+        now = now or time.monotonic()
+        with self._lock:
+            while len(self.samples) > 1 and self.samples[1][0] <= now - self.window:
+                self.samples.popleft()
+            t0, b0 = self.samples[0]
+            sent = self.bytes_sent
+        return (sent - b0) / (now - t0) if now > t0 else 0.0
+    
+    def check(self):
+        """Trip when the rate has been below the floor for stall_seconds, returns the trip or None"""
+        now = time.monotonic()
+        if self.tripped or now - self.started < min(self.window, self.stall_seconds):
+            return self.tripped  # not enough history for a meaningful rate yet
+        rate = self.rate(now)
+        if rate >= self.floor:
+            self.below_since = None
+        elif self.below_since is None:
+            self.below_since = now - min(self.window, self.stall_seconds)
+        elif now - self.below_since >= self.stall_seconds:
+            self.tripped = UploadStalled(self.bytes_sent, rate, now - self.below_since)
+            if self.abort:
+                try:
+                    self.abort()
+                except OSError:
+                    pass
+        return self.tripped
+    
+    def _monitor(self):
+        while not self._stop.wait(self.check_interval):
+            if self.check():
+                return
+    
+    def stalled(self):
+        """The UploadStalled that ended the transfer, or None if it failed for another reason"""
+        if self.tripped:
+            return self.tripped
+        idle = time.monotonic() - self.last_progress
+        if idle >= self.stall_seconds * 0.9:
+            # The send timeout fired: nothing moved for stall_seconds
+            return UploadStalled(self.bytes_sent, 0.0, idle)
+        return None
+
+
+def query_upload_offset(url, bytes_size, session=None):
+    """
+    Ask the controller how many bytes of an interrupted upload it has acknowledged.
+    Returns the acknowledged byte count, or None when ranged uploads are not supported.
     """
-    global keep_alive_stop
-    keep_alive_thread = None
-    ip_address = base_url.split('//')[1].split('/')[0] if '//' in base_url else base_url.split('/')[0]
+    session = session or get_session(url)
+    try:
+        r = session.head(url, headers={'Content-Range': f"bytes */{bytes_size}"}, verify=False, timeout=30)
+    except requests.exceptions.RequestException as e:
+        print(f"🔌 Upload offset query failed: {str(e)[:200]}...")
+        return None
     
+    if r.status_code != 308:
+        return None
+    
+    # No Range header means nothing was stored yet
+    range_header = r.headers.get('Range')
+    if not range_header:
+        return 0
+    try:
+        return int(range_header.split('-')[-1]) + 1
+    except ValueError:
+        return None
+
+
+def upload_software_image(base_url, upgrade_file, bytes_size, username=None, password=None,
+                          resumable=False, resume_offset=None, on_checkpoint=None, engine=None,
+                          stall_floor=STALL_FLOOR_BYTES, stall_seconds=STALL_SECONDS, on_metrics=None):
+    """
+    Upload the software image with keep-alive and retries, without committing it
+    
+    With resumable=True an interrupted upload continues from the byte offset the controller
+    acknowledged instead of byte zero. on_checkpoint(offset) is called before every attempt
+    and whenever a new acknowledged offset is known, so callers can persist it for a later
+    restart. resume_offset is the offset such a checkpoint recorded (None when there was no
+    interrupted upload); the controller is asked for its offset whenever it is set.
+    engine selects one of UPLOAD_ENGINES; by default requests-toolbelt is used when
+    installed and the zero-copy sendfile engine otherwise.
+    An attempt whose throughput stays below stall_floor bytes/s for stall_seconds is
+    aborted with reason 'upload_stalled' and retried right away.
+    on_metrics(metrics) is called with the throughput of the attempt that completed the upload
+    and the image SHA-256, which is computed from the sent data (or taken from digest_cache).
+    """
     url = f"{base_url}/mgmt/system/config/action/software?type=full&filesize={bytes_size}"
     
-    print(f"\n🔄 Starting Version Update (Chunked Method with Keep-Alive)")
+    print(f"\n🔄 Starting Image Upload (Chunked Method with Keep-Alive)")
     print(f"{'='*60}")
     print(f"📁 File: {os.path.basename(upgrade_file)}")
     print(f"📊 Size: {bytes_size / (1024*1024):.2f} MB ({bytes_size:,} bytes)")
@@ -217,16 +818,25 @@ def version_update_chunked(base_url, upgrade_file, bytes_size, username=None, pa
     print(f"{'='*60}")
     
     # Check if chunked support is available
-    if not HAS_CHUNKED_SUPPORT:
-        print("⚠️  requests-toolbelt not found, using fallback chunked method...")
-        print("💡 For better performance, install it with: pip install requests-toolbelt")
+    if engine is None:
+        engine = 'toolbelt' if HAS_CHUNKED_SUPPORT else 'sendfile'
+    elif engine == 'toolbelt' and not HAS_CHUNKED_SUPPORT:
+        print("⚠️  requests-toolbelt not found, using zero-copy sendfile engine...")
+        print("💡 To use the toolbelt engine, install it with: pip install requests-toolbelt")
+        engine = 'sendfile'
+    print(f"⚙️  Upload engine: {engine}")
+    watchdog = StallWatchdog(stall_floor, stall_seconds) if stall_floor and stall_seconds else None
     
-    # For files > 500MB, start keep-alive thread during upload
-    start_keep_alive = bytes_size > 500 * 1024 * 1024  # 500MB threshold
+    # Hash the image while it is sent, unless an earlier upload of the same file already did
+    image_sha256 = digest_cache.get(upgrade_file)
+    hasher = None
     
     max_retries = 3
     for attempt in range(max_retries):
         try:
+            if image_sha256 is None and hasher is None:
+                hasher = ImageHasher(upgrade_file)
+            
             if attempt > 0:
                 print(f"\n🔄 Retry attempt {attempt} of {max_retries - 1}...")
                 # Re-authenticate before retry
@@ -236,28 +846,46 @@ def version_update_chunked(base_url, upgrade_file, bytes_size, username=None, pa
                         print("❌ Re-authentication failed")
                         continue
             
+            # Work out where to resume from before sending anything
+            offset = 0
+            # A checkpoint entry also exists for an upload killed during its first attempt, before any
+            # offset was acknowledged, so the controller is asked even when it recorded 0
+            if resumable and (attempt > 0 or resume_offset is not None):
+                acknowledged = query_upload_offset(url, bytes_size)
+                if acknowledged is None:
+                    print("⚠️  Controller does not support ranged uploads - sending full file")
+                else:
+                    if resume_offset is not None and acknowledged != resume_offset:
+                        print(f"📍 Controller acknowledged {acknowledged:,} bytes (checkpoint had {resume_offset:,})")
+                    offset = min(acknowledged, bytes_size)
+            # Record the upload before sending, so a restart knows to ask the controller
+            if resumable and on_checkpoint:
+                on_checkpoint(offset)
+            
+            if offset:
+                print(f"⏩ Resuming upload at byte {offset:,} ({offset / bytes_size * 100:.1f}% already on controller)")
             print(f"⬆️  Uploading file with chunked method... This may take several minutes...")
             
-            # Start keep-alive thread for large files
-            if start_keep_alive:
-                keep_alive_stop.clear()
-                keep_alive_thread = threading.Thread(target=send_keep_alive, args=(ip_address, 300))
-                keep_alive_thread.daemon = True
-                keep_alive_thread.start()
-                print("🔄 Keep-alive started (5 minute intervals)")
+            # Heartbeats only go out while the session is idle, so short uploads never send one
+            heartbeats.register(base_url)
             
             try:
-                if HAS_CHUNKED_SUPPORT:
-                    # Use requests-toolbelt for optimal chunked upload
-                    success = _upload_with_toolbelt(url, upgrade_file, bytes_size)
+                if offset >= bytes_size:
+                    # Every byte already acknowledged, only the commit is missing
+                    response = None
+                    metrics = None
+                    success = True
                 else:
-                    # Use fallback chunked method
-                    success = _upload_with_fallback(url, upgrade_file, bytes_size)
+                    response, metrics = _timed_upload(url, upgrade_file, bytes_size, offset, engine, watchdog, hasher)
+                    if offset and response is not None and response.status_code == 416:
+                        print("⚠️  Controller rejected the upload range - falling back to full upload")
+                        offset = 0
+                        if on_checkpoint:
+                            on_checkpoint(0)
+                        response, metrics = _timed_upload(url, upgrade_file, bytes_size, 0, engine, watchdog, hasher)
+                    success = _upload_succeeded(response)
             finally:
-                # Stop keep-alive thread
-                if keep_alive_thread:
-                    keep_alive_stop.set()
-                    print("🛑 Keep-alive stopped")
+                heartbeats.unregister(base_url)
             
             if not success:
                 if attempt < max_retries - 1:
@@ -268,34 +896,31 @@ def version_update_chunked(base_url, upgrade_file, bytes_size, username=None, pa
                 return False
             
             print(f"✅ File uploaded successfully!")
+            if metrics and metrics['average_mbps']:
+                print(f"📊 Throughput: {metrics['average_mbps']:.1f} MB/s average over {metrics['seconds']:.0f}s")
+            if hasher:
+                image_sha256 = hasher.finish()
+                digest_cache.put(upgrade_file, image_sha256, hasher.stat)
+            print(f"🔏 Image SHA-256: {image_sha256}")
+            if resumable and on_checkpoint:
+                on_checkpoint(bytes_size)
+            if on_metrics and metrics:
+                on_metrics({'controller': base_url, 'engine': engine, 'resumed_from': offset, 'sha256': image_sha256,
+                            'heartbeat': heartbeats.stats(base_url), **metrics})
             
-            # Wait before committing
-            print(f"⏳ Processing uploaded file...")
-            for i in range(5):
-                print(f"   {'▓' * (i + 1)}{'░' * (4 - i)} {i + 1}/5 seconds", end='\r')
-                time.sleep(1)
-            print("\n")
-            
-            # Commit the upload
-            commit_url = f"{base_url}/mgmt/system/config/action/software?type=full"
-            print(f"🔄 Committing upload...")
-            commit_response = session.put(commit_url, verify=False, timeout=600)
-            
-            # Handle session expiration during commit
-            if commit_response.status_code == 401 and username and password:
-                print("🔑 Session expired during commit, re-authenticating...")
-                if login(base_url, username, password):
-                    print("🔄 Retrying commit...")
-                    commit_response = session.put(commit_url, verify=False, timeout=600)
-            
-            if commit_response.status_code != 200:
-                print(f"❌ Commit failed with status code: {commit_response.status_code}")
-                if hasattr(commit_response, 'text') and commit_response.text:
-                    print(f"📝 Response: {commit_response.text[:500]}...")
-                return False
-            
-            print(f"🚀 Starting system update...")
             return True
+        
+        except UploadStalled as e:
+            print(f"\n🐌 Upload stalled on attempt {attempt + 1} (reason: {e.reason}) - "
+                  f"{e.rate / 1024:.1f} KB/s for {e.seconds:.0f}s, floor is {stall_floor / 1024:.0f} KB/s")
+            if attempt < max_retries - 1:
+                # A stall says nothing about the controller, so retry on a fresh connection straight away
+                print(f"⏳ Waiting 5 seconds before retry...")
+                time.sleep(5)
+                continue
+            else:
+                print("❌ Max retries exceeded due to stalled uploads")
+                return False
                     
         except requests.exceptions.Timeout as e:
             print(f"\n⏰ Upload timed out on attempt {attempt + 1}")
@@ -336,27 +961,146 @@ def version_update_chunked(base_url, upgrade_file, bytes_size, username=None, pa
     return False
 
 
-def _upload_with_toolbelt(url, upgrade_file, bytes_size):
+def commit_software_image(base_url, username=None, password=None, session=None):
+    """Commit a previously uploaded software image, which starts the system update"""
+    session = session or get_session(base_url)
+    commit_url = f"{base_url}/mgmt/system/config/action/software?type=full"
+    
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            print(f"🔄 Committing upload...")
+            commit_response = session.put(commit_url, verify=False, timeout=600)
+            
+            # Handle session expiration during commit
+            if commit_response.status_code == 401 and username and password:
+                print("🔑 Session expired during commit, re-authenticating...")
+                if login(base_url, username, password, session):
+                    print("🔄 Retrying commit...")
+                    commit_response = session.put(commit_url, verify=False, timeout=600)
+            
+            if commit_response.status_code != 200:
+                print(f"❌ Commit failed with status code: {commit_response.status_code}")
+                if hasattr(commit_response, 'text') and commit_response.text:
+                    print(f"📝 Response: {commit_response.text[:500]}...")
+                return False
+            
+            print(f"🚀 Starting system update...")
+            return True
+            
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            print(f"\n🔌 Commit request failed on attempt {attempt + 1}: {str(e)[:200]}...")
+            if attempt < max_retries - 1:
+                wait_time = 30 * (attempt + 1)
+                print(f"⏳ Waiting {wait_time} seconds before retry...")
+                time.sleep(wait_time)
+    
+    print("❌ Max retries exceeded while committing")
+    return False
+
+
+def version_update_chunked(base_url, upgrade_file, bytes_size, username=None, password=None,
+                           resumable=False, resume_offset=None, on_checkpoint=None, engine=None,
+                           stall_floor=STALL_FLOOR_BYTES, stall_seconds=STALL_SECONDS, on_metrics=None,
+                           on_commit=None):
+    """
+    Enhanced version update with chunked upload and keep-alive for better memory management
+    
+    Uploads the image with upload_software_image() (see there for the upload options)
+    and commits it with commit_software_image(). on_commit(seconds, committed) is
+    called once the commit request finished.
+    """
+    if not upload_software_image(base_url, upgrade_file, bytes_size, username, password,
+                                 resumable=resumable, resume_offset=resume_offset,
+                                 on_checkpoint=on_checkpoint, engine=engine,
+                                 stall_floor=stall_floor, stall_seconds=stall_seconds,
+                                 on_metrics=on_metrics):
+        return False
+    
+    # Wait before committing
+    print(f"⏳ Processing uploaded file...")
+    for i in range(5):
+        print(f"   {'▓' * (i + 1)}{'░' * (4 - i)} {i + 1}/5 seconds", end='\r')
+        time.sleep(1)
+    print("\n")
+    
+    started = time.monotonic()
+    committed = commit_software_image(base_url, username, password)
+    if on_commit:
+        on_commit(time.monotonic() - started, committed)
+    return committed
+
+
+def _send_upload(url, upgrade_file, bytes_size, offset=0, engine='toolbelt', watchdog=None, progress=None,
+                 hasher=None):
+    """
+    Send the image from offset with the selected engine, returns the response or None.
+    Raises UploadStalled when the watchdog aborts the transfer. progress (a TransferProgress)
+    is fed the absolute byte count as the upload proceeds, hasher (an ImageHasher) the sent data.
+    """
+    headers = {}
+    if offset:
+        headers['Content-Range'] = f"bytes {offset}-{bytes_size - 1}/{bytes_size}"
+    
+    if engine == 'toolbelt':
+        # Use requests-toolbelt for optimal chunked upload
+        return _upload_with_toolbelt(url, upgrade_file, bytes_size, offset, headers, watchdog=watchdog, progress=progress,
+                                     hasher=hasher)
+    # Stream the file straight from the kernel onto the pooled connection
+    return _upload_with_sendfile(url, upgrade_file, bytes_size, offset, headers, watchdog=watchdog, progress=progress,
+                                 hasher=hasher)
+
+
+def _timed_upload(url, upgrade_file, bytes_size, offset, engine, watchdog=None, hasher=None):
+    """_send_upload() with live throughput / ETA rendering, returns (response, transfer metrics)"""
+    # Label lines with the controller, concurrent pre-stage uploads share the terminal
+    progress = TransferProgress(bytes_size, initial=offset, label=urlsplit(url).hostname).start()
+    try:
+        response = _send_upload(url, upgrade_file, bytes_size, offset, engine, watchdog, progress, hasher)
+    finally:
+        metrics = progress.finish()
+    return response, metrics
+
+
+def _upload_succeeded(response):
+    """Report a failed upload response, returns True when the controller accepted it"""
+    if response is None:
+        return False
+    
+    if response.status_code != 200:
+        print(f"❌ Upload failed with status code: {response.status_code}")
+        if hasattr(response, 'text') and response.text:
+            print(f"📝 Response: {response.text[:500]}...")
+        return False
+    
+    return True
+
+
+def _upload_with_toolbelt(url, upgrade_file, bytes_size, offset=0, headers=None, session=None, watchdog=None,
+                          progress=None, hasher=None):
     """Upload using requests-toolbelt for optimal performance"""
+    session = session or get_session(url)
+    if watchdog:
+        watchdog.start()
     try:
-        # Track upload progress
-        last_percent = [0]  # Use list to make it mutable in closure
-        
         def progress_callback(monitor):
-            """Callback for upload progress"""
-            percent = int((monitor.bytes_read / monitor.len) * 100)
-            if percent != last_percent[0] and percent % 5 == 0:  # Update every 5%
-                mb_uploaded = monitor.bytes_read / (1024*1024)
-                total_mb = monitor.len / (1024*1024)
-                print(f"\r   ⬆️  {percent}% - {mb_uploaded:.1f} MB / {total_mb:.1f} MB", end='', flush=True)
-                last_percent[0] = percent
+            """Called for every chunk read - only hand over the byte count"""
+            if progress:
+                progress.update(offset + monitor.bytes_read)
+            if watchdog:
+                watchdog.sample(monitor.bytes_read)
         
         # Open file and create multipart encoder
         with open(upgrade_file, 'rb') as f:
+            # The encoder sends from the current position, so seeking skips acknowledged bytes
+            f.seek(offset)
+            advise_sequential(f, offset)
+            
             # Create multipart encoder - this will read the file in chunks
             encoder = MultipartEncoder(
                 fields={
-                    'Filedata': (os.path.basename(upgrade_file), f, 'application/octet-stream')
+                    'Filedata': (os.path.basename(upgrade_file), HashingReader(f, hasher) if hasher else f,
+                                 'application/octet-stream')
                 }
             )
             
@@ -367,93 +1111,185 @@ def _upload_with_toolbelt(url, upgrade_file, bytes_size):
             response = session.post(
                 url, 
                 data=monitor,
-                headers={'Content-Type': monitor.content_type},
+                headers={**(headers or {}), 'Content-Type': monitor.content_type},
                 verify=False, 
-                timeout=1800  # 30 minutes
+                # urllib3 applies the connect timeout while sending the body, so it doubles as the send stall timeout
+                timeout=(watchdog.stall_seconds, 1800) if watchdog else 1800  # 30 minutes for the response
             )
             
-        print()  # New line after progress
-            
-        if response.status_code != 200:
-            print(f"❌ Upload failed with status code: {response.status_code}")
-            if hasattr(response, 'text') and response.text:
-                print(f"📝 Response: {response.text[:500]}...")
-            return False
-        
-        return True
-        
+        return response
+    
+    except UploadStalled:
+        raise
     except Exception as e:
+        stall = watchdog.stalled() if watchdog else None
+        if stall:
+            raise stall from e
         print(f"💥 Toolbelt upload failed: {str(e)[:200]}...")
-        return False
+        return None
+    finally:
+        if watchdog:
+            watchdog.stop()
 
 
-def _upload_with_fallback(url, upgrade_file, bytes_size):
-    """Fallback chunked upload method without requests-toolbelt"""
+def _upload_with_sendfile(url, upgrade_file, bytes_size, offset=0, headers=None, session=None, watchdog=None,
+                          progress=None, hasher=None):
+    """Zero-copy upload: multipart envelope around a sendfile()-streamed body"""
+    session = session or get_session(url)
+    # sendfile() bypasses the session's adapter, so the request is recorded here
+    started = time.perf_counter()
+    status = None
     try:
-        class SimpleFileReader:
-            def __init__(self, file_path, file_size):
-                self.file = open(file_path, 'rb')
-                self.file_size = file_size
-                self.bytes_read = 0
-                self.last_percent = -1
-                
-            def read(self, size=65536):  # 64KB chunks
-                chunk = self.file.read(size)
-                self.bytes_read += len(chunk)
-                
-                percent = int((self.bytes_read / self.file_size) * 100)
-                if percent != self.last_percent and percent % 5 == 0:  # Update every 5%
-                    mb_uploaded = self.bytes_read / (1024*1024)
-                    total_mb = self.file_size / (1024*1024)
-                    print(f"\r   ⬆️  {percent}% - {mb_uploaded:.1f} MB / {total_mb:.1f} MB", end='', flush=True)
-                    self.last_percent = percent
-                    
-                return chunk
-            
-            def __len__(self):
-                return self.file_size
-                
-            def close(self):
-                self.file.close()
+        def progress_callback(bytes_sent):
+            """Called once per block, not per read"""
+            if progress:
+                progress.update(offset + bytes_sent)
+            if watchdog:
+                watchdog.sample(bytes_sent)
         
-        file_reader = SimpleFileReader(upgrade_file, bytes_size)
-        try:
-            files = {'Filedata': (os.path.basename(upgrade_file), file_reader, 'application/octet-stream')}
-            response = session.post(url, files=files, verify=False, timeout=1800)
-        finally:
-            file_reader.close()
-            print()  # New line after progress
+        if watchdog:
+            # Small blocks so a slow link still reports progress often enough to judge throughput;
+            # a tripped watchdog shuts the socket down to unblock sendfile()
+            def on_socket(sock):
+                watchdog.start(abort=lambda: sock.shutdown(socket.SHUT_RDWR))
             
-        if response.status_code != 200:
-            print(f"❌ Upload failed with status code: {response.status_code}")
-            if hasattr(response, 'text') and response.text:
-                print(f"📝 Response: {response.text[:500]}...")
-            return False
-        
-        return True
+            response = upload_with_sendfile(session, url, upgrade_file, bytes_size, offset, headers,
+                                            timeout=1800, on_progress=progress_callback,
+                                            send_timeout=watchdog.stall_seconds, block_size=STALL_BLOCK_SIZE,
+                                            on_socket=on_socket, hasher=hasher)
+        else:
+            response = upload_with_sendfile(session, url, upgrade_file, bytes_size, offset, headers,
+                                            timeout=1800, on_progress=progress_callback, hasher=hasher)
+        status = response.status_code
+        request_metrics.record('POST', url, status, time.perf_counter() - started, bytes_size - offset,
+                               len(response.content or b''))
+        return response
         
+    except UploadStalled as e:
+        request_metrics.record('POST', url, type(e).__name__, time.perf_counter() - started, bytes_size - offset)
+        raise
     except Exception as e:
-        print(f"💥 Fallback upload failed: {str(e)[:200]}...")
-        return False
+        if status is None:
+            request_metrics.record('POST', url, type(e).__name__, time.perf_counter() - started, bytes_size - offset)
+        stall = watchdog.stalled() if watchdog else None
+        if stall:
+            raise stall from e
+        print(f"💥 Sendfile upload failed: {str(e)[:200]}...")
+        return None
+    finally:
+        if watchdog:
+            watchdog.stop()
 
 
-def update_status(base_url):
+# Reachability states, in the order a rebooting controller passes through them
+PROBE_DOWN = 'down'
+PROBE_PORT_OPEN = 'port_open'
+PROBE_API_READY = 'api_ready'
+
+# The TCP connect must be quick, a loaded or distant controller gets longer for TLS and the HTTP answer
+PROBE_CONNECT_TIMEOUT = 0.8
+PROBE_RESPONSE_TIMEOUT = 5
+# Poll the update status anyway after this many port_open checks in a row
+PROBE_PORT_OPEN_LIMIT = 5
+
+class ReachabilityProbe:
+    """
+    Cheap unauthenticated check of how far a controller is through its reboot.
+    
+    Each check opens a TCP connection with a sub-second timeout, then completes
+    the TLS handshake (for https) and sends one bare HTTP request with a few
+    seconds for both:
+    
+    - down: nothing accepts the connection
+    - port_open: the port accepts connections but the handshake fails or the
+      web server does not answer yet / answers 5xx while services start
+    - api_ready: the management API answers (any status below 500, including
+      401), so authenticated calls are worth making again
+    
+    Transitions are recorded with their time since the probe was created.
+    A controller stuck at port_open may just answer the probe slowly, so
+    worth_polling() also allows an authenticated poll after
+    PROBE_PORT_OPEN_LIMIT port_open checks in a row.
+    """
+    
+    def __init__(self, base_url, timeout=PROBE_CONNECT_TIMEOUT, path='/mgmt/system/user/accessibility',
+                 response_timeout=PROBE_RESPONSE_TIMEOUT):
+        parts = urlsplit(base_url if '//' in base_url else f"https://{base_url}")
+        self.host = parts.hostname
+        self.tls = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.tls else 80)
+        self.timeout = timeout
+        self.response_timeout = response_timeout
+        self.path = path
+        self.state = None
+        self.port_open_checks = 0
+        self.transitions = []
+        self.started = time.time()
+        self._context = ssl.create_default_context()
+        self._context.check_hostname = False
+        self._context.verify_mode = ssl.CERT_NONE
+    
+    def probe(self):
+        """Run one TCP -> TLS -> HTTP probe and return the state reached"""
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError:
+            return PROBE_DOWN
+        
+        try:
+            sock.settimeout(self.response_timeout)
+            if self.tls:
+                sock = self._context.wrap_socket(sock, server_hostname=self.host)
+            sock.sendall(f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: close\r\n\r\n".encode())
+            status_line = sock.recv(64).split(b'\r\n', 1)[0].split()
+            if len(status_line) >= 2 and status_line[0].startswith(b'HTTP/') and int(status_line[1]) < 500:
+                return PROBE_API_READY
+            return PROBE_PORT_OPEN
+        except (OSError, ValueError):
+            return PROBE_PORT_OPEN
+        finally:
+            sock.close()
+    
+    def check(self, state=None):
+        """Probe (unless the state was found otherwise), record and announce a change, return the state"""
+        state = state or self.probe()
+        self.port_open_checks = self.port_open_checks + 1 if state == PROBE_PORT_OPEN else 0
+        if state != self.state:
+            elapsed = time.time() - self.started
+            if self.state is not None:
+                labels = {PROBE_DOWN: '🔌 Controller went down', PROBE_PORT_OPEN: '🔓 Management port is open',
+                          PROBE_API_READY: '🌐 Management API is answering'}
+                print(f"\n{labels[state]} ({int(elapsed)//60:02d}:{int(elapsed)%60:02d})", flush=True)
+            self.transitions.append({'state': state, 'at': round(elapsed, 1)})
+            self.state = state
+        return state
+    
+    def worth_polling(self, state):
+        """True when authenticated requests are worth making in the given (just checked) state"""
+        return state == PROBE_API_READY or (state == PROBE_PORT_OPEN and
+                                            self.port_open_checks >= PROBE_PORT_OPEN_LIMIT)
+
+
+def update_status(base_url, session=None):
     """Enhanced update status check with multiple fallback methods"""
+    session = session or get_session(base_url)
     try:
         # Primary method: Check settings base params
         url = f"{base_url}/mgmt/system/config/item/settingsbaseparams"
-        response = session.get(url, verify=False, timeout=30)
+        # Short connect timeout: the controller may have gone down since the last probe
+        response = session.get(url, verify=False, timeout=(3, 30))
         
         if response.status_code == 200 and response.text.strip():
             return response.json()
         elif response.status_code == 401:
             # Session expired - return None to trigger re-login
             print("\n🔑 Session expired - will attempt re-login", flush=True)
+            session_pool.mark_authenticated(base_url, False)
             return None
         
         # Fallback method 1: Check system status
         fallback_url = f"{base_url}/mgmt/system/status"
-        fallback_response = session.get(fallback_url, verify=False, timeout=20)
+        fallback_response = session.get(fallback_url, verify=False, timeout=(3, 20))
         
         if fallback_response.status_code == 200 and fallback_response.text.strip():
             fallback_data = fallback_response.json()
@@ -462,6 +1298,7 @@ def update_status(base_url):
         elif fallback_response.status_code == 401:
             # Session expired - return None to trigger re-login
             print("\n🔑 Session expired - will attempt re-login", flush=True)
+            session_pool.mark_authenticated(base_url, False)
             return None
         
         # If both fail, server might be rebooting
@@ -481,47 +1318,91 @@ def update_status(base_url):
         return None
 
 
-def download_df_config(base_url):
+class MultipartStream:
+    """
+    Single-part multipart body built from an iterable of chunks. It has a length, so
+    requests sends a Content-Length header and streams the chunks instead of buffering.
+    """
     
+    def __init__(self, filename, chunks, size, field_name='Filedata'):
+        self.preamble, self.epilogue, self.content_type = multipart_envelope(filename, field_name)
+        self.chunks = chunks
+        self.size = size
+    
+    def __len__(self):
+        return len(self.preamble) + self.size + len(self.epilogue)
+    
+    def __iter__(self):
+        yield self.preamble
+        sent = 0
+        for chunk in self.chunks:
+            sent += len(chunk)
+            yield chunk
+        if sent != self.size:
+            raise IOError(f"Configuration stream ended after {sent:,} of {self.size:,} bytes")
+        yield self.epilogue
+
+
+def _df_config_filename(response):
+    """File name of an exported configuration, from Content-Disposition or a timestamp"""
+    if 'Content-Disposition' in response.headers:
+        # Extract filename from Content-Disposition
+        content_disposition = response.headers['Content-Disposition']
+        return content_disposition.split('filename=')[-1].strip('"')
+    # If no Content-Disposition header, create a default filename
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"DefenseFlowConfiguration_{timestamp}.zip"
+    print(f"No filename in response, using default: {filename}")
+    return filename
+
+
+def _export_df_config(base_url, session):
+    """Start the configuration export, returns the streaming response or None"""
     print('Exporting DefenseFlow Configuration from Vision')
     url = f"{base_url}/mgmt/device/df/config/getfromdevice?saveToDb=false&type=config"
     response = session.get(url, stream=True, verify=False)
     
     if response.status_code != 200:
         print(f"Failed to download config file. Status code: {response.status_code}")
+        response.close()
         return None
-    
-    # Open the file in binary write mode and download it in chunks
-    if 'Content-Disposition' in response.headers:
-        # Extract filename from Content-Disposition
-        content_disposition = response.headers['Content-Disposition']
-        filename = content_disposition.split('filename=')[-1].strip('"')
-    else:
-        # If no Content-Disposition header, create a default filename
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"DefenseFlowConfiguration_{timestamp}.zip"
-        print(f"No filename in response, using default: {filename}")
-    
+    return response
+
+
+def _save_df_config(response, filename):
+    """Write an export response to filename, returns filename or None"""
     try:
         with open(filename, 'wb') as file:
             for chunk in response.iter_content(chunk_size=8192):
                 if chunk:  # Filter out keep-alive new chunks
                     file.write(chunk)
-
+        
         print(f'Successfully Exported File {filename}')
         return filename
     except Exception as e:
         print(f"Error saving file: {e}")
         return None
-   
+    finally:
+        response.close()
+
+
+def download_df_config(base_url, session=None, directory=None):
+    """Export the configuration to a file (in directory if given), returns its path or None"""
+    session = session or get_session(base_url)
+    response = _export_df_config(base_url, session)
+    if response is None:
+        return None
+    filename = _df_config_filename(response)
+    if directory:
+        filename = os.path.join(directory, os.path.basename(filename))
+    return _save_df_config(response, filename)
+
 
-def upload_df_config(filename, base_url):
+def _import_df_config(base_url, filename, body, session):
+    """Post a configuration body to the import endpoint, exits on failure"""
     try:
-        print('Importing DefenseFlow Configuration to Cyber-Controller Plus')
         url = f"{base_url}/mgmt/device/df/config/sendtodevice?fileName={filename}&type=config"
-        files = {'Filedata': ('DefenseFlow-To-CCPlus.code-workspace', open(filename, 'rb'), 'application/octet-stream')}
-        r = session.post(url, files=files, verify=False)
+        r = session.post(url, data=body, headers={'Content-Type': body.content_type}, verify=False)
         
         if r.status_code != 200:
             print(f"Error - Cyber-Controller: status code {r.status_code} with message {r.text}")
@@ -547,37 +1428,245 @@ def upload_df_config(filename, base_url):
         print(f"Request error during upload: {e}")
         exit(1)
 
+
+def upload_df_config(filename, base_url, session=None, remote_name=None):
+    """Import a configuration file; remote_name is the file name reported to the controller"""
+    session = session or get_session(base_url)
+    print('Importing DefenseFlow Configuration to Cyber-Controller Plus')
+    with open(filename, 'rb') as f:
+        chunks = iter(lambda: f.read(DF_STREAM_CHUNK_SIZE), b'')
+        body = MultipartStream(DF_IMPORT_PART_NAME, chunks, os.fstat(f.fileno()).st_size)
+        _import_df_config(base_url, remote_name or os.path.basename(filename), body, session)
+
+
+def migrate_df_config(source_url, target_url, tee_dir=None, buffer_chunks=DF_STREAM_BUFFER_CHUNKS,
+                      source_session=None, target_session=None):
+    """
+    Pipe the configuration export of source_url straight into the import on target_url.
+    
+    A reader thread moves the export body into a bounded queue of buffer_chunks chunks
+    that the streamed import drains, so memory stays bounded and the migration takes
+    about one transfer time. With tee_dir a copy is written there as well. When the
+    export size is unknown (no Content-Length, or a compressed body) the export is
+    saved first and imported from disk. Returns the configuration file name, or None
+    when the export fails; exits like upload_df_config() when the import fails.
+    """
+    source_session = source_session or get_session(source_url)
+    target_session = target_session or get_session(target_url)
+    
+    response = _export_df_config(source_url, source_session)
+    if response is None:
+        return None
+    filename = _df_config_filename(response)
+    tee_path = os.path.join(tee_dir, os.path.basename(filename)) if tee_dir else None
+    
+    size = response.headers.get('Content-Length')
+    if size is None or response.headers.get('Content-Encoding', 'identity') != 'identity':
+        print("⚠️ Export size unknown - saving the configuration before importing it")
+        saved = _save_df_config(response, tee_path or filename)
+        if saved:
+            upload_df_config(saved, target_url, target_session)
+        return saved
+    
+    print(f"🔀 Streaming DefenseFlow Configuration ({int(size) / (1024*1024):.1f} MB) to Cyber-Controller Plus"
+          f"{f', copy: {tee_path}' if tee_path else ''}")
+    buffer = queue.Queue(maxsize=buffer_chunks)
+    stop = threading.Event()
+    
+    def put(item):
+        # Give up when the import side has stopped reading
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def read_export():
+        tee = None
+        try:
+            tee = open(tee_path, 'wb') if tee_path else None
+            for chunk in response.iter_content(chunk_size=DF_STREAM_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                if tee:
+                    tee.write(chunk)
+                if not put(chunk):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+        finally:
+            if tee:
+                tee.close()
+            response.close()
+    
+    def chunks():
+        while True:
+            item = buffer.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    
+    reader = threading.Thread(target=read_export, daemon=True)
+    reader.start()
+    try:
+        _import_df_config(target_url, filename, MultipartStream(DF_IMPORT_PART_NAME, chunks(), int(size)), target_session)
+    finally:
+        stop.set()
+        reader.join()
+    return tee_path or filename
+
 # Helper functions for better organization
 
 def wait_for_ha_disable(base_url_primary):
-    """Wait for HA to be disabled with progress indication"""
+    """Wait for HA to be disabled with progress indication (see HAStatusWatcher)"""
     print("🔄 Waiting for HA to be disabled...")
-    ha = True
     check_count = 0
     spinner = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
     start_time = time.time()
     
-    while ha:
+    def on_update(ha_result):
+        nonlocal check_count
         check_count += 1
         elapsed_time = int(time.time() - start_time)
-        ha_result = ha_status(base_url_primary)
-        
-        # Handle case where ha_status returns None due to error
+        # ha_status returns None on errors
         if ha_result is None:
             print(f"\r{spinner[check_count % len(spinner)]} Checking HA status... ({elapsed_time//60:02d}:{elapsed_time%60:02d})", end='', flush=True)
-            time.sleep(20)  # Reduced from 40 to 20 seconds for server issues
-            continue
-            
-        if ha_result.get('haStatus') == 'disabled':
-            ha = False
-            print(f"\n✅ HA is now disabled! (took {elapsed_time//60:02d}:{elapsed_time%60:02d})")
         else:
             current_status = ha_result.get('haStatus', 'unknown')
             print(f"\r{spinner[check_count % len(spinner)]} HA Status: {current_status} - waiting for disable... ({elapsed_time//60:02d}:{elapsed_time%60:02d})", end='', flush=True)
-            time.sleep(5)  # Reduced from 10 to 5 seconds for faster response
+    
+    get_ha_watcher(base_url_primary).wait_for(lambda ha_result: bool(ha_result) and ha_result.get('haStatus') == 'disabled',
+                                              on_update)
+    elapsed_time = int(time.time() - start_time)
+    print(f"\n✅ HA is now disabled! (took {elapsed_time//60:02d}:{elapsed_time%60:02d})")
+
+# Recorded durations of past upgrades, used to tune update status polling
+UPGRADE_HISTORY_FILE = 'upgrade_history.json'
+UPGRADE_HISTORY_LIMIT = 50
+
+def load_upgrade_history(path=UPGRADE_HISTORY_FILE):
+    """Load recorded upgrade durations (oldest first)"""
+    try:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+    except Exception:
+        pass
+    return []
 
-def wait_for_version_update(base_url, username, password):
-    """Enhanced version update monitoring with timeout and better progress detection"""
+def record_upgrade_history(entry, path=UPGRADE_HISTORY_FILE):
+    """Append an upgrade record, keeping only the most recent ones"""
+    history = load_upgrade_history(path)
+    history.append(entry)
+    try:
+        with open(path, 'w') as f:
+            json.dump(history[-UPGRADE_HISTORY_LIMIT:], f, indent=2)
+    except Exception as e:
+        print(f"⚠️ Could not save upgrade history: {e}")
+
+
+def recorded_target_version(image_sha256, path=UPGRADE_HISTORY_FILE):
+    """Version a controller reported after an earlier successful upgrade with this image, None if unknown"""
+    if not image_sha256:
+        return None
+    for entry in reversed(load_upgrade_history(path)):
+        if entry.get('image_sha256') == image_sha256 and entry.get('new_version'):
+            return entry['new_version']
+    return None
+
+def image_file_version(upgrade_file):
+    """Dotted version number in the image file name (e.g. 10.9.0.0), None if there is none"""
+    match = re.search(r'(\d+(?:\.\d+){2,})', os.path.basename(upgrade_file))
+    return match.group(1) if match else None
+
+def same_version(current, target):
+    """Compare versions by their numeric components, ignoring trailing zeros (10.9.0 == 10.9.0.0)"""
+    def parts(version):
+        numbers = [int(n) for n in re.findall(r'\d+', str(version))]
+        while numbers and numbers[-1] == 0:
+            numbers.pop()
+        return numbers
+    return bool(parts(target)) and parts(current) == parts(target)
+
+
+class UpdatePollingStrategy:
+    """
+    Decides how long to wait between update status polls.
+    
+    - while the controller is still up before its reboot: a steady interval,
+      relaxed when past upgrades say the reboot is still far away
+    - while it is down: exponential backoff with jitter, capped so the next
+      poll lands around the time past upgrades came back up
+    - once it answers again after being down: fast polling, since completion
+      is only a few status changes away
+    
+    While only the cheap reachability probe runs (the API is not answering),
+    the backoff is capped at probe_interval.
+    """
+    
+    def __init__(self, history=None, controller=None, fast_interval=3, up_interval=15, slow_interval=30,
+                 min_backoff=5, max_backoff=60, jitter=0.2, probe_interval=5):
+        self.fast_interval = fast_interval
+        self.probe_interval = probe_interval
+        self.up_interval = up_interval
+        self.slow_interval = slow_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        
+        # Prefer this controller's own history when there is enough of it
+        history = history or []
+        own = [h for h in history if h.get('controller') == controller]
+        samples = own if len(own) >= 3 else history
+        self.expected_down_at = self._median(samples, 'down_at')
+        self.expected_up_at = self._median(samples, 'up_at')
+        self.expected_total = self._median(samples, 'total')
+    
+    @staticmethod
+    def _median(samples, key):
+        values = [h[key] for h in samples if h.get(key) is not None]
+        return statistics.median(values) if values else None
+    
+    def _jittered(self, interval):
+        return max(1.0, interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+    
+    def next_interval(self, elapsed, responding, failures=0, came_back=False, probing=False):
+        """Seconds to wait before the next poll"""
+        if responding:
+            if came_back:
+                return self._jittered(self.fast_interval)
+            if self.expected_total and elapsed >= self.expected_total * 0.9:
+                return self._jittered(self.fast_interval)
+            if self.expected_down_at and elapsed < self.expected_down_at * 0.7:
+                return self._jittered(self.slow_interval)
+            return self._jittered(self.up_interval)
+        
+        backoff = min(self.max_backoff, self.min_backoff * 2 ** max(0, failures - 1))
+        if self.expected_up_at:
+            remaining = self.expected_up_at - elapsed
+            # Overdue: keep checking often rather than backing off further
+            backoff = min(backoff, max(self.fast_interval * 2, remaining))
+        if probing:
+            backoff = min(backoff, self.probe_interval)
+        return self._jittered(backoff)
+
+
+def wait_for_version_update(base_url, username, password, image_sha256=None):
+    """
+    Enhanced version update monitoring with timeout and better progress detection
+    
+    Polling adapts to the reboot (see UpdatePollingStrategy) and is tuned from
+    UPGRADE_HISTORY_FILE. Every cycle starts with a ReachabilityProbe; status
+    requests and logins are only made once the management API answers.
+    Returns a dict with the monitoring timings, including detection_latency:
+    the upper bound on how late completion was noticed.
+    The new version is recorded with image_sha256, see recorded_target_version().
+    """
     print(f"\n📊 Monitoring Update Progress")
     print(f"{'='*50}")
     
@@ -585,15 +1674,26 @@ def wait_for_version_update(base_url, username, password):
     version = update_status(base_url)
     current_version = version.get('software_version') if version else None
     start_time = time.time()
+    monitor_start = start_time
     check_count = 0
     consecutive_failures = 0
-    max_consecutive_failures = 20  # Allow up to 20 consecutive failures (10 minutes)
+    max_unresponsive_time = 600  # Ask the operator after 10 minutes without any answer
+    unresponsive_since = None
+    down_at = None
+    up_at = None
+    interval = 0
+    
+    strategy = UpdatePollingStrategy(load_upgrade_history(), controller=base_url)
+    prober = ReachabilityProbe(base_url)
+    stats = {'controller': base_url, 'completed': False, 'previous_version': current_version}
     
     # Progress indicators
     spinner = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
     
     print(f"🎯 Starting version: {current_version}")
     print(f"⏱️  Maximum wait time: ~45 minutes")
+    if strategy.expected_total:
+        print(f"📈 Past upgrades took ~{int(strategy.expected_total)//60:02d}:{int(strategy.expected_total)%60:02d}, polling tuned accordingly")
     
     while ver_update:
         check_count += 1
@@ -606,42 +1706,60 @@ def wait_for_version_update(base_url, username, password):
             response = input("Continue waiting? (y/n): ").lower().strip()
             if response in ['n', 'no']:
                 print("🛑 Monitoring stopped by user. Update may still be in progress.")
-                return
+                return stats
             else:
                 start_time = time.time()  # Reset timer
                 consecutive_failures = 0
+                unresponsive_since = None
         
-        update_result = update_status(base_url)
+        # Only spend full (authenticated) requests once the API answers at all
+        reachability = prober.check()
+        polling = prober.worth_polling(reachability)
+        update_result = update_status(base_url) if polling else None
+        monitor_elapsed = time.time() - monitor_start
         
-        # Handle case where update_status returns None due to error
+        # Handle case where the controller is rebooting or update_status returned None due to error
         if update_result is None:
             consecutive_failures += 1
-            print(f"\r{spinner[check_count % len(spinner)]} Server not responding... ({consecutive_failures}/15 attempts) ({elapsed_time//60:02d}:{elapsed_time%60:02d})", end='', flush=True)
+            if down_at is None:
+                down_at = monitor_elapsed
+            if unresponsive_since is None:
+                unresponsive_since = time.time()
             
-            # Try to re-login after several failures (server might have rebooted)
-            if consecutive_failures >= 5 and consecutive_failures % 3 == 0:
+            # The controller answered with 401 - it is back up and needs a fresh login
+            relogged = False
+            if polling and not session_pool.is_authenticated(base_url):
                 print(f"\n🔑 Attempting to re-login after server reboot...")
                 if login(base_url, username, password):
                     print("✅ Re-login successful after reboot")
-                    consecutive_failures = 0  # Reset counter after successful login
+                    relogged = True
                 else:
                     print("❌ Re-login failed - server may still be rebooting")
             
-            if consecutive_failures >= max_consecutive_failures:
+            if time.time() - unresponsive_since >= max_unresponsive_time:
                 print(f"\n⚠️  Server has been unresponsive for too long ({consecutive_failures} attempts)")
                 print(f"💡 This usually means the update is progressing and the server is rebooting")
                 print(f"🌐 You can check progress at: {base_url}")
                 response = input("Continue waiting? (y/n): ").lower().strip()
                 if response in ['n', 'no']:
                     print("🛑 Monitoring stopped by user")
-                    return
+                    return stats
                 else:
-                    consecutive_failures = 0  # Reset counter
+                    unresponsive_since = time.time()  # Reset counter
             
-            time.sleep(30)
+            if relogged:
+                interval = strategy.next_interval(monitor_elapsed, responding=True, came_back=True)
+            else:
+                interval = strategy.next_interval(monitor_elapsed, responding=False, failures=consecutive_failures,
+                                                  probing=not polling)
+            print(f"\r{spinner[check_count % len(spinner)]} Server not responding ({reachability})... ({consecutive_failures} attempts, next check in {interval:.0f}s) ({elapsed_time//60:02d}:{elapsed_time%60:02d})", end='', flush=True)
+            time.sleep(interval)
             continue
         else:
             consecutive_failures = 0  # Reset failure counter on successful response
+            unresponsive_since = None
+            if down_at is not None and up_at is None:
+                up_at = monitor_elapsed
             
         # Check for completion
         upgrade_status = update_result.get('lastUpgradeStatus', 'In Progress')
@@ -649,83 +1767,255 @@ def wait_for_version_update(base_url, username, password):
         
         if (upgrade_status == 'OK' and new_version != current_version):
             ver_update = False
+            # Completion happened at some point since the previous poll
+            stats.update({
+                'completed': True,
+                'new_version': new_version,
+                'total': round(monitor_elapsed, 1),
+                'down_at': round(down_at, 1) if down_at is not None else None,
+                'up_at': round(up_at, 1) if up_at is not None else None,
+                'detection_latency': round(interval, 1),
+                'polls': check_count,
+                'reachability': prober.transitions
+            })
             print(f"\n✅ Version update completed successfully!")
             print(f"🎯 Previous version: {current_version}")
             print(f"🎯 New version: {new_version}")
             print(f"⏱️  Total time: {elapsed_time//60:02d}:{elapsed_time%60:02d}")
+            print(f"⏱️  Completion detected within {interval:.0f}s ({check_count} status checks)")
+            record_upgrade_history({
+                'controller': base_url,
+                'finished_at': datetime.now(timezone.utc).isoformat(),
+                'total': stats['total'],
+                'down_at': stats['down_at'],
+                'up_at': stats['up_at'],
+                'detection_latency': stats['detection_latency'],
+                'new_version': new_version,
+                'image_sha256': image_sha256
+            })
         elif upgrade_status == 'Failed':
             print(f"\n❌ Update failed according to server status")
             print(f"💡 Check the web interface for more details: {base_url}")
-            return
+            stats['failed'] = True
+            return stats
         else:
+            interval = strategy.next_interval(monitor_elapsed, responding=True, came_back=up_at is not None)
             print(f"\r{spinner[check_count % len(spinner)]} Update in progress... Status: {upgrade_status} | Version: {new_version} ({elapsed_time//60:02d}:{elapsed_time%60:02d})", end='', flush=True)
-            time.sleep(20)  # Slightly longer wait for more stable monitoring
+            time.sleep(interval)
+    
+    return stats
+
+def ha_healthy(ha_result):
+    """True when an ha_status() result reports both nodes healthy"""
+    return bool(ha_result) and ha_result.get("primaryHealth") == 'healthy' and ha_result.get("secondaryHealth") == 'healthy'
 
 def wait_for_ha_healthy(base_url_primary):
-    """Wait for HA to be healthy on both nodes with progress indication"""
+    """Wait for HA to be healthy on both nodes with progress indication (see HAStatusWatcher)"""
     print("🔄 Waiting for HA to be healthy...")
-    ha = True
     check_count = 0
     spinner = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
     start_time = time.time()
     
-    while ha:
+    def on_update(ha_result):
+        nonlocal check_count
         check_count += 1
         elapsed_time = int(time.time() - start_time)
-        ha_result = ha_status(base_url_primary)
-        
-        # Handle case where ha_status returns None due to error
+        # ha_status returns None on errors
         if ha_result is None:
             print(f"\r{spinner[check_count % len(spinner)]} Checking HA health status... ({elapsed_time//60:02d}:{elapsed_time%60:02d})", end='', flush=True)
-            time.sleep(8)  # Reduced from 10 to 8 seconds
-            continue
-            
-        primary_health = ha_result.get("primaryHealth", "unknown")
-        secondary_health = ha_result.get("secondaryHealth", "unknown")
-        
-        if primary_health == 'healthy' and secondary_health == 'healthy':
-            ha = False
-            print(f"\n✅ HA is healthy on both nodes! (took {elapsed_time//60:02d}:{elapsed_time%60:02d})")
-            print(f"   📊 Primary: {primary_health} | Secondary: {secondary_health}")
         else:
+            primary_health = ha_result.get("primaryHealth", "unknown")
+            secondary_health = ha_result.get("secondaryHealth", "unknown")
             print(f"\r{spinner[check_count % len(spinner)]} HA Health - Primary: {primary_health} | Secondary: {secondary_health} ({elapsed_time//60:02d}:{elapsed_time%60:02d})", end='', flush=True)
-            time.sleep(8)  # Reduced from 10 to 8 seconds
+    
+    ha_result = get_ha_watcher(base_url_primary).wait_for(ha_healthy, on_update)
+    elapsed_time = int(time.time() - start_time)
+    print(f"\n✅ HA is healthy on both nodes! (took {elapsed_time//60:02d}:{elapsed_time%60:02d})")
+    print(f"   📊 Primary: {ha_result.get('primaryHealth')} | Secondary: {ha_result.get('secondaryHealth')}")
+
+def _rejected(status):
+    """True for a client error that is about the request itself, not the session or the load"""
+    return status is not None and 400 <= status < 500 and status not in (401, 429)
 
-def disable_protected_objects(base_url):
-    """Disable all protected objects on the given server"""
-    print("Disabling protected objects...")
-    data = get_po_names(base_url)
-    if not data:
+def disable_protected_objects(base_url, session=None, batch_size=PO_BATCH_SIZE, reconcile=False):
+    """
+    Disable all protected objects on the given server
+    
+    Names are sent batch_size at a time (the disable endpoint takes a list). A batch
+    the controller rejects (a 4xx other than 401/429) is split in half until the
+    offending names are isolated. Server errors, auth failures and unanswered requests
+    fail the whole batch, since they say nothing about the names.
+    With reconcile=True objects the listing already shows as disabled are skipped.
+    Returns {'disabled': [...], 'failed': [{'name', 'status', 'error'}], 'unchanged': n, 'requests': n}.
+    """
+    session = session or get_session(base_url)
+    url = f"{base_url}/mgmt/v2/device/df/restv2/protected-objects/configure/?action=disable"
+    relogin_lock = threading.Lock()
+    report = {'disabled': [], 'failed': [], 'unchanged': 0, 'requests': 0}
+    print(f"Disabling protected objects (batches of {batch_size}{', reconcile' if reconcile else ''})...")
+    
+    def disable(names):
+        result = _put_with_retry(base_url, url, names, session, relogin_lock, retry_rejected=False)
+        report['requests'] += result['attempts']
+        if result['ok']:
+            report['disabled'].extend(names)
+        elif len(names) > 1 and _rejected(result['status']):
+            # Rejected as a whole - bisect to find the names the controller refuses
+            middle = len(names) // 2
+            disable(names[:middle])
+            disable(names[middle:])
+        else:
+            report['failed'].extend({'name': name, 'status': result['status'], 'error': result['error']} for name in names)
+    
+    batch = []
+    try:
+        for obj in iter_protected_objects(base_url, session):
+            if reconcile and po_is_disabled(obj):
+                report['unchanged'] += 1
+                continue
+            batch.append(obj['name'])
+            if len(batch) >= batch_size:
+                disable(batch)
+                batch = []
+        if batch:
+            disable(batch)
+    except requests.exceptions.RequestException as e:
+        print(f"Request error: {e}")
+    
+    total = len(report['disabled']) + len(report['failed']) + report['unchanged']
+    if not total:
         print("No protected objects found")
+        return report
+    already = f" ({report['unchanged']} already disabled)" if reconcile else ''
+    print(f"Disabled {len(report['disabled'])}/{total} protected objects in {report['requests']} requests{already}")
+    for failure in report['failed']:
+        print(f"  ❌ {failure['name']}: {failure['error']}")
+    return report
+
+def _put_with_retry(base_url, url, payload, session, relogin_lock, attempts=BULK_ATTEMPTS, timeout=30,
+                    retry_rejected=True):
+    """
+    PUT payload, retrying connection errors, timeouts and non-200 answers with a short backoff.
+    A 401 logs in again with the controller's stored credentials first. With retry_rejected=False
+    client errors other than 401/429 are returned at once, since repeating them will not help.
+    Returns {'ok', 'status', 'attempts', 'error'}.
+    """
+    result = {'ok': False, 'status': None, 'attempts': 0, 'error': None}
+    for attempt in range(attempts):
+        result['attempts'] = attempt + 1
+        try:
+            response = session.put(url, json=payload, verify=False, timeout=timeout)
+            result['status'] = response.status_code
+            if response.status_code == 200:
+                result['ok'] = True
+                result['error'] = None
+                break
+            result['error'] = response.text[:200] if response.text else f"HTTP {response.status_code}"
+            if response.status_code == 401:
+                # One worker logs in again, the others just retry on the refreshed session
+                with relogin_lock:
+                    if session_pool.is_authenticated(base_url):
+                        session_pool.mark_authenticated(base_url, False)
+                        username, password = session_pool.credentials(base_url)
+                        if username and password:
+                            login(base_url, username, password, session)
+            elif not retry_rejected and 400 <= response.status_code < 500 and response.status_code != 429:
+                break
+        except requests.exceptions.RequestException as e:
+            result['status'] = None
+            result['error'] = str(e)[:200]
+        if attempt < attempts - 1:
+            time.sleep(2 ** attempt)
+    return result
+
+def bulk_put(base_url, items, workers=BULK_WORKERS, attempts=BULK_ATTEMPTS, timeout=30, session=None):
+    """
+    Send many independent PUTs to one controller through a bounded worker pool.
+    
+    items is an iterable of (name, url, payload) and is consumed lazily, with at most
+    a few requests per worker in flight, so it can be a generator over a paginated
+    collection. Each PUT is retried on its own (see _put_with_retry). Returns one
+    result per item, in input order: {'name', 'ok', 'status', 'attempts', 'seconds', 'error'}.
+    """
+    session = session or get_session(base_url)
+    relogin_lock = threading.Lock()
+    
+    def put_one(item):
+        name, url, payload = item
+        started = time.time()
+        result = _put_with_retry(base_url, url, payload, session, relogin_lock, attempts, timeout)
+        return {'name': name, **result, 'seconds': round(time.time() - started, 2)}
+    
+    results = []
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for item in items:
+            in_flight.append(executor.submit(put_one, item))
+            if len(in_flight) >= workers * 2:
+                results.append(in_flight.popleft().result())
+        while in_flight:
+            results.append(in_flight.popleft().result())
+    return results
+
+
+def print_bulk_results(results, title, max_rows=30):
+    """Print a per-item result table for bulk_put() (only failures beyond max_rows items)"""
+    if not results:
         return
-        
-    for po_name in data:
-        url = f"{base_url}/mgmt/v2/device/df/restv2/protected-objects/configure/?action=disable" 
-        payload = [po_name]  # Send as a list with the protected object name
-        response = session.put(url, json=payload, verify=False)
-
-def update_network_elements_router_id(base_url, router_id):
-    """Update router ID for all network elements"""
-    print(f"Updating network elements with router ID: {router_id}")
-    elements_names = get_net_element_names(base_url)
-    if not elements_names:
+    rows = results if len(results) <= max_rows else [r for r in results if not r['ok']]
+    width = max([24] + [len(str(r['name'])) for r in rows])
+    print(f"\n📊 {title}")
+    if rows:
+        print(f"  {'Name':<{width}} {'Result':<7} {'HTTP':>4} {'Tries':>5} {'Time':>7}  Error")
+    for r in rows:
+        print(f"  {r['name']:<{width}} {'ok' if r['ok'] else 'FAILED':<7} {r['status'] or '-':>4} "
+              f"{r['attempts']:>5} {r['seconds']:>6.1f}s  {'' if r['ok'] else r['error'] or ''}")
+    failed = [r for r in results if not r['ok']]
+    slowest = max(r['seconds'] for r in results)
+    print(f"  {len(results) - len(failed)}/{len(results)} succeeded, slowest took {slowest:.1f}s")
+
+def update_network_elements_router_id(base_url, router_id, session=None, workers=BULK_WORKERS, reconcile=False):
+    """
+    Update router ID for all network elements
+    
+    The PUTs run concurrently through bulk_put(); returns its per-element results
+    (None when the element list could not be read). With reconcile=True elements
+    that already carry router_id are not written and are returned with unchanged=True.
+    """
+    session = session or get_session(base_url)
+    print(f"Updating network elements with router ID: {router_id}{' (reconcile)' if reconcile else ''}")
+    unchanged = []
+    
+    def changes():
+        # Elements are updated while later pages are still being fetched
+        for element in iter_network_elements(base_url, session):
+            name = element['name']
+            if reconcile and str(element.get('RouterID')) == str(router_id):
+                unchanged.append({'name': name, 'ok': True, 'status': None, 'attempts': 0,
+                                  'error': None, 'seconds': 0.0, 'unchanged': True})
+                continue
+            yield (name, f"{base_url}/mgmt/device/df/config/NetworkElements/{name}/",
+                   {"name": f"{name}", "RouterID": f"{router_id}"})
+    
+    started = time.time()
+    try:
+        results = bulk_put(base_url, changes(), workers=workers, session=session)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to read network elements: {e}")
+        return None
+    if not results and not unchanged:
         print("No network elements found")
-        return
-        
-    for name in elements_names:
-        url = f"{base_url}/mgmt/device/df/config/NetworkElements/{name}/"
-        payload = {
-            "name": f"{name}",
-            "RouterID": f"{router_id}"
-        }
-        response = session.put(url, json=payload, verify=False)
-        if response.status_code == 200:
-            print(f"Updated router ID for network element: {name}")
-        else:
-            print(f"Failed to update router ID for network element: {name}")
+        return []
+    if not results:
+        print(f"All {len(unchanged)} network elements already use router ID {router_id}")
+        return unchanged
+    print_bulk_results(results, f"Router ID update ({len(results)} network elements written, "
+                                f"{len(unchanged)} already up to date, {time.time() - started:.1f}s)")
+    return results + unchanged
 
-def get_license(base_url):
+def get_license(base_url, session=None):
     """Get license information from the server and check if Cyber Controller Plus License is valid"""
+    session = session or get_session(base_url)
     today_ms = int(datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).timestamp() * 1000)
     
     try:
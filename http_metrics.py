@@ -0,0 +1,284 @@
+"""
+Per-endpoint HTTP instrumentation for the controller sessions.
+
+Every pooled session mounts InstrumentedAdapter, which records each request
+under its controller and endpoint template ("GET /mgmt/device/df/config/
+NetworkElements/{name}/"; names, numeric IDs and query strings removed):
+
+- request count, errors and a latency histogram (request sent until the
+  body was read; for streamed responses until the headers arrived)
+- bytes out (request body) and bytes in (response body, Content-Length for
+  streamed responses)
+- status codes, or the exception name when there was no response
+- retries the urllib3 Retry strategy made, and why (status or error)
+
+request_metrics holds the numbers for the whole process. Phase functions
+read it with snapshot() / totals(), and dump() writes it as JSON at the end
+of a run. Requests that bypass requests (the sendfile engine, the aiohttp
+waits) call record() themselves.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+
+DEFAULT_METRICS_FILE = 'http_metrics.json'
+
+# Upper bounds of the latency histogram buckets in milliseconds, the last bucket is open
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Path patterns whose variable part is replaced by a placeholder
+ENDPOINT_TEMPLATES = (
+    (re.compile(r'^(/mgmt/device/df/config/NetworkElements/)[^/]+(/?)$'), r'\1{name}\2'),
+)
+NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_template(url):
+    """Controller key and path template of a request URL"""
+    parts = urlsplit(url)
+    path = unquote(parts.path) or '/'
+    for pattern, template in ENDPOINT_TEMPLATES:
+        if pattern.match(path):
+            path = pattern.sub(template, path)
+            break
+    else:
+        path = NUMERIC_SEGMENT.sub('/{id}', path)
+    return f"{parts.scheme}://{parts.netloc}", path
+
+
+def body_size(request):
+    """Bytes of a prepared request's body, from Content-Length when it is streamed"""
+    body = request.body
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    try:
+        return int(request.headers.get('Content-Length', 0))
+    except ValueError:
+        return 0
+
+
+class EndpointStats:
+    """Counters and latency histogram of one endpoint"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.statuses = Counter()
+        self.retry_reasons = Counter()
+
+    def record(self, status, latency_ms, bytes_out, bytes_in, retries=0, retry_reasons=None):
+        self.count += 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+        self.statuses[str(status)] += 1
+        self.retries += retries
+        self.retry_reasons.update(retry_reasons or ())
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+        self.total_ms += latency_ms
+        self.min_ms = latency_ms if self.min_ms is None else min(self.min_ms, latency_ms)
+        self.max_ms = max(self.max_ms, latency_ms)
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if latency_ms <= bound), len(LATENCY_BUCKETS_MS))
+        self.histogram[bucket] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.retries += other.retries
+        self.bytes_out += other.bytes_out
+        self.bytes_in += other.bytes_in
+        self.total_ms += other.total_ms
+        if other.min_ms is not None:
+            self.min_ms = other.min_ms if self.min_ms is None else min(self.min_ms, other.min_ms)
+        self.max_ms = max(self.max_ms, other.max_ms)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        self.statuses.update(other.statuses)
+        self.retry_reasons.update(other.retry_reasons)
+
+    def percentile(self, fraction):
+        """Upper bound of the histogram bucket holding the given fraction of requests (max for the open bucket)"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank and count:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else round(self.max_ms, 1)
+        return round(self.max_ms, 1)
+
+    def as_dict(self):
+        labels = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'total_ms': round(self.total_ms, 1),
+            'mean_ms': round(self.total_ms / self.count, 1) if self.count else None,
+            'min_ms': round(self.min_ms, 1) if self.min_ms is not None else None,
+            'max_ms': round(self.max_ms, 1),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'latency_histogram_ms': {label: count for label, count in zip(labels, self.histogram) if count},
+            'statuses': dict(self.statuses),
+            'retry_reasons': dict(self.retry_reasons)
+        }
+
+
+class HttpMetrics:
+    """Thread-safe EndpointStats per controller and "METHOD template" endpoint"""
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc).isoformat()
+
+    def record(self, method, url, status, latency, bytes_out=0, bytes_in=0, retries=0, retry_reasons=None):
+        """Record one request; latency in seconds, status an int or an exception name"""
+        controller, path = endpoint_template(url)
+        key = (controller, f"{method.upper()} {path}")
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = EndpointStats()
+            stats.record(status, latency * 1000, bytes_out, bytes_in, retries, retry_reasons)
+
+    def _merged(self, controller=None):
+        merged = {}
+        with self._lock:
+            for (owner, endpoint), stats in self._endpoints.items():
+                if controller is not None and owner != controller:
+                    continue
+                merged.setdefault(endpoint, EndpointStats()).merge(stats)
+        return merged
+
+    def snapshot(self, controller=None):
+        """Endpoint -> stats dict, for one controller key ('https://host') or all of them"""
+        return {endpoint: stats.as_dict() for endpoint, stats in sorted(self._merged(controller).items())}
+
+    def endpoint(self, endpoint, controller=None):
+        """Stats dict of one "METHOD template" endpoint, None if it was never called"""
+        return self.snapshot(controller).get(endpoint)
+
+    def totals(self, controller=None):
+        """Request, error, retry and byte counts over all endpoints"""
+        totals = EndpointStats()
+        for stats in self._merged(controller).values():
+            totals.merge(stats)
+        return {'requests': totals.count, 'errors': totals.errors, 'retries': totals.retries,
+                'bytes_out': totals.bytes_out, 'bytes_in': totals.bytes_in,
+                'total_ms': round(totals.total_ms, 1)}
+
+    def slowest(self, limit=5):
+        """The endpoints that took the most time in total, as (endpoint, stats dict)"""
+        ranked = sorted(self._merged().items(), key=lambda item: item[1].total_ms, reverse=True)
+        return [(endpoint, stats.as_dict()) for endpoint, stats in ranked[:limit]]
+
+    def dump(self, path=DEFAULT_METRICS_FILE):
+        """Write the totals and per-endpoint stats, overall and per controller, as JSON"""
+        with self._lock:
+            controllers = sorted({owner for owner, _ in self._endpoints})
+        report = {
+            'started_at': self.started_at,
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'totals': self.totals(),
+            'endpoints': self.snapshot(),
+            'controllers': {controller: self.snapshot(controller) for controller in controllers}
+        }
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ Could not save HTTP metrics: {e}")
+            return None
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+        self.started_at = datetime.now(timezone.utc).isoformat()
+
+
+# HTTP metrics of every controller session in this process
+request_metrics = HttpMetrics()
+
+
+def _retry_history(history):
+    """Retries and their reasons from a urllib3 Retry history"""
+    reasons = [str(entry.status) if entry.status else type(entry.error).__name__ if entry.error else 'redirect'
+               for entry in history]
+    return len(reasons), reasons
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """HTTPAdapter that records every request it sends in an HttpMetrics"""
+
+    def __init__(self, metrics=None, **kwargs):
+        self.metrics = metrics or request_metrics
+        super().__init__(**kwargs)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        started = time.perf_counter()
+        sent = body_size(request)
+        try:
+            response = super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert,
+                                    proxies=proxies)
+            if not stream:
+                # Read the body here so the latency covers it; requests keeps the content
+                response.content
+        except requests.exceptions.RequestException as e:
+            # Retries that ran out surface as MaxRetryError, without their history
+            exhausted = any(isinstance(arg, MaxRetryError) for arg in e.args)
+            retries = (self.max_retries.total or 0) if exhausted else 0
+            self.metrics.record(request.method, request.url, type(e).__name__, time.perf_counter() - started,
+                                sent, 0, retries, [type(e).__name__] * retries)
+            raise
+
+        if stream:
+            try:
+                received = int(response.headers.get('Content-Length', 0))
+            except ValueError:
+                received = 0
+        else:
+            received = len(response.content or b'')
+        retry = getattr(response.raw, 'retries', None)
+        retries, reasons = _retry_history(retry.history) if retry is not None else (0, None)
+        self.metrics.record(request.method, request.url, response.status_code, time.perf_counter() - started,
+                            sent, received, retries, reasons)
+        return response
+
+
+def print_http_summary(metrics=None, limit=5):
+    """Print the endpoints that took the most time"""
+    metrics = metrics or request_metrics
+    totals = metrics.totals()
+    if not totals['requests']:
+        return
+    print(f"\n📡 HTTP: {totals['requests']} requests, {totals['errors']} errors, {totals['retries']} retries, "
+          f"{totals['bytes_out'] / (1024*1024):.1f} MB out, {totals['bytes_in'] / (1024*1024):.1f} MB in")
+    for endpoint, stats in metrics.slowest(limit):
+        print(f"   {endpoint:<70} {stats['count']:>5}x  total {stats['total_ms'] / 1000:>7.1f}s  "
+              f"p50 {stats['p50_ms']}ms  p95 {stats['p95_ms']}ms  errors {stats['errors']}")
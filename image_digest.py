@@ -0,0 +1,167 @@
+"""
+SHA-256 of the upgrade image without a separate pass over the file.
+
+The upload engines feed ImageHasher the same buffers they send, so the
+digest is a by-product of the upload. A DigestCache keyed by path, size,
+mtime and inode remembers it, so the second controller's upload and later
+runs look it up instead of hashing again:
+
+- TLS sends are hashed from the engine's send buffer
+- sendfile() never copies the image into Python, so each block is hashed
+  through a memory map right after it was sent, from the page cache
+- toolbelt reads through HashingReader, which hashes what the encoder reads
+
+Only bytes the engines did not send (the acknowledged prefix of a resumed
+upload) are read from disk for hashing.
+"""
+
+import os
+import json
+import mmap
+import hashlib
+import threading
+
+DIGEST_CACHE_FILE = 'image_digests.json'
+DIGEST_CACHE_LIMIT = 50
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _cache_key(path, st):
+    return f"{os.path.realpath(path)}:{st.st_size}:{st.st_mtime_ns}:{st.st_ino}"
+
+
+class DigestCache:
+    """Image digests keyed by path, size, mtime and inode, persisted as JSON"""
+
+    def __init__(self, path=DIGEST_CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, image):
+        """Cached SHA-256 of image, None if unknown or the file changed since it was hashed"""
+        try:
+            key = _cache_key(image, os.stat(image))
+        except OSError:
+            return None
+        with self._lock:
+            return self._load().get(key)
+
+    def put(self, image, digest, st=None):
+        """Remember digest for image as it is now (or as it was when st was taken)"""
+        key = _cache_key(image, st or os.stat(image))
+        with self._lock:
+            digests = self._load()
+            digests.pop(key, None)
+            digests[key] = digest
+            # Keep the newest entries only
+            digests = dict(list(digests.items())[-DIGEST_CACHE_LIMIT:])
+            tmp = f"{self.path}.tmp"
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(digests, f, indent=2)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"⚠️ Could not save image digest cache: {e}")
+
+    def digest(self, image):
+        """Cached digest of image, hashing the whole file on a cache miss"""
+        digest = self.get(image)
+        if digest is None:
+            hasher = ImageHasher(image)
+            digest = hasher.finish()
+            self.put(image, digest, hasher.stat)
+        return digest
+
+
+digest_cache = DigestCache()
+
+
+class ImageHasher:
+    """
+    Incremental SHA-256 of an image fed with (absolute offset, bytes) as the engines send them.
+    Data before the hashed position (a resent range) is ignored, a gap after it (bytes a
+    resumed upload skipped) is read from the file.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.stat = os.stat(image)
+        self.size = self.stat.st_size
+        self.position = 0
+        self._sha = hashlib.sha256()
+        self._lock = threading.Lock()
+
+    def _catch_up(self, offset):
+        """Hash image[position:offset] from disk"""
+        with open(self.image, 'rb') as f:
+            f.seek(self.position)
+            while self.position < offset:
+                chunk = f.read(min(HASH_CHUNK_SIZE, offset - self.position))
+                if not chunk:
+                    raise IOError(f"Image ended after {self.position:,} bytes")
+                self._sha.update(chunk)
+                self.position += len(chunk)
+
+    def feed(self, offset, data):
+        """Hash data sent from offset, keeping only the part past the hashed position"""
+        with self._lock:
+            end = offset + len(data)
+            if end <= self.position:
+                return
+            if offset > self.position:
+                self._catch_up(offset)
+            self._sha.update(data[self.position - offset:])
+            self.position = end
+
+    def finish(self):
+        """Hash whatever was not sent and return the hex digest"""
+        with self._lock:
+            self._catch_up(self.size)
+            return self._sha.hexdigest()
+
+
+class HashingReader:
+    """File object wrapper that feeds every read to an ImageHasher"""
+
+    def __init__(self, file, hasher):
+        self._file = file
+        self._hasher = hasher
+
+    def read(self, size=-1):
+        offset = self._file.tell()
+        data = self._file.read(size)
+        if data:
+            self._hasher.feed(offset, data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def tell(self):
+        return self._file.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+
+class MappedImage:
+    """Read-only memory map of the image, so sendfile() blocks can be hashed from the page cache"""
+
+    def __init__(self, file, hasher):
+        self._hasher = hasher
+        self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    def feed(self, offset, count):
+        self._hasher.feed(offset, self._view[offset:offset + count])
+
+    def close(self):
+        self._view.release()
+        self._map.close()
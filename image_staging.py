@@ -0,0 +1,160 @@
+"""
+Get the upgrade image into fast storage before it is uploaded.
+
+Images often live on NFS mounts or spinning disks, where a slow read shows
+up as a slow or stalled upload. ImageStager runs in the background while
+the controllers are logged in and the license is checked:
+
+- prewarm: posix_fadvise(SEQUENTIAL, WILLNEED) and one sequential read of
+  the image, so the uploads read it from the page cache. Uploads can start
+  straight away, the readahead keeps ahead of them
+- copy: copy the image to local storage (the system temp directory by
+  default) and upload from the copy, which is kept for a resumed run and
+  removed after a successful upgrade. Each working directory gets its own
+  copy (see staged_path), so concurrent runs never write or remove a copy
+  another run reads; fleet.py copies each image once and hands the copy to
+  its pairs
+
+Both read the whole image once anyway, so they hash it on the way and the
+uploads find its digest in the digest cache.
+"""
+
+import os
+import time
+import hashlib
+import shutil
+import tempfile
+import threading
+
+from image_digest import ImageHasher, digest_cache
+
+STAGE_MODES = ('prewarm', 'copy')
+STAGE_CHUNK_SIZE = 8 * 1024 * 1024
+
+HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+def advise_sequential(file, offset=0, length=0):
+    """Tell the kernel file will be read sequentially from offset, so it reads ahead aggressively"""
+    if HAS_FADVISE:
+        try:
+            os.posix_fadvise(file.fileno(), offset, length, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def staged_path(image, stage_dir):
+    """
+    Where the copy of image goes: a directory under stage_dir unique to the
+    image and the current working directory, so a resumed run finds its own
+    copy and concurrent runs (e.g. fleet pairs) never share one. The file
+    name is kept because it is sent to the controller.
+    """
+    key = hashlib.sha1(f"{os.getcwd()}\0{os.path.realpath(image)}".encode()).hexdigest()[:12]
+    return os.path.join(stage_dir, f"cc-stage-{key}", os.path.basename(image))
+
+
+class ImageStager:
+    """Background prewarm or copy of the upgrade image, see the module docstring"""
+
+    def __init__(self, image, mode='prewarm', stage_dir=None):
+        if mode not in STAGE_MODES:
+            raise ValueError(f"Unknown staging mode: {mode}")
+        self.image = image
+        self.mode = mode
+        self.stage_dir = stage_dir or tempfile.gettempdir()
+        self.staged = staged_path(image, self.stage_dir) if mode == 'copy' else None
+        self.error = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        started = time.monotonic()
+        try:
+            if self.mode == 'copy':
+                copied = self._copy()
+            else:
+                copied = self._prewarm()
+        except Exception as e:
+            self.error = e
+            print(f"\n⚠️ Image staging failed, uploading from {self.image}: {e}")
+            return
+        if copied:
+            elapsed = time.monotonic() - started
+            rate = copied / elapsed / (1024*1024) if elapsed > 0 else 0
+            action = f"copied to {self.staged}" if self.mode == 'copy' else "prewarmed in the page cache"
+            print(f"\n🔥 Image {action} in {elapsed:.0f}s ({rate:.1f} MB/s)")
+
+    def _read_through(self, src, hasher, dst=None):
+        """Read src sequentially into one reused buffer, hashing it and optionally writing it to dst"""
+        buffer = bytearray(STAGE_CHUNK_SIZE)
+        view = memoryview(buffer)
+        total = 0
+        while True:
+            n = src.readinto(view)
+            if not n:
+                return total
+            if hasher:
+                hasher.feed(total, view[:n])
+            if dst:
+                dst.write(view[:n])
+            total += n
+
+    def _prewarm(self):
+        hasher = None if digest_cache.get(self.image) else ImageHasher(self.image)
+        with open(self.image, 'rb') as f:
+            advise_sequential(f)
+            if HAS_FADVISE:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            total = self._read_through(f, hasher)
+        if hasher:
+            digest_cache.put(self.image, hasher.finish(), hasher.stat)
+        return total
+
+    def _copy(self):
+        st = os.stat(self.image)
+        # A copy left by an interrupted run is reused when size and mtime still match
+        try:
+            staged = os.stat(self.staged)
+            if staged.st_size == st.st_size and staged.st_mtime_ns == st.st_mtime_ns:
+                print(f"\n♻️ Reusing staged image {self.staged}")
+                return 0
+        except OSError:
+            pass
+
+        os.makedirs(os.path.dirname(self.staged), exist_ok=True)
+        hasher = ImageHasher(self.image)
+        part = f"{self.staged}.{os.getpid()}.part"
+        with open(self.image, 'rb') as src, open(part, 'wb') as dst:
+            advise_sequential(src)
+            total = self._read_through(src, hasher, dst)
+        shutil.copystat(self.image, part)
+        os.replace(part, self.staged)
+
+        digest = hasher.finish()
+        digest_cache.put(self.image, digest, hasher.stat)
+        digest_cache.put(self.staged, digest)
+        return total
+
+    def path(self):
+        """Path the uploads should read: the staged copy once it is complete, otherwise the original"""
+        if self.mode != 'copy':
+            return self.image
+        if self._thread:
+            self._thread.join()
+        return self.image if self.error else self.staged
+
+    def cleanup(self):
+        """Remove the staged copy and its directory"""
+        if self.mode == 'copy' and not self.error:
+            if self._thread:
+                self._thread.join()
+            try:
+                os.remove(self.staged)
+                os.rmdir(os.path.dirname(self.staged))
+            except OSError:
+                pass
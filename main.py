@@ -8,20 +8,36 @@ Automated HA upgrade workflow with checkpoint support and configuration migratio
 import os
 import time
 import json
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
+from scheduler import TaskScheduler
+from config_store import ConfigStore, DEFAULT_ROOT as DEFAULT_CONFIG_ROOT, DEFAULT_RETENTION_DAYS, DEFAULT_KEEP_PER_CONTROLLER
+
 # Import all required functions from ha_functions.py
 from ha_functions import (
-    login, break_ha, ha_status, get_router_id, 
-    establish_ha, version_update_chunked, download_df_config, upload_df_config,
+    ensure_authenticated, break_ha, get_router_id,
+    establish_ha, version_update_chunked, upload_software_image, commit_software_image, UPLOAD_ENGINES, STALL_FLOOR_BYTES, STALL_SECONDS, download_df_config, upload_df_config, migrate_df_config,
     wait_for_ha_disable, wait_for_version_update, wait_for_ha_healthy,
-    disable_protected_objects, update_network_elements_router_id, get_license
+    disable_protected_objects, update_network_elements_router_id, get_license, PO_BATCH_SIZE,
+    update_status, recorded_target_version, image_file_version, same_version, heartbeats
 )
+from image_digest import digest_cache
+from image_staging import ImageStager, STAGE_MODES
+from preflight import run_preflight, print_preflight
+from http_metrics import request_metrics, print_http_summary, DEFAULT_METRICS_FILE
+from event_log import event_log, DEFAULT_EVENT_LOG
+from async_engine import run_wait, wait_for_ha_disable_async, wait_for_ha_healthy_async, wait_for_version_update_async
 
 # ========================================
 # Checkpoint Management Functions
 # ========================================
 
+# Serializes checkpoint writes from concurrent uploads
+_progress_lock = threading.Lock()
+
 def save_progress(phase, status, data=None):
     """Save progress to checkpoint file"""
     checkpoint = {
@@ -32,12 +48,44 @@ def save_progress(phase, status, data=None):
     }
     
     try:
-        with open('checkpoint.json', 'w') as f:
-            json.dump(checkpoint, f, indent=2)
+        with _progress_lock:
+            # Values later phases need (see save_run_state) outlive the checkpoints in between
+            run_state = (load_progress() or {}).get('run_state')
+            if run_state:
+                checkpoint['run_state'] = run_state
+            with open('checkpoint.json', 'w') as f:
+                json.dump(checkpoint, f, indent=2)
         print(f"💾 Progress saved: Phase {phase} - {status}")
     except Exception as e:
         print(f"⚠️ Could not save progress: {e}")
 
+def save_run_state(key, value):
+    """Keep a value in the checkpoint for the later phases of this upgrade, also when it is resumed"""
+    try:
+        with _progress_lock:
+            checkpoint = load_progress() or {'timestamp': datetime.now(timezone.utc).isoformat(),
+                                             'phase': 0, 'status': 'starting', 'data': {}}
+            checkpoint.setdefault('run_state', {})[key] = value
+            with open('checkpoint.json', 'w') as f:
+                json.dump(checkpoint, f, indent=2)
+    except Exception as e:
+        print(f"⚠️ Could not save run state: {e}")
+
+def clear_run_state():
+    """Forget the run state of an earlier upgrade, when the operator starts fresh"""
+    try:
+        with _progress_lock:
+            checkpoint = load_progress()
+            if checkpoint and checkpoint.pop('run_state', None) is not None:
+                with open('checkpoint.json', 'w') as f:
+                    json.dump(checkpoint, f, indent=2)
+    except Exception as e:
+        print(f"⚠️ Could not save run state: {e}")
+
+def load_run_state(key, default=None):
+    """A value saved with save_run_state() by this upgrade"""
+    return ((load_progress() or {}).get('run_state') or {}).get(key, default)
+
 def load_progress():
     """Load progress from checkpoint file"""
     try:
@@ -92,15 +140,15 @@ def get_user_inputs():
     print(f"\n📤 Upload Configuration")
     print("=" * 30)
     print(f"File size: {file_size / (1024*1024):.2f} MB ({file_size / (1024*1024*1024):.2f} GB)")
-    print(f"Method: Chunked upload with keep-alive")
+    print(f"Method: Chunked upload with heartbeats")
     
     # Check if requests-toolbelt is available
     try:
         from requests_toolbelt.multipart.encoder import MultipartEncoder
         print("✅ requests-toolbelt available - optimal performance")
     except ImportError:
-        print("⚠️  requests-toolbelt not found - will use fallback method")
-        print("💡 For better performance, install it with: pip install requests-toolbelt")
+        print("⚠️  requests-toolbelt not found - will use zero-copy sendfile engine")
+        print("💡 To use the toolbelt engine, install it with: pip install requests-toolbelt")
     
     # Warn about large files
     if file_size > 5 * 1024 * 1024 * 1024:  # 5GB
@@ -130,19 +178,112 @@ def get_user_inputs():
         'upload_method': upload_method
     }
 
-def perform_version_update(base_url, config, controller_type="controller"):
-    """Perform version update using chunked upload with keep-alive"""
-    # Determine credentials based on controller type
+def _credentials(config, controller_type):
+    """Return (username, password) for the controller type"""
     if "secondary" in controller_type.lower():
-        username = config.get('secondary_username')
-        password = config.get('secondary_password')
-    else:
-        username = config.get('primary_username') 
-        password = config.get('primary_password')
+        return config.get('secondary_username'), config.get('secondary_password')
+    return config.get('primary_username'), config.get('primary_password')
+
+def _upload_options(base_url, config, phase):
+    """Build the upload keyword arguments, including resumable checkpointing"""
+    resumable = config.get('resumable', False)
+    resume_offset = None
+    on_checkpoint = None
+    upload_state = None
+    if resumable and phase is not None:
+        # The digest is that of the file the upload reads, the staged copy when there is one
+        image = image_path(config)
+        upload_state = {
+            'controller': base_url,
+            'upgrade_file': os.path.abspath(config['upgrade_file']),
+            'file_size': config['file_size'],
+            'sha256': digest_cache.get(image),
+            'acknowledged_bytes': 0
+        }
+        
+        # Only trust a recorded offset for the same controller and the same image
+        previous = (config.get('resume_uploads') or {}).get(base_url) or {}
+        if all(previous.get(key) == upload_state[key] for key in ('controller', 'upgrade_file', 'file_size')):
+            if previous.get('sha256') and upload_state['sha256'] is None:
+                # The file changed on disk or the cache is gone, hash it before trusting the offset
+                print("🔏 Verifying the image digest before resuming...")
+                upload_state['sha256'] = digest_cache.digest(image)
+            if previous.get('sha256') in (None, upload_state['sha256']):
+                resume_offset = previous.get('acknowledged_bytes', 0)
+            else:
+                print("⚠️ The image changed since the interrupted upload (SHA-256 differs) - uploading it again")
+        
+        # Concurrent uploads share one checkpoint, keyed by controller
+        uploads = config.setdefault('upload_checkpoints', {})
+        
+        def on_checkpoint(offset):
+            upload_state['acknowledged_bytes'] = offset
+            uploads[base_url] = dict(upload_state)
+            save_progress(phase, 'uploading', {'uploads': dict(uploads)})
+    
+    # Final throughput per controller and the image digest, recorded with the phase checkpoints
+    def on_metrics(metrics):
+        config.setdefault('upload_metrics', {})[base_url] = metrics
+        config['image_sha256'] = metrics['sha256']
+        if upload_state:
+            upload_state['sha256'] = metrics['sha256']
+        event_log.record_step('upload', metrics['seconds'], base_url, phase=phase, bytes=metrics['bytes'],
+                              average_mbps=metrics['average_mbps'], engine=metrics['engine'],
+                              resumed_from=metrics['resumed_from'])
+    
+    if resumable:
+        print("⏩ Resumable upload mode enabled")
+    return {
+        'resumable': resumable,
+        'resume_offset': resume_offset,
+        'on_checkpoint': on_checkpoint,
+        'engine': config.get('upload_engine'),
+        'stall_floor': config.get('stall_floor', STALL_FLOOR_BYTES),
+        'stall_seconds': config.get('stall_seconds', STALL_SECONDS),
+        'on_metrics': on_metrics
+    }
+
+def image_path(config):
+    """Path the uploads read the image from: the staged copy once it is ready, otherwise the original"""
+    stager = config.get('image_stager')
+    return stager.path() if stager else config['upgrade_file']
+
+def _commit_recorder(base_url, phase):
+    """on_commit callback recording the commit as a step in the event log"""
+    def on_commit(seconds, committed):
+        event_log.record_step('commit', seconds, base_url, status='completed' if committed else 'failed', phase=phase)
+    return on_commit
+
+def perform_version_update(base_url, config, controller_type="controller", phase=None):
+    """Perform version update using chunked upload with heartbeats"""
+    username, password = _credentials(config, controller_type)
+    
+    print(f"🔄 Using chunked upload with heartbeats for {controller_type}")
+    return version_update_chunked(base_url, image_path(config), config['file_size'],
+                                username, password, on_commit=_commit_recorder(base_url, phase),
+                                **_upload_options(base_url, config, phase))
+
+def stage_version_image(base_url, config, controller_type="controller", phase=None):
+    """Upload the upgrade image without committing it"""
+    username, password = _credentials(config, controller_type)
     
-    print(f"🔄 Using chunked upload with keep-alive for {controller_type}")
-    return version_update_chunked(base_url, config['upgrade_file'], config['file_size'],
-                                username, password)
+    print(f"📦 Pre-staging upgrade image on {controller_type}")
+    return upload_software_image(base_url, image_path(config), config['file_size'],
+                                 username, password, **_upload_options(base_url, config, phase))
+
+def apply_version_update(base_url, config, controller_type="controller", phase=None):
+    """Commit the pre-staged image, or upload and commit when nothing was staged"""
+    if config.get('prestage'):
+        username, password = _credentials(config, controller_type)
+        print(f"📦 Image pre-staged on {controller_type} - committing only")
+        started = time.monotonic()
+        committed = commit_software_image(base_url, username, password)
+        _commit_recorder(base_url, phase)(time.monotonic() - started, committed)
+        if committed:
+            return True
+        print("⚠️ Commit of pre-staged image failed - falling back to full upload")
+    
+    return perform_version_update(base_url, config, controller_type, phase)
 
 def check_license_validity(config):
     """Check license validity on primary controller"""
@@ -150,11 +291,13 @@ def check_license_validity(config):
     print("-" * 30)
     
     print("Checking license on primary controller...")
-    if not login(config['base_url_primary'], config['primary_username'], config['primary_password']):
+    if not ensure_authenticated(config['base_url_primary'], config['primary_username'], config['primary_password']):
         raise Exception("Failed to login to primary controller for license check")
     
-    primary_license_valid = get_license(config['base_url_primary'])
-    
+    return _report_license(get_license(config['base_url_primary']))
+
+def _report_license(primary_license_valid):
+    """Announce whether configurations will be migrated, returns primary_license_valid"""
     if primary_license_valid:
         print("✅ Valid CyberController Plus License found")
         print("Configuration migration will be performed during upgrade")
@@ -164,22 +307,300 @@ def check_license_validity(config):
         print("Configuration migration will be SKIPPED during upgrade")
         return False
 
+def preflight_checks(config, resuming=False):
+    """
+    Check both controllers concurrently before anything is changed, raises when a
+    precondition of a later phase is not met. Returns whether the license is valid.
+    When resuming, HA may already have been broken, so its health is not checked.
+    """
+    print("\n🛫 Pre-flight Checks")
+    print("-" * 30)
+    
+    report = run_preflight(config, check_ha=not resuming)
+    event_log.record_step('preflight', report['seconds'], status='failed' if report['problems'] else 'completed',
+                          problems=report['problems'])
+    print_preflight(report)
+    if report['problems']:
+        changed = "" if resuming else ", nothing was changed"
+        raise Exception(f"Pre-flight checks failed{changed}: {'; '.join(report['problems'])}")
+    
+    print(f"✅ Pre-flight checks passed in {report['seconds']:.1f}s")
+    return _report_license(report['license_valid'])
+
+
+# ========================================
+# Phase Steps
+# ========================================
+# Steps do the work of a phase without touching the checkpoint, so they can
+# be run one after another by the phase functions or concurrently by the
+# task scheduler.
+
+def login_controller(config, role):
+    """Make sure the 'primary' or 'secondary' controller session is logged in"""
+    # Sessions are kept per controller, so this only logs in when the session is new or expired
+    if not ensure_authenticated(config[f'base_url_{role}'], config[f'{role}_username'], config[f'{role}_password']):
+        raise Exception(f"Failed to login to {role} controller")
+
+def prestage_images_step(config):
+    """Upload the image to both controllers concurrently without committing"""
+    login_controller(config, 'primary')
+    login_controller(config, 'secondary')
+    
+    targets = [
+        (config[f'base_url_{role}'], f"{role} controller")
+        for role in ('secondary', 'primary') if not at_target_version(config, role)
+    ]
+    if not targets:
+        return
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = {
+            controller_type: executor.submit(stage_version_image, base_url, config, controller_type, 0)
+            for base_url, controller_type in targets
+        }
+    
+    failed = [controller_type for controller_type, future in futures.items() if not future.result()]
+    if failed:
+        raise Exception(f"Failed to pre-stage upgrade image on {', '.join(failed)}")
+
+def run_async_wait(config, role, wait, **kwargs):
+    """Run a wait coroutine from async_engine for the 'primary' or 'secondary' controller"""
+    return run_wait(config[f'base_url_{role}'], config[f'{role}_username'], config[f'{role}_password'], wait, **kwargs)
+
+def disable_ha_step(config):
+    """Break HA on the primary and wait until it is disabled"""
+    login_controller(config, 'primary')
+    with event_log.step('ha_disabled', config['base_url_primary'], role='primary'):
+        break_ha(config['base_url_primary'])
+        if config.get('async_waits'):
+            run_async_wait(config, 'primary', wait_for_ha_disable_async)
+        else:
+            wait_for_ha_disable(config['base_url_primary'])
+
+def image_sha256(config):
+    """Digest of the image the uploads read if it is already known, without hashing it"""
+    return config.get('image_sha256') or digest_cache.get(image_path(config))
+
+def target_version(config):
+    """
+    The version the image installs and where that came from: --target-version, the version
+    a controller reported after an earlier upgrade with the same image, or the image file name.
+    """
+    if config.get('target_version'):
+        return config['target_version'], 'command line'
+    recorded = recorded_target_version(image_sha256(config))
+    if recorded:
+        return recorded, 'earlier upgrade with this image'
+    version = image_file_version(config['upgrade_file'])
+    if version:
+        return version, 'image file name'
+    return None, None
+
+def at_target_version(config, role):
+    """True if the controller already runs the target version, so its update can be skipped"""
+    if config.get('force_update'):
+        return False
+    target, source = target_version(config)
+    if target is None:
+        return False
+    
+    status = update_status(config[f'base_url_{role}'])
+    current = status.get('software_version') if status else None
+    if not current or status.get('lastUpgradeStatus', 'OK') != 'OK' or not same_version(current, target):
+        return False
+    
+    print(f"⏭️ {role.capitalize()} controller already runs {current} (target {target}, from {source}) - skipping its update")
+    config.setdefault('skipped_updates', {})[role] = current
+    return True
+
+def update_controller_step(config, role, phase):
+    """Upload (or commit the pre-staged) image on a controller, unless it already runs the target version"""
+    login_controller(config, role)
+    if at_target_version(config, role):
+        return
+    if not apply_version_update(config[f'base_url_{role}'], config, f"{role} controller", phase=phase):
+        raise Exception(f"Failed to update {role} server")
+
+def record_update_timings(config, role, monitoring):
+    """Log the reboot of a version update as steps: until it went down, until it answered again, until done"""
+    if not monitoring or not monitoring.get('completed'):
+        return
+    base_url = config[f'base_url_{role}']
+    down_at, up_at, total = monitoring.get('down_at'), monitoring.get('up_at'), monitoring.get('total')
+    event_log.record_step('reboot_down', down_at, base_url, role=role)
+    if down_at is not None and up_at is not None:
+        event_log.record_step('reboot_up', up_at - down_at, base_url, role=role)
+    if total is not None:
+        event_log.record_step('version_ready', total - (up_at or down_at or 0), base_url, role=role,
+                              new_version=monitoring.get('new_version'),
+                              detection_latency=monitoring.get('detection_latency'))
+
+def wait_update_step(config, role):
+    """Wait for a controller to come back on the new version, returns the monitoring timings"""
+    skipped = config.get('skipped_updates', {}).get(role)
+    if skipped:
+        return {'controller': config[f'base_url_{role}'], 'completed': True, 'skipped': True, 'new_version': skipped}
+    if config.get('async_waits'):
+        monitoring = run_async_wait(config, role, wait_for_version_update_async, image_sha256=image_sha256(config))
+    else:
+        monitoring = wait_for_version_update(config[f'base_url_{role}'], config[f'{role}_username'],
+                                             config[f'{role}_password'], image_sha256(config))
+    record_update_timings(config, role, monitoring)
+    return monitoring
+
+def store_config(config, filename, role, phase):
+    """Add an exported configuration to the config store and apply retention, returns the store entry"""
+    store = config['config_store']
+    entry = store.add(filename, config[f'base_url_{role}'], role, phase)
+    print(f"🗄️ Stored configuration {entry['digest'][:12]} ({entry['name']})"
+          f"{' - identical to an earlier export' if entry.get('deduplicated') else ''}")
+    store.prune()
+    if phase == 3:
+        # Phase 5 compares against this export, see unchanged_config()
+        digests = config.setdefault('phase3_config_digests', {})
+        digests[role] = entry['digest']
+        save_run_state('phase3_config_digests', digests)
+    return entry
+
+def export_config_step(config, role, phase=None):
+    """Export the DefenseFlow configuration from a controller into the config store, returns the store entry"""
+    login_controller(config, role)
+    store = config['config_store']
+    with event_log.step('config_export', config[f'base_url_{role}'], role=role, phase=phase) as step:
+        df_config_filename = download_df_config(config[f'base_url_{role}'], directory=store.incoming_dir)
+        if df_config_filename is None:
+            raise Exception(f"Failed to download DefenseFlow configuration from {role}")
+        step['bytes'] = os.path.getsize(df_config_filename)
+    return store_config(config, df_config_filename, role, phase)
+
+def phase3_config_digest(config, role):
+    """Digest of the configuration role exported in phase 3 of this upgrade, from the checkpoint after a restart"""
+    digests = config.get('phase3_config_digests') or load_run_state('phase3_config_digests') or {}
+    return digests.get(role)
+
+def unchanged_config(config, target_role, entry):
+    """True if entry matches the configuration the target exported in phase 3 of this upgrade"""
+    return phase3_config_digest(config, target_role) == entry['digest']
+
+def import_config_step(config, role, entry, skip_unchanged=False):
+    """
+    Import a stored DefenseFlow configuration into a controller. With skip_unchanged the import
+    is skipped when the controller already exported this exact configuration in phase 3.
+    Returns True if the configuration was imported.
+    """
+    if skip_unchanged and unchanged_config(config, role, entry):
+        print(f"⏭️ Configuration {entry['digest'][:12]} is unchanged since the {role} exported it - skipping import")
+        return False
+    login_controller(config, role)
+    with event_log.step('config_import', config[f'base_url_{role}'], role=role, phase=entry.get('phase'),
+                        bytes=entry['size']):
+        upload_df_config(entry['path'], config[f'base_url_{role}'], remote_name=entry['name'])
+    return True
+
+def migrate_config_step(config, source_role, target_role, phase, skip_unchanged=False):
+    """
+    Move the DefenseFlow configuration from one controller to the other, keeping the export in the
+    config store. With --stream-config the export is piped straight into the import, unless the
+    import may be skipped, which needs the digest of the export first.
+    Returns the store entry and whether the configuration was imported.
+    """
+    store = config['config_store']
+    baseline = phase3_config_digest(config, target_role) if skip_unchanged else None
+    if not config.get('stream_config') or baseline is not None:
+        entry = export_config_step(config, source_role, phase)
+        if not (skip_unchanged and unchanged_config(config, target_role, entry)):
+            # Let the target settle before importing
+            time.sleep(5)
+        return entry, import_config_step(config, target_role, entry, skip_unchanged)
+    
+    login_controller(config, source_role)
+    login_controller(config, target_role)
+    with event_log.step('config_migrate', config[f'base_url_{target_role}'], role=target_role, phase=phase,
+                        source=config[f'base_url_{source_role}']) as step:
+        df_config_filename = migrate_df_config(config[f'base_url_{source_role}'], config[f'base_url_{target_role}'],
+                                               tee_dir=store.incoming_dir)
+        if df_config_filename is None:
+            raise Exception(f"Failed to download DefenseFlow configuration from {source_role}")
+        step['bytes'] = os.path.getsize(df_config_filename)
+    return store_config(config, df_config_filename, source_role, phase), True
+
+def configure_router_id_step(config):
+    """
+    Disable protected objects and set the secondary router ID on all network elements.
+    Returns the router ID, the per-element update results and the protected object disable report.
+    """
+    login_controller(config, 'secondary')
+    
+    # Get router ID and update network elements
+    secondary_router_id = get_router_id(config['base_url_secondary'])
+    if not secondary_router_id:
+        raise Exception("Failed to get router ID from secondary")
+    
+    print(f"Changing router ID on secondary to: {secondary_router_id}")
+    
+    # Disable protected objects
+    # Reconcile mode only writes what differs from the desired state
+    reconcile = config.get('reconcile', False)
+    with event_log.step('protected_objects_disabled', config['base_url_secondary'], role='secondary'):
+        po_report = disable_protected_objects(config['base_url_secondary'],
+                                              batch_size=config.get('po_batch_size', PO_BATCH_SIZE),
+                                              reconcile=reconcile)
+    
+    # Update network elements with router ID
+    with event_log.step('router_id_updated', config['base_url_secondary'], role='secondary'):
+        results = update_network_elements_router_id(config['base_url_secondary'], secondary_router_id,
+                                                    reconcile=reconcile)
+    if results is None:
+        raise Exception("Failed to read network elements from secondary")
+    failed = [r['name'] for r in results if not r['ok']]
+    if failed:
+        print(f"⚠️ Router ID not updated on {len(failed)} network element(s): {', '.join(failed)}")
+    return secondary_router_id, results, po_report
+
+def establish_ha_step(config):
+    """Re-establish HA from the primary and wait until both nodes are healthy"""
+    login_controller(config, 'primary')
+    
+    print("Establishing HA...")
+    establish_ha(
+        config['primary_address'], 
+        config['secondary_address'], 
+        config['secondary_username'], 
+        config['secondary_password'], 
+        config['base_url_primary']
+    )
+    
+    with event_log.step('ha_healthy', config['base_url_primary'], role='primary'):
+        if config.get('async_waits'):
+            run_async_wait(config, 'primary', wait_for_ha_healthy_async)
+        else:
+            wait_for_ha_healthy(config['base_url_primary'])
+
 
 # ========================================
 # Phase Execution Functions
 # ========================================
 
+def phase_0_prestage_images(config):
+    """Phase 0: Upload the image to both controllers concurrently while HA is still up"""
+    print("\n📋 Phase 0: Pre-staging Upgrade Images")
+    print("-" * 39)
+    save_progress(0, 'starting')
+    
+    prestage_images_step(config)
+    
+    save_progress(0, 'completed', {
+        'prestaged_at': datetime.now(timezone.utc).isoformat(),
+        'upload_throughput': config.get('upload_metrics', {}),
+        'image_sha256': config.get('image_sha256')
+    })
+
 def phase_1_disable_ha(config):
     """Phase 1: Disable HA on primary controller"""
     print("\n📋 Phase 1: Disabling HA")
     print("-" * 25)
     save_progress(1, 'starting')
     
-    if not login(config['base_url_primary'], config['primary_username'], config['primary_password']):
-        raise Exception("Failed to login to primary controller")
-    
-    break_ha(config['base_url_primary'])
-    wait_for_ha_disable(config['base_url_primary'])
+    disable_ha_step(config)
     
     save_progress(1, 'completed', {'ha_disabled_at': datetime.now(timezone.utc).isoformat()})
 
@@ -189,16 +610,16 @@ def phase_2_update_secondary(config):
     print("-" * 42)
     save_progress(2, 'starting')
     
-    if not login(config['base_url_secondary'], config['secondary_username'], config['secondary_password']):
-        raise Exception("Failed to login to secondary controller")
-    
     time.sleep(2)
-    if not perform_version_update(config['base_url_secondary'], config, "secondary controller"):
-        raise Exception("Failed to update secondary server")
-    
-    wait_for_version_update(config['base_url_secondary'], config['secondary_username'], config['secondary_password'])
+    update_controller_step(config, 'secondary', 2)
+    monitoring = wait_update_step(config, 'secondary')
     
-    save_progress(2, 'completed', {'secondary_updated_at': datetime.now(timezone.utc).isoformat()})
+    save_progress(2, 'completed', {
+        'secondary_updated_at': datetime.now(timezone.utc).isoformat(),
+        'update_monitoring': monitoring,
+        'upload_throughput': config.get('upload_metrics', {}),
+        'image_sha256': config.get('image_sha256')
+    })
 
 def phase_3_migrate_config_to_secondary(config):
     """Phase 3: Export config from primary and import to secondary"""
@@ -206,27 +627,16 @@ def phase_3_migrate_config_to_secondary(config):
     print("-" * 48)
     save_progress(3, 'starting')
     
-    # Export config from primary
-    if not login(config['base_url_primary'], config['primary_username'], config['primary_password']):
-        raise Exception("Failed to login to primary controller")
-    
-    time.sleep(5)
-    df_config_filename = download_df_config(config['base_url_primary'])
-    if df_config_filename is None:
-        raise Exception("Failed to download DefenseFlow configuration from primary")
-    
-    # Import config to secondary
-    if not login(config['base_url_secondary'], config['secondary_username'], config['secondary_password']):
-        raise Exception("Failed to login to secondary controller")
-    
+    # Export config from primary and import it to secondary
     time.sleep(5)
-    upload_df_config(df_config_filename, config['base_url_secondary'])
+    entry, _ = migrate_config_step(config, 'primary', 'secondary', 3)
     
     save_progress(3, 'completed', {
-        'config_filename': df_config_filename,
+        'config_filename': entry['path'],
+        'config_digest': entry['digest'],
         'migrated_at': datetime.now(timezone.utc).isoformat()
     })
-    return df_config_filename
+    return entry['path']
 
 def phase_4_update_primary(config):
     """Phase 4: Update primary controller"""
@@ -234,15 +644,15 @@ def phase_4_update_primary(config):
     print("-" * 40)
     save_progress(4, 'starting')
     
-    if not login(config['base_url_primary'], config['primary_username'], config['primary_password']):
-        raise Exception("Failed to login to primary controller")
+    update_controller_step(config, 'primary', 4)
+    monitoring = wait_update_step(config, 'primary')
     
-    if not perform_version_update(config['base_url_primary'], config, "primary controller"):
-        raise Exception("Failed to update primary server")
-    
-    wait_for_version_update(config['base_url_primary'], config['primary_username'], config['primary_password'])
-    
-    save_progress(4, 'completed', {'primary_updated_at': datetime.now(timezone.utc).isoformat()})
+    save_progress(4, 'completed', {
+        'primary_updated_at': datetime.now(timezone.utc).isoformat(),
+        'update_monitoring': monitoring,
+        'upload_throughput': config.get('upload_metrics', {}),
+        'image_sha256': config.get('image_sha256')
+    })
 
 def phase_5_migrate_config_to_primary(config):
     """Phase 5: Export config from secondary and import to primary"""
@@ -250,23 +660,13 @@ def phase_5_migrate_config_to_primary(config):
     print("-" * 46)
     save_progress(5, 'starting')
     
-    # Export config from secondary
-    if not login(config['base_url_secondary'], config['secondary_username'], config['secondary_password']):
-        raise Exception("Failed to login to secondary controller")
-    
-    df_config_filename = download_df_config(config['base_url_secondary'])
-    if df_config_filename is None:
-        raise Exception("Failed to download DefenseFlow configuration from secondary")
-    
-    # Import config to primary
-    if not login(config['base_url_primary'], config['primary_username'], config['primary_password']):
-        raise Exception("Failed to login to primary controller")
-    
-    time.sleep(5)
-    upload_df_config(df_config_filename, config['base_url_primary'])
+    # Export config from secondary and import it to primary
+    entry, imported = migrate_config_step(config, 'secondary', 'primary', 5, skip_unchanged=True)
     
     save_progress(5, 'completed', {
-        'config_filename': df_config_filename,
+        'config_filename': entry['path'],
+        'config_digest': entry['digest'],
+        'config_imported': imported,
         'migrated_at': datetime.now(timezone.utc).isoformat()
     })
 
@@ -276,24 +676,16 @@ def phase_6_configure_secondary_router_id(config):
     print("-" * 44)
     save_progress(6, 'starting')
     
-    if not login(config['base_url_secondary'], config['secondary_username'], config['secondary_password']):
-        raise Exception("Failed to login to secondary controller")
-    
-    # Get router ID and update network elements
-    secondary_router_id = get_router_id(config['base_url_secondary'])
-    if not secondary_router_id:
-        raise Exception("Failed to get router ID from secondary")
-    
-    print(f"Changing router ID on secondary to: {secondary_router_id}")
-    
-    # Disable protected objects
-    disable_protected_objects(config['base_url_secondary'])
-    
-    # Update network elements with router ID
-    update_network_elements_router_id(config['base_url_secondary'], secondary_router_id)
+    secondary_router_id, results, po_report = configure_router_id_step(config)
     
     save_progress(6, 'completed', {
         'router_id': secondary_router_id,
+        'network_elements_updated': sum(1 for r in results if r['ok'] and not r.get('unchanged')),
+        'network_elements_unchanged': sum(1 for r in results if r.get('unchanged')),
+        'network_elements_failed': [r['name'] for r in results if not r['ok']],
+        'protected_objects_disabled': len(po_report['disabled']),
+        'protected_objects_unchanged': po_report['unchanged'],
+        'protected_objects_failed': [failure['name'] for failure in po_report['failed']],
         'configured_at': datetime.now(timezone.utc).isoformat()
     })
 
@@ -303,19 +695,7 @@ def phase_7_establish_ha(config):
     print("-" * 30)
     save_progress(7, 'starting')
     
-    if not login(config['base_url_primary'], config['primary_username'], config['primary_password']):
-        raise Exception("Failed to login to primary controller")
-    
-    print("Establishing HA...")
-    establish_ha(
-        config['primary_address'], 
-        config['secondary_address'], 
-        config['secondary_username'], 
-        config['secondary_password'], 
-        config['base_url_primary']
-    )
-    
-    wait_for_ha_healthy(config['base_url_primary'])
+    establish_ha_step(config)
     
     save_progress(7, 'completed', {
         'ha_established_at': datetime.now(timezone.utc).isoformat(),
@@ -323,120 +703,417 @@ def phase_7_establish_ha(config):
     })
 
 
+# ========================================
+# Workflow Execution
+# ========================================
+
+# Phase names in the event log
+PHASE_NAMES = {
+    0: 'prestage_images',
+    1: 'disable_ha',
+    2: 'update_secondary',
+    3: 'migrate_config_to_secondary',
+    4: 'update_primary',
+    5: 'migrate_config_to_primary',
+    6: 'configure_secondary_router_id',
+    7: 'establish_ha'
+}
+
+def run_phase(config, phase_func, phase):
+    """Run a phase function, recording its start and end in the event log"""
+    with event_log.phase(phase, PHASE_NAMES[phase]):
+        return phase_func(config)
+
+def run_phases(config, license_valid, start_phase):
+    """Run the phases one after another, skipping those already completed"""
+    if config['prestage']:
+        if start_phase <= 0:
+            run_phase(config, phase_0_prestage_images, 0)
+        else:
+            print("⏭️ Skipping Phase 0 (already completed)")
+    
+    if start_phase <= 1:
+        run_phase(config, phase_1_disable_ha, 1)
+    else:
+        print("⏭️ Skipping Phase 1 (already completed)")
+        
+    if start_phase <= 2:
+        run_phase(config, phase_2_update_secondary, 2)
+    else:
+        print("⏭️ Skipping Phase 2 (already completed)")
+    
+    # Only migrate configuration if license is valid
+    if start_phase <= 3:
+        if license_valid:
+            run_phase(config, phase_3_migrate_config_to_secondary, 3)
+        else:
+            print("\n📋 Phase 3: SKIPPED - Configuration Migration to Secondary")
+            print("Skipping configuration migration due to invalid/missing license")
+            save_progress(3, 'skipped', {'reason': 'Invalid license'})
+            event_log.emit('phase_skipped', phase=3, reason='Invalid license')
+    else:
+        print("⏭️ Skipping Phase 3 (already completed)")
+    
+    if start_phase <= 4:
+        run_phase(config, phase_4_update_primary, 4)
+    else:
+        print("⏭️ Skipping Phase 4 (already completed)")
+    
+    # Only migrate configuration if license is valid
+    if start_phase <= 5:
+        if license_valid:
+            run_phase(config, phase_5_migrate_config_to_primary, 5)
+        else:
+            print("\n📋 Phase 5: SKIPPED - Configuration Migration to Primary")
+            print("Skipping configuration migration due to invalid/missing license")
+            save_progress(5, 'skipped', {'reason': 'Invalid license'})
+            event_log.emit('phase_skipped', phase=5, reason='Invalid license')
+    else:
+        print("⏭️ Skipping Phase 5 (already completed)")
+    
+    if start_phase <= 6:
+        run_phase(config, phase_6_configure_secondary_router_id, 6)
+    else:
+        print("⏭️ Skipping Phase 6 (already completed)")
+        
+    if start_phase <= 7:
+        run_phase(config, phase_7_establish_ha, 7)
+    else:
+        print("⏭️ Skipping Phase 7 (already completed)")
+
+def build_phase_graph(config, license_valid):
+    """
+    Build the upgrade as a task graph. Work that does not depend on the
+    previous step overlaps: the primary config is exported while the
+    secondary reboots, and the secondary config export and router ID
+    changes run while the primary reboots. With --stream-config each
+    migration is one task that pipes the export into the import once the
+    target is back up.
+    """
+    def migration(func):
+        """Configuration migration only runs with a valid license"""
+        def run(inputs):
+            if not license_valid:
+                print("Skipping configuration migration due to invalid/missing license")
+                return None
+            return func(inputs)
+        return run
+    
+    scheduler = TaskScheduler()
+    start = []
+    if config.get('prestage'):
+        scheduler.add_task('prestage_images', lambda inputs: prestage_images_step(config), phase=0)
+        start = ['prestage_images']
+    
+    scheduler.add_task('disable_ha', lambda inputs: disable_ha_step(config), start, phase=1)
+    scheduler.add_task('update_secondary', lambda inputs: update_controller_step(config, 'secondary', 2),
+                       ['disable_ha'], phase=2)
+    scheduler.add_task('wait_secondary', lambda inputs: wait_update_step(config, 'secondary'),
+                       ['update_secondary'], phase=2)
+    if config.get('stream_config'):
+        # A streamed migration needs both controllers up, so it waits for the target's reboot
+        scheduler.add_task('migrate_secondary_config',
+                           migration(lambda inputs: migrate_config_step(config, 'primary', 'secondary', 3)),
+                           ['wait_secondary'], phase=3)
+        secondary_configured = 'migrate_secondary_config'
+    else:
+        scheduler.add_task('export_primary_config', migration(lambda inputs: export_config_step(config, 'primary', 3)),
+                           ['disable_ha'], phase=3)
+        scheduler.add_task('import_secondary_config',
+                           migration(lambda inputs: import_config_step(config, 'secondary', inputs['export_primary_config'])),
+                           ['wait_secondary', 'export_primary_config'], phase=3)
+        secondary_configured = 'import_secondary_config'
+    scheduler.add_task('update_primary', lambda inputs: update_controller_step(config, 'primary', 4),
+                       [secondary_configured], phase=4)
+    scheduler.add_task('wait_primary', lambda inputs: wait_update_step(config, 'primary'),
+                       ['update_primary'], phase=4)
+    if config.get('stream_config'):
+        scheduler.add_task('migrate_primary_config',
+                           migration(lambda inputs: migrate_config_step(config, 'secondary', 'primary', 5,
+                                                                        skip_unchanged=True)),
+                           ['wait_primary'], phase=5)
+        secondary_exported = primary_configured = 'migrate_primary_config'
+    else:
+        scheduler.add_task('export_secondary_config', migration(lambda inputs: export_config_step(config, 'secondary', 5)),
+                           [secondary_configured], phase=5)
+        scheduler.add_task('import_primary_config',
+                           migration(lambda inputs: import_config_step(config, 'primary', inputs['export_secondary_config'],
+                                                                         skip_unchanged=True)),
+                           ['wait_primary', 'export_secondary_config'], phase=5)
+        secondary_exported, primary_configured = 'export_secondary_config', 'import_primary_config'
+    # Router ID changes must not leak into the config exported for the primary
+    scheduler.add_task('configure_router_id', lambda inputs: configure_router_id_step(config),
+                       [secondary_exported], phase=6)
+    scheduler.add_task('establish_ha', lambda inputs: establish_ha_step(config),
+                       [primary_configured, 'configure_router_id'], phase=7)
+    return scheduler
+
+def run_phase_graph(config, license_valid, start_phase):
+    """Run the upgrade as a task graph, checkpointing the last fully completed phase"""
+    print("\n📋 Running phases as a task graph")
+    print("-" * 33)
+    
+    scheduler = build_phase_graph(config, license_valid)
+    completed = [name for name, task in scheduler.tasks.items() if task.phase < start_phase]
+    for name in completed:
+        print(f"⏭️ Skipping {name} (already completed)")
+    
+    saved_phase = [start_phase - 1]
+    
+    def record_task(task):
+        event_log.emit('task', task=task.name, phase=task.phase, status=task.status,
+                       started=round(task.started_at - scheduler.started_at, 2), duration=round(task.duration, 2))
+    
+    def on_task_done(task):
+        print(f"\n✅ Task {task.name} finished")
+        record_task(task)
+        # Phases can complete out of order, only checkpoint a fully completed prefix
+        unfinished = [t.phase for t in scheduler.tasks.values() if t.status not in ('completed', 'skipped')]
+        phase = (min(unfinished) if unfinished else max(t.phase for t in scheduler.tasks.values()) + 1) - 1
+        if phase > saved_phase[0]:
+            saved_phase[0] = phase
+            save_progress(phase, 'completed', {
+                'tasks_completed': [t.name for t in scheduler.tasks.values() if t.status == 'completed'],
+                'update_monitoring': {
+                    name: scheduler.tasks[name].result
+                    for name in ('wait_secondary', 'wait_primary') if scheduler.tasks[name].result
+                },
+                'upload_throughput': config.get('upload_metrics', {}),
+                'image_sha256': config.get('image_sha256'),
+                'completed_at': datetime.now(timezone.utc).isoformat()
+            })
+    
+    try:
+        scheduler.run(completed, on_task_done)
+    finally:
+        for task in scheduler.tasks.values():
+            if task.status == 'failed':
+                record_task(task)
+        scheduler.report()
+
+
 # ========================================
 # Main Workflow Function
 # ========================================
 
-def main():
+def add_upgrade_options(parser):
+    """Add the upgrade workflow options shared by main.py and fleet.py"""
+    parser.add_argument('--resumable', action='store_true',
+                        help="resume interrupted image uploads from the last acknowledged byte offset")
+    parser.add_argument('--prestage', action='store_true',
+                        help="upload the image to both controllers before breaking HA, then only commit in phases 2 and 4")
+    parser.add_argument('--parallel', action='store_true',
+                        help="run phases as a task graph, overlapping work that does not depend on the previous step")
+    parser.add_argument('--upload-engine', choices=UPLOAD_ENGINES, default=None,
+                        help="image upload engine (default: toolbelt when installed, otherwise sendfile)")
+    parser.add_argument('--stall-floor', type=int, default=STALL_FLOOR_BYTES // 1024, metavar='KB_PER_S',
+                        help="abort and retry an upload whose throughput stays below this rate (0 disables)")
+    parser.add_argument('--stall-seconds', type=int, default=STALL_SECONDS,
+                        help="how long throughput must stay below --stall-floor before the upload is aborted")
+    parser.add_argument('--target-version', default=None,
+                        help="version the image installs; controllers already running it are not updated "
+                             "(default: from an earlier upgrade with the same image, or the image file name)")
+    parser.add_argument('--force-update', action='store_true',
+                        help="upload and install the image even on controllers that already run the target version")
+    parser.add_argument('--async-waits', action='store_true',
+                        help="run the HA and version update waits as asyncio coroutines on one event loop, "
+                             "with a timeout instead of operator prompts (on their own aiohttp sessions when "
+                             "aiohttp is installed)")
+    parser.add_argument('--session-ttl', type=int, default=None, metavar='SECONDS',
+                        help="controller session lifetime; heartbeats go out after half of it "
+                             "(default: the session cookie lifetime, else every 5 minutes until a session expires)")
+    parser.add_argument('--skip-preflight', action='store_true',
+                        help="do not run the pre-flight checks on both controllers before phase 1")
+    parser.add_argument('--stage-image', choices=STAGE_MODES, default=None,
+                        help="while logging in and checking the license, prewarm the image in the page cache "
+                             "or copy it to fast local storage (--stage-dir) and upload from the copy")
+    parser.add_argument('--stage-dir', default=None,
+                        help="directory for --stage-image copy (default: the system temp directory)")
+    parser.add_argument('--po-batch-size', type=int, default=PO_BATCH_SIZE,
+                        help="protected objects disabled per request in phase 6")
+    parser.add_argument('--stream-config', action='store_true',
+                        help="pipe the DefenseFlow configuration export straight into the import (phases 3 and 5) "
+                             "instead of going through a local file")
+    parser.add_argument('--config-store', default=DEFAULT_CONFIG_ROOT,
+                        help="directory of the content-addressed store that keeps every exported configuration")
+    parser.add_argument('--config-retention-days', type=int, default=DEFAULT_RETENTION_DAYS,
+                        help="expire stored configurations older than this many days")
+    parser.add_argument('--config-keep', type=int, default=DEFAULT_KEEP_PER_CONTROLLER,
+                        help="always keep this many newest configurations per controller, whatever their age")
+    parser.add_argument('--event-log', default=DEFAULT_EVENT_LOG, metavar='FILE',
+                        help="append the run's phase and step timings to this JSONL event log "
+                             "(summarize it with upgrade_report.py; an empty value disables it)")
+    parser.add_argument('--http-metrics', default=DEFAULT_METRICS_FILE, metavar='FILE',
+                        help="write per-endpoint request counts, latency histograms, bytes, status codes and "
+                             "retries to this JSON file at the end of the run")
+    parser.add_argument('--reconcile', action='store_true',
+                        help="phase 6 only writes network elements and protected objects that differ from the desired state")
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Radware CyberController HA Version Upgrade Automation")
+    add_upgrade_options(parser)
+    return parser.parse_args(argv)
+
+def resume_point(progress):
+    """Work out the phase to resume from and any interrupted uploads from a checkpoint"""
+    start_phase = 0
+    resume_uploads = None
+    
+    # Handle phase as either string or int, and handle error states
+    phase_num = progress['phase']
+    if isinstance(phase_num, str):
+        if phase_num == 'error':
+            print("⚠️ Previous run had an error. Starting from Phase 1.")
+            start_phase = 1
+        else:
+            try:
+                phase_num = int(phase_num)
+            except ValueError:
+                print("⚠️ Invalid phase in checkpoint. Starting from Phase 1.")
+                start_phase = 1
+                phase_num = 1
+    
+    if isinstance(phase_num, int):
+        if progress['status'] == 'completed':
+            start_phase = phase_num + 1
+            print(f"🔄 Resuming from Phase {start_phase}")
+        else:
+            start_phase = phase_num
+            print(f"🔄 Resuming Phase {start_phase}")
+            resume_uploads = (progress.get('data') or {}).get('uploads')
+            for upload in (resume_uploads or {}).values():
+                print(f"📍 Interrupted upload to {upload['controller']}: {upload.get('acknowledged_bytes', 0):,} bytes acknowledged")
+    
+    return start_phase, resume_uploads
+
+def build_config(inputs, options, resume_uploads=None):
+    """Create the configuration object from the controller inputs and workflow options"""
+    return {
+        **inputs,
+        'base_url_primary': f"https://{inputs['primary_address']}",
+        'base_url_secondary': f"https://{inputs['secondary_address']}",
+        'resumable': options.get('resumable', False),
+        'upload_engine': options.get('upload_engine'),
+        'stall_floor': options.get('stall_floor', STALL_FLOOR_BYTES // 1024) * 1024,
+        'stall_seconds': options.get('stall_seconds', STALL_SECONDS),
+        'target_version': options.get('target_version'),
+        'force_update': options.get('force_update', False),
+        'skip_preflight': options.get('skip_preflight', False),
+        'session_ttl': options.get('session_ttl'),
+        'async_waits': options.get('async_waits', False),
+        'stage_image': options.get('stage_image'),
+        'stage_dir': options.get('stage_dir'),
+        'po_batch_size': max(1, options.get('po_batch_size', PO_BATCH_SIZE)),
+        'reconcile': options.get('reconcile', False),
+        'http_metrics': options.get('http_metrics', DEFAULT_METRICS_FILE),
+        'event_log': options.get('event_log', DEFAULT_EVENT_LOG),
+        'stream_config': options.get('stream_config', False),
+        'config_store': ConfigStore(options.get('config_store', DEFAULT_CONFIG_ROOT),
+                                    options.get('config_retention_days', DEFAULT_RETENTION_DAYS),
+                                    max(1, options.get('config_keep', DEFAULT_KEEP_PER_CONTROLLER))),
+        'resume_uploads': resume_uploads,
+        'prestage': options.get('prestage', False),
+        'parallel': options.get('parallel', False)
+    }
+
+# Options stored with the run_start event, so runs can be compared knowing how they were made
+RECORDED_OPTIONS = ('prestage', 'parallel', 'resumable', 'upload_engine', 'stage_image', 'stream_config',
+                    'async_waits', 'reconcile', 'force_update')
+
+def run_upgrade(config, start_phase=0):
+    """Run the upgrade for one HA pair from start_phase, raises on failure"""
+    print(f"\nStarting HA automation process...")
+    print(f"Primary: {config['primary_address']}")
+    print(f"Secondary: {config['secondary_address']}")
+    print(f"Upgrade file: {config['upgrade_file']} ({config['file_size'] / (1024*1024):.2f} MB)")
+    print(f"Upload method: Chunked (with progress tracking and heartbeats)")
+    
+    if config.get('event_log'):
+        event_log.start_run(config['event_log'], primary=config['base_url_primary'],
+                            secondary=config['base_url_secondary'], upgrade_file=config['upgrade_file'],
+                            file_size=config['file_size'], start_phase=start_phase,
+                            mode='parallel' if config['parallel'] else 'sequential',
+                            options={name: config.get(name) for name in RECORDED_OPTIONS})
+    try:
+        execute_upgrade(config, start_phase)
+    except KeyboardInterrupt:
+        event_log.end_run('interrupted')
+        raise
+    except BaseException as e:
+        # upload_df_config() exits on failure, so SystemExit is a failed run too
+        event_log.end_run('failed', error=f"{type(e).__name__}: {e}")
+        raise
+    event_log.end_run('completed')
+
+def execute_upgrade(config, start_phase):
+    """Pre-flight checks, the phases and the clean-up of run_upgrade()"""
+    heartbeats.ttl = config.get('session_ttl')
+    
+    # Stage the image in the background while the controllers are checked
+    stager = None
+    if config.get('stage_image') and start_phase <= 4:
+        print(f"🔥 Staging image in the background ({config['stage_image']})")
+        stager = config['image_stager'] = ImageStager(config['upgrade_file'], config['stage_image'],
+                                                      config.get('stage_dir')).start()
+    
+    # Check both controllers before the first change. A run resumed at phase 1 may already have
+    # sent break_ha, so HA health is only checked on a fresh run; later phases only check the license
+    if start_phase <= 1 and not config.get('skip_preflight'):
+        license_valid = preflight_checks(config, resuming=start_phase > 0)
+    else:
+        license_valid = check_license_validity(config)
+    
+    # Execute phases based on start_phase
+    try:
+        if config['parallel']:
+            run_phase_graph(config, license_valid, start_phase)
+        else:
+            run_phases(config, license_valid, start_phase)
+    finally:
+        # Where the time went on the wire, also for a failed run
+        print_http_summary()
+        if config.get('http_metrics') and request_metrics.dump(config['http_metrics']):
+            print(f"📡 HTTP metrics saved to {config['http_metrics']}")
+    
+    print("\n🎉 All phases completed successfully!")
+    print("✅ HA upgrade automation finished")
+    if not license_valid:
+        print("⚠️ Note: Configuration migration was skipped due to license issues")
+    
+    # Archive the completed checkpoint
+    archive_checkpoint()
+    if stager:
+        stager.cleanup()
+
+def main(argv=None):
     """Main automation workflow with checkpoint support"""
+    args = parse_args(argv)
+    
     print("🚀 Radware CyberController HA Version Upgrade Automation")
     print("=" * 58)
     
     # Check for existing progress
     progress = load_progress()
-    start_phase = 1
+    start_phase = 0
+    resume_uploads = None
     if progress:
         print(f"\n📋 Found previous session from {progress['timestamp']}")
         print(f"Last completed: Phase {progress['phase']} - {progress['status']}")
         resume = input("Do you want to start fresh? (y/n): ").lower().strip()
         if resume in ['n', 'no']:
-            # Handle phase as either string or int, and handle error states
-            phase_num = progress['phase']
-            if isinstance(phase_num, str):
-                if phase_num == 'error':
-                    print("⚠️ Previous run had an error. Starting from Phase 1.")
-                    start_phase = 1
-                else:
-                    try:
-                        phase_num = int(phase_num)
-                    except ValueError:
-                        print("⚠️ Invalid phase in checkpoint. Starting from Phase 1.")
-                        start_phase = 1
-                        phase_num = 1
-            
-            if isinstance(phase_num, int):
-                if progress['status'] == 'completed':
-                    start_phase = phase_num + 1
-                    print(f"🔄 Resuming from Phase {start_phase}")
-                else:
-                    start_phase = phase_num
-                    print(f"🔄 Resuming Phase {start_phase}")
+            start_phase, resume_uploads = resume_point(progress)
+        else:
+            clear_run_state()
     
     try:
         # Get user inputs
         inputs = get_user_inputs()
         
         # Create configuration object
-        config = {
-            **inputs,
-            'base_url_primary': f"https://{inputs['primary_address']}",
-            'base_url_secondary': f"https://{inputs['secondary_address']}"
-        }
-        
-        print(f"\nStarting HA automation process...")
-        print(f"Primary: {config['primary_address']}")
-        print(f"Secondary: {config['secondary_address']}")
-        print(f"Upgrade file: {config['upgrade_file']} ({config['file_size'] / (1024*1024):.2f} MB)")
-        print(f"Upload method: Chunked (with progress tracking and keep-alive)")
-        
-        # Check license validity first
-        license_valid = check_license_validity(config)
-        
-        # Execute phases based on start_phase
-        if start_phase <= 1:
-            phase_1_disable_ha(config)
-        else:
-            print("⏭️ Skipping Phase 1 (already completed)")
-            
-        if start_phase <= 2:
-            phase_2_update_secondary(config)
-        else:
-            print("⏭️ Skipping Phase 2 (already completed)")
-        
-        # Only migrate configuration if license is valid
-        if start_phase <= 3:
-            if license_valid:
-                phase_3_migrate_config_to_secondary(config)
-            else:
-                print("\n📋 Phase 3: SKIPPED - Configuration Migration to Secondary")
-                print("Skipping configuration migration due to invalid/missing license")
-                save_progress(3, 'skipped', {'reason': 'Invalid license'})
-        else:
-            print("⏭️ Skipping Phase 3 (already completed)")
-        
-        if start_phase <= 4:
-            phase_4_update_primary(config)
-        else:
-            print("⏭️ Skipping Phase 4 (already completed)")
-        
-        # Only migrate configuration if license is valid
-        if start_phase <= 5:
-            if license_valid:
-                phase_5_migrate_config_to_primary(config)
-            else:
-                print("\n📋 Phase 5: SKIPPED - Configuration Migration to Primary")
-                print("Skipping configuration migration due to invalid/missing license")
-                save_progress(5, 'skipped', {'reason': 'Invalid license'})
-        else:
-            print("⏭️ Skipping Phase 5 (already completed)")
-        
-        if start_phase <= 6:
-            phase_6_configure_secondary_router_id(config)
-        else:
-            print("⏭️ Skipping Phase 6 (already completed)")
-            
-        if start_phase <= 7:
-            phase_7_establish_ha(config)
-        else:
-            print("⏭️ Skipping Phase 7 (already completed)")
-        
-        print("\n🎉 All phases completed successfully!")
-        print("✅ HA upgrade automation finished")
-        if not license_valid:
-            print("⚠️ Note: Configuration migration was skipped due to license issues")
+        config = build_config(inputs, vars(args), resume_uploads)
         
-        # Archive the completed checkpoint
-        archive_checkpoint()
+        run_upgrade(config, start_phase)
         
     except KeyboardInterrupt:
         print("\n⏸️ Script interrupted by user (Ctrl+C)")
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Local Stand-in CyberController
+==============================
+Minimal HTTP server that mimics the CyberController upload API so upload
+behaviour can be exercised without real hardware.
+
+Supports login, ranged (resumable) software uploads and commit. An upload
+can be cut off after a given number of file bytes to simulate a flaky link,
+or slowed to a trickle to simulate a stalled one. Given a certificate it
+serves HTTPS, like a real controller:
+
+    controller = MockController(interrupt_after=50 * 1024 * 1024)
+    base_url = controller.start()
+    ...
+    controller.stop()
+"""
+
+import re
+import ssl
+import time
+import socket
+import hashlib
+import threading
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SESSION_COOKIE = 'JSESSIONID=mock-session'
+
+
+class MockController:
+    """Stand-in controller state plus the HTTP server serving it"""
+
+    def __init__(self, host='127.0.0.1', port=0, interrupt_after=None, support_ranges=True,
+                 stall_after=None, stall_rate=0, certfile=None, keyfile=None):
+        self.host = host
+        self.port = port
+        # Serve HTTPS with this certificate (PEM) when given
+        self.certfile = certfile
+        self.keyfile = keyfile
+        # Drop the connection once this many file bytes have arrived (one-shot)
+        self.interrupt_after = interrupt_after
+        self.support_ranges = support_ranges
+        # Read at stall_rate bytes/s (0 = stop reading) once this many file bytes have arrived (one-shot)
+        self.stall_after = stall_after
+        self.stall_rate = stall_rate
+
+        self.lock = threading.Lock()
+        self.expected_size = None
+        self.received = 0
+        self.hasher = hashlib.sha256()
+        self.upload_requests = 0
+        # File offset each upload request started at, to tell resumed uploads from re-sent ones
+        self.upload_starts = []
+        self.interruptions = 0
+        self.stalls = 0
+        self.committed = False
+        self.server = None
+        self.thread = None
+
+    @property
+    def base_url(self):
+        scheme = 'https' if self.certfile else 'http'
+        return f"{scheme}://{self.host}:{self.server.server_address[1]}"
+
+    @property
+    def digest(self):
+        """SHA-256 of the acknowledged file bytes"""
+        with self.lock:
+            return self.hasher.hexdigest()
+
+    def start(self):
+        """Start serving in a background thread and return the base URL"""
+        controller = self
+
+        class Handler(MockControllerHandler):
+            pass
+        Handler.controller = controller
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        if self.certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.certfile, self.keyfile)
+            # The handshake happens on the first read, in the connection's own thread
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True,
+                                                     do_handshake_on_connect=False)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class MockControllerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    controller = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _drain(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+    def _authenticated(self):
+        return SESSION_COOKIE in (self.headers.get('Cookie') or '')
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/mgmt/system/user/accessibility':
+            return self._reply(200 if self._authenticated() else 401, '{}')
+        self._reply(404)
+
+    def do_HEAD(self):
+        path = urlparse(self.path).path
+        if path == '/mgmt/system/config/action/software':
+            return self._query_offset()
+        self._reply(404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path == '/mgmt/system/user/login':
+            self._drain()
+            return self._reply(200, '{"status": "ok"}', {'Set-Cookie': f"{SESSION_COOKIE}; Path=/"})
+        if path == '/mgmt/system/config/action/software':
+            return self._upload()
+        self._drain()
+        self._reply(404)
+
+    def do_PUT(self):
+        path = urlparse(self.path).path
+        self._drain()
+        if path == '/mgmt/system/config/action/software':
+            c = self.controller
+            with c.lock:
+                complete = c.expected_size is not None and c.received == c.expected_size
+                c.committed = complete
+            return self._reply(200 if complete else 400, '{"status": "ok"}' if complete else '{"status": "error"}')
+        self._reply(404)
+
+    # ---- software upload ----
+
+    def _query_offset(self):
+        c = self.controller
+        if not c.support_ranges:
+            return self._reply(405)
+        with c.lock:
+            received = c.received
+        headers = {'Range': f"bytes=0-{received - 1}"} if received else {}
+        self._reply(308, headers=headers)
+
+    def _upload(self):
+        c = self.controller
+        query = parse_qs(urlparse(self.path).query)
+        filesize = int(query.get('filesize', ['0'])[0])
+        content_length = int(self.headers.get('Content-Length') or 0)
+        match = re.search(r'boundary=([^;]+)', self.headers.get('Content-Type', ''))
+        if not match:
+            self._drain()
+            return self._reply(400, 'multipart body expected')
+        epilogue_len = len(f"\r\n--{match.group(1).strip()}--\r\n")
+
+        start = 0
+        content_range = self.headers.get('Content-Range')
+        with c.lock:
+            c.upload_requests += 1
+            if content_range and c.support_ranges:
+                start = int(content_range.split()[1].split('-')[0])
+                if start != c.received or filesize != c.expected_size:
+                    self._drain()
+                    return self._reply(416, headers={'Range': f"bytes=0-{c.received - 1}"})
+            else:
+                # A plain upload always starts over
+                c.expected_size = filesize
+                c.received = 0
+                c.hasher = hashlib.sha256()
+                c.committed = False
+            c.upload_starts.append(start)
+
+        remaining = content_length
+        buffered = b''
+        # Read the part headers first so the file bytes can be counted exactly
+        while b'\r\n\r\n' not in buffered and remaining:
+            chunk = self.rfile.read(min(65536, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            buffered += chunk
+        header_end = buffered.index(b'\r\n\r\n') + 4
+        file_len = content_length - header_end - epilogue_len
+        data = buffered[header_end:]
+        seen = 0
+
+        while True:
+            piece = data[:max(0, file_len - seen)]
+            if piece:
+                limit = c.interrupt_after
+                with c.lock:
+                    if limit is not None and c.received + len(piece) >= limit:
+                        # Acknowledge up to the limit, then drop the link mid-stream
+                        keep = limit - c.received
+                        c.hasher.update(piece[:keep])
+                        c.received += keep
+                        c.interrupt_after = None
+                        c.interruptions += 1
+                        self.close_connection = True
+                        try:
+                            self.connection.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+                        return
+                    c.hasher.update(piece)
+                    c.received += len(piece)
+                seen += len(piece)
+            if not remaining:
+                break
+            if c.stall_after is not None and c.received >= c.stall_after:
+                if self._stall():
+                    return
+            data = self.rfile.read(min(1024 * 1024, remaining))
+            if not data:
+                return
+            remaining -= len(data)
+
+        with c.lock:
+            complete = c.received == c.expected_size
+        self._reply(200 if complete else 308, '{"status": "ok"}')
+
+    def _stall(self, limit=600):
+        """Starve the client until it gives up (or limit seconds pass); returns True when done"""
+        c = self.controller
+        c.stall_after = None
+        c.stalls += 1
+        self.close_connection = True
+        deadline = time.time() + limit
+        while time.time() < deadline:
+            if not c.stall_rate:
+                # Leave the data unread so the client's socket buffers fill up
+                time.sleep(0.5)
+                continue
+            try:
+                data = self.rfile.read(max(1, c.stall_rate // 10))
+            except OSError:
+                return True
+            if not data:
+                return True
+            # Trickled bytes are discarded, as if lost on the way
+            time.sleep(0.1)
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in CyberController")
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--interrupt-after', type=int, default=None,
+                        help="drop the first upload after this many file bytes")
+    parser.add_argument('--no-ranges', action='store_true', help="reject resumable uploads")
+    parser.add_argument('--stall-after', type=int, default=None,
+                        help="stall the first upload after this many file bytes")
+    parser.add_argument('--stall-rate', type=int, default=0,
+                        help="bytes/s still read while stalled (0 stops reading)")
+    parser.add_argument('--certfile', default=None, help="serve HTTPS with this PEM certificate")
+    parser.add_argument('--keyfile', default=None, help="private key of --certfile, if not in the same file")
+    args = parser.parse_args()
+
+    controller = MockController(port=args.port, interrupt_after=args.interrupt_after,
+                                support_ranges=not args.no_ranges,
+                                stall_after=args.stall_after, stall_rate=args.stall_rate,
+                                certfile=args.certfile, keyfile=args.keyfile)
+    print(f"🧪 Mock controller listening on {controller.start()}")
+    try:
+        controller.thread.join()
+    except KeyboardInterrupt:
+        controller.stop()
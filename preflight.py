@@ -0,0 +1,132 @@
+"""
+Pre-flight checks before the upgrade changes anything.
+
+Both controllers are logged in concurrently, then every check on both of
+them runs at the same time, so the whole stage costs about two round trips
+(plus the network element and protected object listings) instead of
+discovering a missing precondition after HA has been broken:
+
+- login on both controllers
+- HA status and health on the primary (not when resuming, HA may already be broken)
+- Cyber-Controller Plus license (decides whether configurations are migrated)
+- BGP router ID (the secondary's is needed in phase 6)
+- current software version
+- network element and protected object counts (phase 6 lists them)
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ha_functions import (
+    ensure_authenticated, ha_status, get_license, get_router_id, update_status,
+    iter_network_elements, iter_po_names
+)
+
+ROLES = ('primary', 'secondary')
+
+
+def _count(iterable):
+    return sum(1 for _ in iterable)
+
+
+def _checks(base_url):
+    """Check name -> function returning its value, None when it cannot be read"""
+    return {
+        'ha_status': lambda: ha_status(base_url),
+        'license': lambda: get_license(base_url),
+        'router_id': lambda: get_router_id(base_url),
+        'software_version': lambda: (update_status(base_url) or {}).get('software_version'),
+        'network_elements': lambda: _count(iter_network_elements(base_url)),
+        'protected_objects': lambda: _count(iter_po_names(base_url))
+    }
+
+
+def _value(future, errors, key):
+    try:
+        return future.result()
+    except Exception as e:
+        errors[key] = str(e)[:200]
+        return None
+
+
+def _problems(results, check_ha=True):
+    """Conditions that would make the run fail after HA is broken"""
+    problems = []
+    for role in ROLES:
+        if not results[role].get('login'):
+            problems.append(f"cannot log in to the {role} controller")
+            continue
+        if results[role].get('software_version') in (None, 'Unknown'):
+            problems.append(f"cannot read the current software version of the {role} controller")
+
+    primary, secondary = results['primary'], results['secondary']
+    if primary.get('login') and check_ha:
+        status = primary.get('ha_status')
+        if status is None:
+            problems.append("cannot read the HA status of the primary controller")
+        elif status.get('primaryHealth') != 'healthy' or status.get('secondaryHealth') != 'healthy':
+            problems.append(f"HA is not healthy (primary: {status.get('primaryHealth', 'unknown')}, "
+                            f"secondary: {status.get('secondaryHealth', 'unknown')})")
+    if secondary.get('login'):
+        if not secondary.get('router_id'):
+            problems.append("the secondary controller has no BGP router ID (needed in phase 6)")
+        for name in ('network_elements', 'protected_objects'):
+            if secondary.get(name) is None:
+                problems.append(f"cannot list {name.replace('_', ' ')} on the secondary controller (needed in phase 6)")
+    return problems
+
+
+def print_preflight(report):
+    """Print the per-controller results and any problems"""
+    def show(role, name):
+        value = report['controllers'][role].get(name)
+        if name == 'login':
+            return '✅' if value else '❌'
+        if name == 'license':
+            return 'valid' if value else 'invalid/missing'
+        if name == 'ha_status':
+            return f"{value.get('primaryHealth', '?')}/{value.get('secondaryHealth', '?')}" if value else '-'
+        return '-' if value is None else str(value)
+
+    print(f"   {'Check':<20} {'Primary':<24} {'Secondary':<24}")
+    for name in ('login', 'ha_status', 'license', 'router_id', 'software_version', 'network_elements', 'protected_objects'):
+        print(f"   {name:<20} {show('primary', name):<24} {show('secondary', name):<24}")
+    for problem in report['problems']:
+        print(f"   ❌ {problem}")
+
+
+def run_preflight(config, check_ha=True):
+    """
+    Run all pre-flight checks on both controllers concurrently. Without check_ha
+    an unhealthy or disabled HA is not a problem (a resumed run may have broken it).
+    Returns a report with the per-controller values, the problems found,
+    whether the primary license is valid and the elapsed time.
+    """
+    started = time.monotonic()
+    errors = {}
+    results = {role: {} for role in ROLES}
+
+    with ThreadPoolExecutor(max_workers=len(ROLES) * 6) as executor:
+        logins = {
+            role: executor.submit(ensure_authenticated, config[f'base_url_{role}'],
+                                  config[f'{role}_username'], config[f'{role}_password'])
+            for role in ROLES
+        }
+        for role in ROLES:
+            results[role]['login'] = _value(logins[role], errors, f"{role}.login")
+
+        futures = {
+            (role, name): executor.submit(check)
+            for role in ROLES if results[role]['login']
+            for name, check in _checks(config[f'base_url_{role}']).items()
+        }
+        for (role, name), future in futures.items():
+            results[role][name] = _value(future, errors, f"{role}.{name}")
+
+    return {
+        'controllers': results,
+        'problems': _problems(results, check_ha),
+        'errors': errors,
+        'license_valid': bool(results['primary'].get('license')),
+        'seconds': round(time.monotonic() - started, 2)
+    }
@@ -0,0 +1,108 @@
+"""
+Transfer progress and throughput metrics for image uploads.
+
+Upload engines only hand raw byte counts to update(), which is a single
+attribute store and safe to call for every chunk. A renderer thread wakes at
+a fixed low frequency, derives an exponentially smoothed throughput and an
+ETA from the counts and prints one progress line, so no formatting or
+arithmetic happens on the I/O path.
+"""
+
+import sys
+import time
+import threading
+
+
+def _fmt_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class TransferProgress:
+    """Smoothed throughput, ETA and periodic rendering for one transfer"""
+
+    def __init__(self, total, initial=0, label='', interval=1.0, alpha=0.3, stream=None):
+        self.total = total
+        self.initial = initial
+        self.label = label
+        self.interval = interval
+        self.alpha = alpha
+        self.stream = stream or sys.stdout
+        self.done = initial
+        self.rate = None
+        self.started = None
+        self.finished = None
+        self._last_time = None
+        self._last_done = initial
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the renderer thread"""
+        self.started = self._last_time = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._render_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def update(self, done):
+        """Record the absolute number of bytes transferred - hot path, no work here"""
+        self.done = done
+
+    def _tick(self):
+        """Fold the bytes moved since the last tick into the smoothed rate"""
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        if elapsed <= 0:
+            return
+        instant = (self.done - self._last_done) / elapsed
+        self.rate = instant if self.rate is None else self.alpha * instant + (1 - self.alpha) * self.rate
+        self._last_time = now
+        self._last_done = self.done
+
+    def eta(self):
+        """Seconds left at the smoothed rate, None while unknown"""
+        if not self.rate:
+            return None
+        return max(0, self.total - self.done) / self.rate
+
+    def render(self, end=''):
+        # Engines may count multipart framing too
+        done = min(self.done, self.total)
+        percent = done * 100 // self.total if self.total else 100
+        eta = self.eta()
+        line = (f"\r   ⬆️  {self.label + ' ' if self.label else ''}{percent}% - "
+                f"{done / (1024*1024):.1f} MB / {self.total / (1024*1024):.1f} MB"
+                f" - {(self.rate or 0) / (1024*1024):.1f} MB/s"
+                f" - ETA {_fmt_duration(eta) if eta is not None else '--:--'}")
+        print(line, end=end, flush=True, file=self.stream)
+
+    def _render_loop(self):
+        while not self._stop.wait(self.interval):
+            self._tick()
+            self.render()
+
+    def finish(self):
+        """Stop rendering, print the final line and return the transfer metrics"""
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.finished = time.monotonic()
+        self._tick()
+        self.render(end='\n')
+        return self.metrics()
+
+    def metrics(self):
+        """Bytes sent in this transfer, duration and average / smoothed throughput"""
+        end = self.finished or time.monotonic()
+        seconds = end - self.started if self.started else 0.0
+        sent = min(self.done, self.total) - self.initial
+        return {
+            'bytes': sent,
+            'seconds': round(seconds, 2),
+            'average_mbps': round(sent / seconds / (1024*1024), 2) if seconds > 0 else None,
+            'smoothed_mbps': round(self.rate / (1024*1024), 2) if self.rate else None
+        }
@@ -0,0 +1,157 @@
+"""
+Dependency-graph task scheduler for the upgrade workflow.
+
+Tasks declare which other tasks they depend on and are started as soon as
+all of those have finished, so independent work (for example exporting the
+primary configuration while the secondary reboots) overlaps. After a run the
+scheduler can report the critical path - the chain of tasks that determined
+the total wall-clock time.
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Task:
+    """A unit of work in the graph"""
+
+    def __init__(self, name, func, deps=(), phase=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.phase = phase
+        self.status = 'pending'
+        self.result = None
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def duration(self):
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+
+class TaskScheduler:
+    """Runs a graph of tasks on a thread pool, starting each one as soon as its inputs are ready"""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.tasks = {}
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def add_task(self, name, func, deps=(), phase=None):
+        """
+        Register a task. func is called with a dict of the results of its
+        dependencies, keyed by task name.
+        """
+        if name in self.tasks:
+            raise ValueError(f"Duplicate task: {name}")
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+        self.tasks[name] = Task(name, func, deps, phase)
+        return self.tasks[name]
+
+    def _execute(self, task, inputs):
+        with self._lock:
+            task.started_at = time.time()
+            task.status = 'running'
+        return task.func(inputs)
+
+    def run(self, completed=(), on_task_done=None):
+        """
+        Run every task not listed in completed. on_task_done(task) is called
+        after each task succeeds. On the first failure no new tasks are
+        started, running ones are allowed to finish and the error is raised.
+        Returns a dict of task results.
+        """
+        results = {}
+        done = set()
+        for name in completed:
+            self.tasks[name].status = 'skipped'
+            results[name] = None
+            done.add(name)
+
+        pending = [name for name in self.tasks if name not in done]
+        running = {}
+        failure = None
+        self.started_at = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if failure is None:
+                    for name in list(pending):
+                        task = self.tasks[name]
+                        if all(dep in done for dep in task.deps):
+                            inputs = {dep: results[dep] for dep in task.deps}
+                            running[executor.submit(self._execute, task, inputs)] = name
+                            pending.remove(name)
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = self.tasks[running.pop(future)]
+                    task.finished_at = time.time()
+                    try:
+                        results[task.name] = future.result()
+                    except Exception as e:
+                        task.status = 'failed'
+                        if failure is None:
+                            failure = e
+                        continue
+                    task.result = results[task.name]
+                    task.status = 'completed'
+                    done.add(task.name)
+                    if on_task_done:
+                        on_task_done(task)
+
+        self.finished_at = time.time()
+        if failure is not None:
+            raise failure
+        return results
+
+    def critical_path(self):
+        """
+        Return the chain of tasks that bounded the run, ending with the task
+        that finished last. Each step goes to the dependency that finished
+        latest, i.e. the one the task was actually waiting for.
+        """
+        ran = [task for task in self.tasks.values() if task.finished_at is not None]
+        if not ran:
+            return []
+
+        path = [max(ran, key=lambda t: t.finished_at)]
+        while True:
+            deps = [self.tasks[dep] for dep in path[-1].deps if self.tasks[dep].finished_at is not None]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda t: t.finished_at))
+        return list(reversed(path))
+
+    def report(self):
+        """Print the task timeline and the critical path"""
+        def fmt(seconds):
+            seconds = int(seconds)
+            return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+        critical = {task.name for task in self.critical_path()}
+        wall = (self.finished_at or time.time()) - (self.started_at or time.time())
+
+        print(f"\n📊 Task Schedule")
+        print(f"{'='*60}")
+        print(f"  {'Task':<28} {'Start':>7} {'Duration':>9}  Status")
+        for task in sorted(self.tasks.values(), key=lambda t: t.started_at or float('inf')):
+            marker = '★' if task.name in critical else ' '
+            start = fmt(task.started_at - self.started_at) if task.started_at else '--:--'
+            print(f"{marker} {task.name:<28} {start:>7} {fmt(task.duration):>9}  {task.status}")
+
+        path = self.critical_path()
+        if path:
+            print(f"\n🔥 Critical path ({fmt(sum(t.duration for t in path))} of {fmt(wall)} wall-clock):")
+            print("   " + " → ".join(f"{t.name} ({fmt(t.duration)})" for t in path))
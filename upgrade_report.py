@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Upgrade Run Report
+==================
+Summarizes the JSONL event log written by main.py and fleet.py (see
+event_log.py): how long each phase took, which sub-steps (uploads, commits,
+reboots, HA recovery, configuration migration) took the time and on which
+controller, and how runs compare.
+
+    python upgrade_report.py                          # last run in upgrade_events.jsonl
+    python upgrade_report.py --last 3                 # last three runs
+    python upgrade_report.py --compare                # last two runs side by side
+    python upgrade_report.py fleet_runs/*/upgrade_events.jsonl --compare --last 10
+    python upgrade_report.py --run 20261017T1015 --json
+"""
+
+import sys
+import json
+import argparse
+from datetime import datetime
+
+from event_log import DEFAULT_EVENT_LOG, load_runs
+
+
+def _fmt(seconds):
+    if seconds is None:
+        return '-'
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _mb(count):
+    return f"{count / (1024*1024):.1f}" if count else '-'
+
+
+def _timestamp(event):
+    try:
+        return datetime.fromisoformat(event['ts'])
+    except (KeyError, ValueError):
+        return None
+
+
+def summarize_run(run_id, events):
+    """Phase durations, step timings and totals of one run"""
+    start = next((e for e in events if e['event'] == 'run_start'), {})
+    end = next((e for e in reversed(events) if e['event'] == 'run_end'), None)
+    roles = {start.get('primary'): 'primary', start.get('secondary'): 'secondary'}
+
+    duration = end.get('duration') if end else None
+    if duration is None:
+        times = [t for t in map(_timestamp, events) if t]
+        duration = (max(times) - min(times)).total_seconds() if len(times) > 1 else None
+
+    phases = {}
+    for event in events:
+        if event['event'] == 'phase_end':
+            phases[event['phase']] = {key: event.get(key) for key in ('name', 'status', 'duration', 'bytes_out', 'bytes_in')}
+        elif event['event'] == 'phase_skipped':
+            phases[event['phase']] = {'name': None, 'status': 'skipped', 'duration': 0}
+
+    # Task graph runs overlap phases, a phase spans from its first task's start to its last task's end
+    tasks = [e for e in events if e['event'] == 'task']
+    for phase in sorted({t['phase'] for t in tasks} - set(phases)):
+        ran = [t for t in tasks if t['phase'] == phase]
+        phases[phase] = {
+            'name': ', '.join(t['task'] for t in ran),
+            'status': 'failed' if any(t['status'] == 'failed' for t in ran) else 'completed',
+            'duration': max(t['started'] + t['duration'] for t in ran) - min(t['started'] for t in ran)
+        }
+
+    steps = []
+    for event in events:
+        if event['event'] != 'step':
+            continue
+        role = event.get('role') or roles.get(event.get('controller'))
+        steps.append({**{key: value for key, value in event.items() if key not in ('ts', 'run', 'event')},
+                      'label': f"{event['step']} ({role})" if role else event['step']})
+
+    return {
+        'run': run_id,
+        'started_at': start.get('ts') or (events[0].get('ts') if events else None),
+        'primary': start.get('primary'),
+        'secondary': start.get('secondary'),
+        'mode': start.get('mode'),
+        'start_phase': start.get('start_phase'),
+        'options': start.get('options', {}),
+        'status': end['status'] if end else 'unfinished',
+        'error': end.get('error') if end else None,
+        'duration': duration,
+        'http': end.get('http') if end else None,
+        'phases': {phase: phases[phase] for phase in sorted(phases)},
+        'steps': steps
+    }
+
+
+def step_totals(summary):
+    """Seconds per step label, summed over repeats (e.g. upload retries)"""
+    totals = {}
+    for step in summary['steps']:
+        totals[step['label']] = totals.get(step['label'], 0) + (step.get('duration') or 0)
+    return totals
+
+
+def print_run(summary):
+    """Print one run: phases, then the steps ordered by the time they took"""
+    total = summary['duration'] or 0
+
+    def share(seconds):
+        return f"{seconds / total * 100:5.1f}%" if total and seconds is not None else '     -'
+
+    print(f"\n📊 Run {summary['run']} ({summary['started_at'] or 'unknown start'})")
+    print(f"{'='*78}")
+    print(f"   Primary: {summary['primary']}   Secondary: {summary['secondary']}")
+    enabled = [name for name, value in summary['options'].items() if value]
+    print(f"   Mode: {summary['mode']}   Options: {', '.join(enabled) or 'none'}   Start phase: {summary['start_phase']}")
+    print(f"   Status: {summary['status']}   Total: {_fmt(summary['duration'])}"
+          + (f"   Error: {summary['error']}" if summary['error'] else ''))
+    if summary['http']:
+        http = summary['http']
+        print(f"   HTTP: {http['requests']} requests, {http['errors']} errors, {http['retries']} retries, "
+              f"{_mb(http['bytes_out'])} MB out, {_mb(http['bytes_in'])} MB in")
+
+    if summary['phases']:
+        print(f"\n   {'Phase':<44} {'Duration':>9} {'Share':>6}  {'Status':<11} {'MB out':>8} {'MB in':>7}")
+        for phase, info in summary['phases'].items():
+            name = f"{phase} {info.get('name') or ''}"[:44]
+            print(f"   {name:<44} {_fmt(info.get('duration')):>9} {share(info.get('duration'))}  "
+                  f"{info.get('status') or '':<11} {_mb(info.get('bytes_out')):>8} {_mb(info.get('bytes_in')):>7}")
+
+    if summary['steps']:
+        print(f"\n   ⏱️ Where the time went")
+        print(f"   {'Step':<34} {'Duration':>9} {'Share':>6}  {'Status':<10} Details")
+        for step in sorted(summary['steps'], key=lambda s: s.get('duration') or 0, reverse=True):
+            details = []
+            if step.get('bytes'):
+                details.append(f"{_mb(step['bytes'])} MB")
+            if step.get('average_mbps'):
+                details.append(f"{step['average_mbps']:.1f} MB/s")
+            if step.get('engine'):
+                details.append(step['engine'])
+            if step.get('new_version'):
+                details.append(f"-> {step['new_version']}")
+            if step.get('detection_latency') is not None:
+                details.append(f"detected within {step['detection_latency']:.1f}s")
+            print(f"   {step['label']:<34} {_fmt(step.get('duration')):>9} {share(step.get('duration'))}  "
+                  f"{step.get('status') or '':<10} {', '.join(details)}")
+
+
+def print_comparison(summaries):
+    """Print the phases and steps of several runs side by side, with the change from the first to the last"""
+    print(f"\n📊 Run Comparison")
+    print(f"{'='*78}")
+    width = 22
+    header = ''.join(f"{s['run']:>{width}}" for s in summaries)
+    print(f"   {'':<34}{header}{'Change':>{width}}")
+
+    def row(label, values):
+        cells = ''.join(f"{_fmt(value):>{width}}" for value in values)
+        first, last = values[0], values[-1]
+        if first is not None and last is not None and len(values) > 1:
+            change = last - first
+            percent = f" ({change / first * 100:+.0f}%)" if first else ''
+            delta = f"{'+' if change >= 0 else '-'}{_fmt(abs(change))}{percent}"
+        else:
+            delta = '-'
+        print(f"   {label[:34]:<34}{cells}{delta:>{width}}")
+
+    row('total', [s['duration'] for s in summaries])
+    print(f"   {'status':<34}" + ''.join(f"{s['status']:>{width}}" for s in summaries))
+
+    phases = sorted({phase for s in summaries for phase in s['phases']})
+    if phases:
+        print(f"\n   Phases")
+        for phase in phases:
+            names = {s['phases'][phase].get('name') for s in summaries if phase in s['phases']} - {None}
+            label = f"{phase} {sorted(names)[0] if len(names) == 1 else ''}"
+            row(label, [s['phases'].get(phase, {}).get('duration') for s in summaries])
+
+    totals = [step_totals(s) for s in summaries]
+    labels = sorted({label for t in totals for label in t}, key=lambda l: -max(t.get(l, 0) for t in totals))
+    if labels:
+        print(f"\n   Steps")
+        for label in labels:
+            row(label, [t.get(label) for t in totals])
+
+
+def select_runs(runs, run_ids=None, last=None):
+    """Runs matching the given run id prefixes, or the last ones, oldest first"""
+    ids = [run_id for run_id in runs if run_id]
+    if run_ids:
+        ids = [run_id for run_id in ids if any(run_id.startswith(prefix) for prefix in run_ids)]
+    if last:
+        ids = ids[-last:]
+    return ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize and compare upgrade runs from the JSONL event log")
+    parser.add_argument('logs', nargs='*', default=[DEFAULT_EVENT_LOG],
+                        help=f"event log files (default: {DEFAULT_EVENT_LOG})")
+    parser.add_argument('--run', action='append', dest='runs', metavar='RUN_ID',
+                        help="report this run (a prefix of the run id is enough); can be repeated")
+    parser.add_argument('--last', type=int, default=None, help="report the last N runs (default: 1, 2 with --compare)")
+    parser.add_argument('--compare', action='store_true', help="show the selected runs side by side")
+    parser.add_argument('--json', action='store_true', help="print the run summaries as JSON")
+    args = parser.parse_args(argv)
+
+    runs = {}
+    for path in args.logs:
+        runs.update(load_runs(path))
+    last = args.last or (None if args.runs else 2 if args.compare else 1)
+    selected = select_runs(runs, args.runs, last)
+    if not selected:
+        print(f"❌ No matching runs in {', '.join(args.logs)}")
+        return False
+
+    summaries = sorted((summarize_run(run_id, runs[run_id]) for run_id in selected),
+                       key=lambda s: s['started_at'] or '')
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+        return True
+    if args.compare and len(summaries) > 1:
+        print_comparison(summaries)
+    else:
+        for summary in summaries:
+            print_run(summary)
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,159 @@
+"""
+Zero-copy upload engine for CyberController software images.
+
+Streams the multipart preamble and epilogue around the image body directly
+on a pooled session connection:
+
+- plain sockets hand the body to the kernel with sendfile(), so the image
+  never passes through Python
+- TLS sockets must encrypt in user space, so the body is read into one
+  reused buffer and sent from a memoryview without per-chunk allocations
+
+CPU and memory use stay flat regardless of image size. With an ImageHasher
+the body is hashed as it is sent (see image_digest.py).
+"""
+
+import os
+import ssl
+import uuid
+import http.client
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import requests
+from requests.cookies import extract_cookies_to_jar
+from requests.structures import CaseInsensitiveDict
+
+from image_digest import MappedImage
+from image_staging import advise_sequential
+
+# Size of one sendfile() call / TLS write
+BLOCK_SIZE = 8 * 1024 * 1024
+TLS_BUFFER_SIZE = 1024 * 1024
+
+
+def multipart_envelope(filename, field_name='Filedata', content_type='application/octet-stream'):
+    """Build the multipart preamble, epilogue and Content-Type header around a single file part"""
+    boundary = uuid.uuid4().hex
+    preamble = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n"
+        f"\r\n"
+    ).encode()
+    epilogue = f"\r\n--{boundary}--\r\n".encode()
+    return preamble, epilogue, f"multipart/form-data; boundary={boundary}"
+
+
+def _pooled_connection(session, prepared, timeout):
+    """Check a connection out of the session's adapter pool"""
+    adapter = session.get_adapter(prepared.url)
+    verify = session.verify
+    if hasattr(adapter, 'get_connection_with_tls_context'):
+        pool = adapter.get_connection_with_tls_context(prepared, verify)
+    else:
+        pool = adapter.get_connection(prepared.url)
+        adapter.cert_verify(pool, prepared.url, verify, None)
+    conn = pool._get_conn(timeout=timeout)
+    conn.timeout = timeout
+    return pool, conn
+
+
+def _send_body(sock, file, offset, count, on_progress=None, block_size=BLOCK_SIZE, hasher=None):
+    """Send count bytes of file starting at offset, feeding them to hasher if given"""
+    sent = 0
+    if isinstance(sock, ssl.SSLSocket):
+        buffer = bytearray(TLS_BUFFER_SIZE)
+        view = memoryview(buffer)
+        file.seek(offset)
+        while sent < count:
+            n = file.readinto(view[:min(TLS_BUFFER_SIZE, count - sent)])
+            if not n:
+                raise IOError(f"Image ended after {offset + sent:,} bytes")
+            sock.sendall(view[:n])
+            if hasher:
+                hasher.feed(offset + sent, view[:n])
+            sent += n
+            if on_progress:
+                on_progress(sent)
+    else:
+        mapped = MappedImage(file, hasher) if hasher else None
+        try:
+            while sent < count:
+                n = sock.sendfile(file, offset + sent, min(block_size, count - sent))
+                if not n:
+                    raise IOError(f"Image ended after {offset + sent:,} bytes")
+                if mapped:
+                    # The block was just read for sendfile(), so this hashes it from the page cache
+                    mapped.feed(offset + sent, n)
+                sent += n
+                if on_progress:
+                    on_progress(sent)
+        finally:
+            if mapped:
+                mapped.close()
+    return sent
+
+
+def upload_with_sendfile(session, url, upgrade_file, bytes_size, offset=0, headers=None,
+                         timeout=1800, on_progress=None, send_timeout=None, block_size=BLOCK_SIZE,
+                         on_socket=None, hasher=None):
+    """
+    Upload upgrade_file[offset:] as a multipart form field on a pooled session connection.
+    on_progress(bytes_sent) is called once per block with the bytes of this request sent so far;
+    an exception it raises aborts the upload and closes the connection.
+    send_timeout bounds how long a single send may make no progress (default: timeout).
+    on_socket(sock) is called once the request is about to be sent, e.g. so a watchdog can
+    shut the socket down to abort a blocked send.
+    hasher (an ImageHasher) is fed the body as it is sent.
+    Returns a requests.Response.
+    """
+    preamble, epilogue, content_type = multipart_envelope(os.path.basename(upgrade_file))
+    count = bytes_size - offset
+
+    request_headers = dict(headers or {})
+    request_headers['Content-Type'] = content_type
+    prepared = session.prepare_request(requests.Request('POST', url, headers=request_headers))
+    prepared.headers['Content-Length'] = str(len(preamble) + count + len(epilogue))
+    prepared.headers.pop('Accept-Encoding', None)
+
+    parsed = urlparse(prepared.url)
+    path = parsed.path + (f"?{parsed.query}" if parsed.query else '')
+
+    pool, conn = _pooled_connection(session, prepared, timeout)
+    reusable = False
+    try:
+        http.client.HTTPConnection.putrequest(conn, 'POST', path, skip_accept_encoding=True)
+        for name, value in prepared.headers.items():
+            conn.putheader(name, value)
+        conn.endheaders()
+
+        sock = conn.sock
+        if on_socket:
+            on_socket(sock)
+        sock.settimeout(send_timeout or timeout)
+        sock.sendall(preamble)
+        with open(upgrade_file, 'rb') as f:
+            advise_sequential(f, offset)
+            _send_body(sock, f, offset, count, on_progress, block_size, hasher)
+        sock.sendall(epilogue)
+
+        sock.settimeout(timeout)
+        raw = http.client.HTTPConnection.getresponse(conn)
+        body = raw.read()
+        reusable = not raw.will_close
+    finally:
+        if not reusable:
+            conn.close()
+        pool._put_conn(conn)
+
+    response = requests.Response()
+    response.status_code = raw.status
+    response.reason = raw.reason
+    response.headers = CaseInsensitiveDict(raw.getheaders())
+    response._content = body
+    response.url = prepared.url
+    response.request = prepared
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    extract_cookies_to_jar(session.cookies, prepared, SimpleNamespace(_original_response=raw))
+    return response